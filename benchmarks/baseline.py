@@ -0,0 +1,79 @@
+"""
+Saving benchmark results and comparing them against a saved baseline.
+"""
+import json
+import math
+import platform
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+
+def save(path: str, results: Dict[str, float]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> Dict[str, float]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def compare(
+    baseline: Dict[str, float],
+    results: Dict[str, float],
+    tolerance: float,
+) -> List[Tuple[str, float, float, float, bool]]:
+    # (metric, baseline, current, relative change, regressed) for the
+    # metrics in both; a change worse than `tolerance` (0.1 = 10%) regresses.
+    # From a zero baseline the change is infinite, and any growth of a
+    # metric that should stay small (like `failed`) regresses.
+    rows = []
+    for name, current in results.items():
+        if name not in baseline or not isinstance(current, (int, float)):
+            continue
+        before = baseline[name]
+        if before:
+            change = (current - before) / before
+        else:
+            change = math.copysign(math.inf, current) if current else 0.0
+        # Rates (*_per_s) are better bigger, everything else smaller
+        worse = -change if name.endswith('_per_s') else change
+        rows.append((name, before, current, change, worse > tolerance))
+    return rows
+
+
+def print_results(results: Dict[str, float]):
+    for name, value in results.items():
+        print(f'{name:>36}: {value:.2f}' if isinstance(value, float) else f'{name:>36}: {value}')
+
+
+def report(rows: Iterable[Tuple[str, float, float, float, bool]]) -> bool:
+    # Prints the comparison; True if nothing regressed
+    ok = True
+    for name, before, current, change, regressed in rows:
+        mark = 'REGRESSED' if regressed else ''
+        print(f'{name:>36}: {before:12.2f} -> {current:12.2f} ({change:+7.1%}) {mark}')
+        ok = ok and not regressed
+    return ok
+
+
+def add_arguments(parser):
+    parser.add_argument('--save', metavar='PATH', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression (default 0.1)')
+
+
+def finish(args, results: Dict[str, float]):
+    # Prints and saves or compares the results as the arguments ask; exits
+    # with 1 on a regression, so it can gate CI
+    print_results(results)
+    if args.save:
+        save(args.save, results)
+    if args.compare:
+        print(f'\nCompared with {args.compare}:')
+        if not report(compare(load(args.compare), results, args.tolerance)):
+            sys.exit(1)
@@ -0,0 +1,79 @@
+"""
+Loop CPU and wake-up latency of ClientAction.wait() with many parked actions.
+
+    python -m benchmarks.client_action_wait [--actions 10000] [--idle 1.0] [--legacy]
+
+--legacy runs the same scenario against the old sleep(0) polling wait().
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict
+from uuid import uuid4
+
+from dno.client_action import ClientAction, Status
+
+
+class PollingClientAction(ClientAction):
+    __slots__ = ()
+
+    async def wait(self):
+        while not self.is_finished():
+            await asyncio.sleep(0)
+
+
+async def waiter(client_action: ClientAction, woken: Dict[str, float]):
+    await client_action.wait()
+    woken[client_action.id] = time.perf_counter()
+
+
+async def bench(actions: int, idle: float, legacy: bool):
+    cls = PollingClientAction if legacy else ClientAction
+    client_actions = [cls('bench', uuid4().hex, {}, Status.PENDING) for _ in range(actions)]
+    woken = {}
+    tasks = [asyncio.ensure_future(waiter(ca, woken)) for ca in client_actions]
+    await asyncio.sleep(0)
+
+    # Idle phase: every action is parked, nothing is finished
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    await asyncio.sleep(idle)
+    idle_cpu = time.process_time() - cpu_start
+    idle_wall = time.perf_counter() - wall_start
+
+    # Wake-up phase: finish actions one at a time while the rest stay parked,
+    # and measure how long until the waiter of that action runs
+    latencies = []
+    for ca, task in zip(client_actions, tasks):
+        ca.set_running()
+        ca.set_result({})
+        finished_at = time.perf_counter()
+        await task
+        latencies.append((woken[ca.id] - finished_at) * 1e6)
+    latencies.sort()
+
+    return {
+        'actions': actions,
+        'idle_cpu_percent': 100 * idle_cpu / idle_wall,
+        'wake_p50_us': statistics.median(latencies),
+        'wake_p99_us': latencies[int(len(latencies) * 0.99) - 1],
+        'wake_max_us': latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--actions', type=int, default=10000)
+    parser.add_argument('--idle', type=float, default=1.0)
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    result = asyncio.get_event_loop().run_until_complete(bench(args.actions, args.idle, args.legacy))
+    print('wait() implementation:', 'legacy sleep(0) polling' if args.legacy else 'future')
+    for k, v in result.items():
+        print(f'{k:>18}: {v:.1f}' if isinstance(v, float) else f'{k:>18}: {v}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+End-to-end load: CreateServer use cases from submit to completion.
+
+    python -m benchmarks.load [--tasks 2000] [--concurrency 200] [--workers 8]
+                              [--claim 100] [--work-ms 0] [--save PATH] [--compare PATH]
+
+Serves app_factory(['test_app']) on a local port. Submitters POST
+CreateServer calls, at most --concurrency in flight, and a fleet of
+--workers simulated workers claims client actions in batches of --claim
+and answers them through /client_action/batch after --work-ms. Reports
+throughput, p50/p99 submit-to-completion latency, event loop lag and peak
+RSS; --save and --compare keep and check a baseline (see
+benchmarks.baseline).
+"""
+import argparse
+import asyncio
+import resource
+import statistics
+import time
+from typing import Dict, List
+from uuid import uuid4
+
+from aiohttp import ClientSession, web
+
+from dno import use_case
+from dno.app import app_factory
+
+from . import baseline
+
+
+CREATE_SERVER_ARGS = {'name': 'server', 'cpu': 2, 'memory': 2048, 'hdd': 20}
+
+VC = {'cpu_available': 64, 'memory_available': 1 << 20, 'hdd_available': 1 << 20, 'cpu': 64, 'memory': 1 << 20, 'hdd': 1 << 20}
+
+
+def answer(client_action: Dict) -> Dict:
+    # What a worker of test_app would send back for the action
+    name = client_action['name']
+    if name == 'Get VC list':
+        return {'result': [VC]}
+    if name == 'Create Virtual Machine':
+        return {'id': uuid4().hex}
+    if name == 'Install operation system on VM':
+        return {
+            'id': client_action['args']['id'],
+            'os': 'LINUX',
+            'username': 'root',
+            'password': 'secret',
+            'ip': '10.0.0.1',
+        }
+    raise ValueError(f'Unknown client action {name}')
+
+
+async def worker(session: ClientSession, url: str, claim: int, work: float, stop: asyncio.Event):
+    while not stop.is_set():
+        async with session.post(f'{url}/client_action/claim', json={'limit': claim}) as resp:
+            claimed = await resp.json()
+        if not claimed['client_actions']:
+            await asyncio.sleep(0.005)
+            continue
+        if work:
+            await asyncio.sleep(work)
+        items = [
+            {'id': ca['id'], 'lease': claimed['lease'], 'result': answer(ca)}
+            for ca in claimed['client_actions']
+        ]
+        async with session.post(f'{url}/client_action/batch', json=items) as resp:
+            await resp.read()
+
+
+async def loop_lag(lags: List[float], stop: asyncio.Event, interval: float = 0.01):
+    # How much later than asked a sleep wakes up
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def bench(tasks: int, concurrency: int, workers: int, claim: int, work: float) -> Dict[str, float]:
+    runner = web.AppRunner(await app_factory(['test_app']))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = 'http://127.0.0.1:%d' % runner.addresses[0][1]
+
+    # Task id -> completion, set by the use case itself in this process
+    finished: Dict[str, asyncio.Future] = {}
+
+    def on_change(uc: use_case.UseCase):
+        if uc.is_finished() and uc.id in finished and not finished[uc.id].done():
+            finished[uc.id].set_result(uc.status)
+
+    use_case.LISTENERS.append(on_change)
+
+    latencies = []
+    failed = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def submit(session: ClientSession):
+        nonlocal failed
+        async with slots:
+            started = time.perf_counter()
+            async with session.post(f'{url}/test_app/call/CreateServer', json=CREATE_SERVER_ARGS) as resp:
+                task_id = (await resp.json())['id']
+            future = finished.setdefault(task_id, asyncio.get_event_loop().create_future())
+            # The use case may have finished before its id came back
+            uc = use_case.RUNNING_TASKS.get(task_id)
+            if uc is not None and uc.is_finished() and not future.done():
+                future.set_result(uc.status)
+            if await future != use_case.Status.FINISHED:
+                failed += 1
+            latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    lags = []
+    try:
+        async with ClientSession() as session:
+            fleet = [asyncio.ensure_future(worker(session, url, claim, work, stop)) for _ in range(workers)]
+            lag = asyncio.ensure_future(loop_lag(lags, stop))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(submit(session) for _ in range(tasks)))
+            elapsed = time.perf_counter() - started
+
+            stop.set()
+            await asyncio.gather(*fleet, lag)
+    finally:
+        use_case.LISTENERS.remove(on_change)
+        await runner.cleanup()
+
+    latencies.sort()
+    lags.sort()
+    return {
+        'tasks': tasks,
+        'failed': failed,
+        'throughput_per_s': tasks / elapsed,
+        'latency_p50_ms': statistics.median(latencies) * 1e3,
+        'latency_p99_ms': latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1e3,
+        'loop_lag_p99_ms': lags[max(0, int(len(lags) * 0.99) - 1)] * 1e3 if lags else 0.0,
+        'loop_lag_max_ms': lags[-1] * 1e3 if lags else 0.0,
+        # KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--claim', type=int, default=100)
+    parser.add_argument('--work-ms', type=float, default=0.0)
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(
+        bench(args.tasks, args.concurrency, args.workers, args.claim, args.work_ms / 1000)
+    )
+    baseline.finish(args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Microbenchmarks of the hot paths: UseCase.__init__, ClientActionField calls
+and Storage.
+
+    python -m benchmarks.micro [--number 20000] [--repeat 3] [--sqlite PATH] [--save PATH] [--compare PATH]
+
+Storage is measured on the in-memory backend, and also on SQLiteStorage
+with --sqlite (the file is created, and removed afterwards). Adds run
+--concurrency at a time, as client actions of concurrent use cases do.
+Every metric is the best of --repeat runs, which keeps the noise of a busy
+machine out of comparisons. --save and --compare keep and check a baseline
+(see benchmarks.baseline).
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List
+from uuid import uuid4
+
+from dno.client_action import ClientAction, MemoryStorage, Status, Storage, StorageBackend
+from dno.sqlite_storage import SQLiteStorage
+
+from . import baseline
+from .validation import KWARGS, Bench, field_call_us, per_call_us
+
+
+async def storage_us(backend: StorageBackend, number: int, concurrency: int) -> Dict[str, float]:
+    previous = Storage.set_backend(backend)
+    try:
+        client_actions: List[ClientAction] = [
+            ClientAction('bench', uuid4().hex, KWARGS, Status.PENDING) for _ in range(number)
+        ]
+
+        start = time.perf_counter()
+        for i in range(0, number, concurrency):
+            await asyncio.gather(*(Storage.add(ca) for ca in client_actions[i:i + concurrency]))
+        add = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for ca in client_actions:
+            await Storage.get(ca.id)
+        get = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for ca in client_actions:
+            ca.set_running()
+        update = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await Storage.find(status=Status.RUNNING, name='bench', limit=100)
+        find = time.perf_counter() - start
+    finally:
+        Storage.set_backend(previous)
+
+    return {
+        'add_us': add / number * 1e6,
+        'get_us': get / number * 1e6,
+        'update_us': update / number * 1e6,
+        'find_100_us': find * 1e6,
+    }
+
+
+async def bench(number: int, concurrency: int, sqlite: str) -> Dict[str, float]:
+    results = {
+        'use_case_init_us': per_call_us(lambda: Bench(**KWARGS), number),
+        'client_action_field_call_us': await field_call_us(number),
+    }
+    for name, us in (await storage_us(MemoryStorage(), number, concurrency)).items():
+        results[f'memory_storage_{name}'] = us
+
+    if sqlite:
+        backend = SQLiteStorage(sqlite)
+        try:
+            for name, us in (await storage_us(backend, number, concurrency)).items():
+                results[f'sqlite_storage_{name}'] = us
+        finally:
+            await backend.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(sqlite + suffix):
+                    os.remove(sqlite + suffix)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--sqlite', metavar='PATH')
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    runs = [loop.run_until_complete(bench(args.number, args.concurrency, args.sqlite)) for _ in range(args.repeat)]
+    baseline.finish(args, {name: min(run[name] for run in runs) for name in runs[0]})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Per-call argument validation: UseCase.__init__ and ClientActionField calls.
+
+    python -m benchmarks.validation [--number 20000]
+
+Compares the validators compiled once per class/field with the previous
+per-call implementation (annotation walk with isinstance checks for use
+cases, a pydantic model instance per client action call).
+"""
+import argparse
+import asyncio
+import time
+from typing import Callable
+from uuid import uuid4
+
+from pydantic import BaseModel
+
+from dno.client_action import ClientActionField
+from dno.use_case import UseCase
+
+
+class Args(BaseModel):
+    name: str
+    cpu: int
+    memory: int
+    hdd: int
+
+
+class Result(BaseModel):
+    id: str
+
+
+class Bench(UseCase):
+    name: str
+    cpu: int
+    memory: int
+    hdd: int
+
+    result: Result
+
+    create_vm = ClientActionField(name='Create Virtual Machine', args=Args, result=Result)
+
+    async def run(self):
+        pass
+
+
+KWARGS = {'name': 'server', 'cpu': 2, 'memory': 2048, 'hdd': 20}
+
+
+def legacy_use_case_validation(self, kwargs):
+    annotations = set(self.__annotations__.keys())
+    for k, v in kwargs.items():
+        type_ = self.__annotations__[k]
+        if not isinstance(v, type_):
+            raise RuntimeError(f'Value "{v}" is not instance of class {type_}')
+        setattr(self, k, v)
+        annotations.remove(k)
+
+    annotations -= {'id', 'status', 'result', 'error'}
+    if annotations:
+        raise RuntimeError(annotations)
+
+
+def legacy_use_case_init(self, **kwargs):
+    legacy_use_case_validation(self, kwargs)
+    self.id = uuid4().hex
+    self.client_actions = {}
+
+
+def legacy_field_validation(field: ClientActionField, kwargs):
+    field.args_instance = field.args(**kwargs)
+
+
+def per_call_us(func: Callable[[], None], number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+async def field_call_us(number: int) -> float:
+    field = Bench.create_vm
+    start = time.perf_counter()
+    for _ in range(number):
+        await field(**KWARGS)
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    field = Bench.create_vm
+    legacy = Bench.__new__(Bench)
+    results = {
+        'UseCase validation (legacy)': per_call_us(lambda: legacy_use_case_validation(legacy, KWARGS), args.number),
+        'UseCase validation (compiled)': per_call_us(lambda: Bench._validate_arguments(KWARGS), args.number),
+        'UseCase.__init__ (legacy)': per_call_us(lambda: legacy_use_case_init(legacy, **KWARGS), args.number),
+        'UseCase.__init__ (compiled)': per_call_us(lambda: Bench(**KWARGS), args.number),
+        'field validation (legacy)': per_call_us(lambda: legacy_field_validation(field, KWARGS), args.number),
+        'field validation (compiled)': per_call_us(lambda: field._validate_args(KWARGS), args.number),
+        'ClientActionField.__call__': asyncio.get_event_loop().run_until_complete(field_call_us(args.number)),
+    }
+    for name, us in results.items():
+        print(f'{name:>31}: {us:.2f} us/call')
+
+
+if __name__ == '__main__':
+    main()
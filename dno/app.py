@@ -1,96 +1,783 @@
+import asyncio
 import importlib
+import inspect
+import json
+import logging
+import math
 import sys
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
 
 from aiohttp import web
+from pydantic import ValidationError
 
-from .use_case import REGISTERED
+from .client_action import ClientAction, ClientActionField, Status, Storage, StorageBackend, UnexpectedStatus
+from .dispatch import DISPATCHER, LeaseExpired
+from .encoding import StaticJSONResponse, dumps, encode, json_response, loads
+from .events import TASK_CLIENT_ACTIONS
+from .idempotency import IdempotencyIndex, arguments_key
+from .journal import Journal
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS, metrics_middleware
+from .push import PUSHER, Endpoint
+from .rate_limit import RateLimiter
+from .retention import Retention
+from .scheduler import QueueFull, Scheduler
+from .task_index import TASK_INDEX
+from .tracing import TRACER, SpanExporter, tracing_middleware
+from .use_case import REGISTERED, RUNNING_TASKS, Status as UseCaseStatus, UseCase
+from .watchdog import Watchdog
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bound for ?wait= of a long-polling get_client_action
+MAX_LONG_POLL = 60.0
+
+# Comment line sent to an idle client action stream to keep the connection open
+STREAM_HEARTBEAT = 15.0
+
+# Limits of POST /client_action/claim
+MAX_CLAIM = 1000
+DEFAULT_LEASE = 60.0
+MAX_LEASE = 3600.0
+
+# Lines of a POST /{app}/call/{use_case}/batch response written at once
+BATCH_RESPONSE_LINES = 100
+
+# Page size of GET /{app}/task
+DEFAULT_TASK_PAGE = 100
+MAX_TASK_PAGE = 1000
+
+# Settings of a push endpoint a POST /client_action/push may give
+PUSH_OPTIONS = {
+    'batch_size': int,
+    'window': float,
+    'concurrency': int,
+    'retries': int,
+    'backoff': float,
+    'max_backoff': float,
+    'lease': float,
+}
+
+# How often expired leases are given back to the PENDING queue
+LEASE_CHECK_INTERVAL = 1.0
 
 
 async def get_apps(request):
-    return web.json_response(request.app['APPS'])
+    return request.app['APPS_RESPONSE'](request)
+
+
+async def get_metrics(request):
+    domain_apps = request.app['DOMAIN_APPS'].values()
+    body = METRICS.render([
+        (
+            'dno_scheduler_queued',
+            'Use cases waiting in the scheduler queue',
+            [({'app': domain_app.name}, domain_app.scheduler.queue_depth()) for domain_app in domain_apps],
+        ),
+        (
+            'dno_scheduler_running',
+            'Use cases running in the scheduler',
+            [({'app': domain_app.name}, domain_app.scheduler.running()) for domain_app in domain_apps],
+        ),
+        ('dno_dispatch_pending', 'PENDING client actions waiting to be claimed', [({}, DISPATCHER.pending_count())]),
+    ])
+    return web.Response(body=body.encode(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+
+async def get_watchdog(request):
+    # Recent stalls of the event loop, oldest first
+    return json_response([stall.as_dict() for stall in request.app['WATCHDOG'].stalls])
+
+
+async def read_json(request):
+    try:
+        return await request.json(loads=loads)
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(reason='Body is not JSON')
+
+
+async def claim_client_actions(request):
+    # Moves up to "limit" PENDING client actions of any task to RUNNING
+    # under one lease of "lease" seconds
+    data = await read_json(request)
+    if not isinstance(data, dict):
+        raise web.HTTPBadRequest(reason='Body must be an object')
+    try:
+        limit = int(data.get('limit', 1))
+        lease_time = float(data.get('lease', DEFAULT_LEASE))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason='limit and lease must be numbers')
+    if not 0 < limit <= MAX_CLAIM:
+        raise web.HTTPBadRequest(reason=f'limit must be in 1..{MAX_CLAIM}')
+    if not 0 < lease_time <= MAX_LEASE:
+        raise web.HTTPBadRequest(reason=f'lease must be in (0, {MAX_LEASE}]')
+    names = data.get('names')
+    if names is not None and (not isinstance(names, list) or not all(isinstance(name, str) for name in names)):
+        raise web.HTTPBadRequest(reason='names must be a list of strings')
+
+    lease, claimed = DISPATCHER.claim(limit, lease_time, names)
+    return json_response({
+        'lease': lease.id,
+        'expires_in': lease_time,
+        'client_actions': claimed,
+    })
+
+
+async def post_client_action_batch(request):
+    # A list of {"id", "result"} or {"id", "error"}, optionally with the
+    # "lease" they were claimed under. Every item is applied on its own.
+    items = await read_json(request)
+    if not isinstance(items, list):
+        raise web.HTTPBadRequest(reason='Body must be a list')
+
+    retention = request.app['RETENTION']
+    outcomes = []
+    for item in items:
+        if not isinstance(item, dict) or 'id' not in item:
+            outcomes.append({'id': None, 'error': 'No id'})
+            continue
+        id = item['id']
+        try:
+            client_action = await Storage.get(id)
+            DISPATCHER.check_lease(client_action, item.get('lease'))
+            if 'error' in item:
+                client_action.set_error(item['error'])
+            else:
+                client_action.set_result(item.get('result'))
+        except KeyError:
+            # Evicted with its finished task, maybe
+            archived = await retention.get_archived('client_action', id) if retention is not None else None
+            if archived is not None:
+                outcomes.append({'id': id, 'error': f'Client action was evicted as {archived["status"]}'})
+            else:
+                outcomes.append({'id': id, 'error': 'Not found'})
+        except LeaseExpired:
+            outcomes.append({'id': id, 'error': 'Lease expired'})
+        except UnexpectedStatus as e:
+            outcomes.append({'id': id, 'error': f'Client action is {e.args[0].value}'})
+        else:
+            outcomes.append({'id': id, 'status': client_action.status.value})
+    return json_response(outcomes)
+
+
+async def get_push_endpoints(request):  # NOQA
+    return json_response([endpoint.as_dict() for endpoint in PUSHER.endpoints()])
+
+
+async def post_push_endpoint(request):
+    # {"url", "names"} and the optional Endpoint settings; replaces the
+    # endpoints of those names
+    data = await read_json(request)
+    if not isinstance(data, dict) or not isinstance(data.get('url'), str):
+        raise web.HTTPBadRequest(reason='url is required')
+    names = data.get('names')
+    if not isinstance(names, list) or not names or not all(isinstance(name, str) for name in names):
+        raise web.HTTPBadRequest(reason='names must be a non-empty list of strings')
+    options = {}
+    for key, type_ in PUSH_OPTIONS.items():
+        if key not in data:
+            continue
+        try:
+            options[key] = type_(data[key])
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(reason=f'{key} must be a number')
+        if options[key] < 0 or (options[key] == 0 and key != 'retries'):
+            raise web.HTTPBadRequest(reason=f'{key} must be positive')
+    endpoint = Endpoint(data['url'], names, **options)
+    PUSHER.register(endpoint)
+    return json_response(endpoint.as_dict())
+
+
+async def delete_push_endpoint(request):
+    if not PUSHER.unregister(request.query.get('url', '')):
+        raise web.HTTPNotFound(reason='No such endpoint')
+    return web.Response(status=web.HTTPNoContent.status_code)
+
+
+async def release_expired_leases(app):
+    async def release():
+        while True:
+            await asyncio.sleep(LEASE_CHECK_INTERVAL)
+            DISPATCHER.release_expired()
+
+    task = asyncio.ensure_future(release())
+    yield
+    task.cancel()
+
+
+async def use_storage(app):
+    # Client actions are kept in app['STORAGE'] while the app runs
+    backend = app['STORAGE']
+    previous = Storage.set_backend(backend)
+    yield
+    Storage.set_backend(previous)
+    await backend.close()
 
 
 class DomainApp:
-    def __init__(self, name):
+    def __init__(self, name, scheduler: Optional[Scheduler] = None):
         self.name = name
+        self.scheduler = scheduler or Scheduler()
+        self.models = None
+        self.use_cases = None
+        self.use_case_classes = REGISTERED.setdefault(self.name, {})
+        self.load_times: Dict[str, float] = {}
+        self._use_case_list = None
+        # Use case name -> its JSON schema, serialized once
+        self._use_case_schemas: Dict[str, StaticJSONResponse] = {}
+        self._loading: Optional[asyncio.Future] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.use_cases is not None
+
+    def load(self):
+        # Imports {app}.models and {app}.use_cases; safe to run in a thread
+        started = time.perf_counter()
         self.models = importlib.import_module(f'{self.name}.models')
-        self.use_cases = importlib.import_module(f'{self.name}.use_cases')
+        models_loaded = time.perf_counter()
+        use_cases = importlib.import_module(f'{self.name}.use_cases')
+        use_cases_loaded = time.perf_counter()
 
-    async def get_use_case_list(self, request):  # NOQA
-        return web.json_response(
-            list(REGISTERED.keys())
+        # Use cases of this app only change when its modules are imported
+        self._use_case_list = StaticJSONResponse(list(self.use_case_classes))
+        self._use_case_schemas = {
+            name: StaticJSONResponse(cls.json_schema) for name, cls in self.use_case_classes.items()
+        }
+        self.use_cases = use_cases
+
+        self.load_times = {
+            'models': models_loaded - started,
+            'use_cases': use_cases_loaded - models_loaded,
+            'total': use_cases_loaded - started,
+        }
+        logger.info(
+            'Loaded %r in %.3fs (models %.3fs, use_cases %.3fs)',
+            self, self.load_times['total'], self.load_times['models'], self.load_times['use_cases'],
         )
 
+    async def ensure_loaded(self):
+        if self.loaded:
+            return
+        # Concurrent first requests share one import in a thread
+        if self._loading is None:
+            self._loading = asyncio.get_event_loop().run_in_executor(None, self.load)
+        await asyncio.shield(self._loading)
+
+    def when_loaded(self, handler):
+        @wraps(handler)
+        async def wrapper(request):
+            await self.ensure_loaded()
+            return await handler(request)
+
+        return wrapper
+
+    async def get_use_case_list(self, request):  # NOQA
+        return self._use_case_list(request)
+
     async def post_use_case(self, request):
         use_case = request.match_info.get('use_case')
-        if use_case not in REGISTERED:
+        if use_case not in self.use_case_classes:
+            raise web.HTTPNotFound(reason=f'No use case {use_case}')
+        kwargs = await read_json(request) if request.body_exists else {}
+        if not isinstance(kwargs, dict):
+            raise web.HTTPBadRequest(reason='Body must be an object')
+        try:
+            priority = int(request.query['priority']) if 'priority' in request.query else None
+        except ValueError:
+            raise web.HTTPBadRequest(reason='priority must be an integer')
+        timeout = self._get_timeout(request)
+        idempotency = request.app['IDEMPOTENCY']
+        cls = self.use_case_classes[use_case]
+
+        try:
+            key = self._idempotency_key(cls, kwargs, request.headers.get('Idempotency-Key'))
+            if key is not None:
+                id = idempotency.get(key)
+                if id is not None:
+                    return json_response({'id': id}, headers={'Idempotent-Replayed': 'true'})
+            instance = cls(**kwargs)
+        except ValidationError as e:
+            raise web.HTTPBadRequest(text=dumps(e.errors()), content_type='application/json')
+        if key is not None:
+            # Before start(), which may let a concurrent retry in
+            idempotency.add(key, instance.id)
+        try:
+            await instance.start(self.scheduler, priority, timeout)
+        except QueueFull as e:
+            if key is not None:
+                idempotency.discard(key, instance.id)
+            raise web.HTTPServiceUnavailable(
+                reason='Too many use cases queued',
+                headers={'Retry-After': str(e.retry_after)},
+            )
+        return json_response({'id': instance.id})
+
+    async def post_use_case_batch(self, request):
+        # Newline-delimited JSON: one object of arguments per line in, one
+        # line per item out, in order: {"line": n, "id": ...} once started,
+        # or {"line": n, "error": ...}. Both sides are streamed, so the
+        # number of items is not limited by memory.
+        use_case = request.match_info.get('use_case')
+        cls = self.use_case_classes.get(use_case)
+        if cls is None:
             raise web.HTTPNotFound(reason=f'No use case {use_case}')
-        raise NotImplementedError(use_case)
+        try:
+            priority = int(request.query['priority']) if 'priority' in request.query else None
+        except ValueError:
+            raise web.HTTPBadRequest(reason='priority must be an integer')
+
+        idempotency = request.app['IDEMPOTENCY']
+        rate_limiter = request.app['RATE_LIMITER']
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        lines = []
+        number = 0
+        while True:
+            try:
+                line = await request.content.readline()
+            except ValueError:
+                # Longer than the read buffer; the rest of the body is lost
+                lines.append(encode({'line': number + 1, 'error': 'Line is too long'}))
+                break
+            if not line:
+                break
+            number += 1
+            if line.strip():
+                # Each item is charged like a submission of its own
+                wait = rate_limiter.charge(request) if rate_limiter is not None else 0.0
+                if wait:
+                    item = {'line': number, 'error': 'Rate limit exceeded', 'retry_after': max(1, math.ceil(wait))}
+                else:
+                    item = await self._start_batch_item(cls, line, number, priority, idempotency)
+                lines.append(encode(item))
+            if len(lines) >= BATCH_RESPONSE_LINES:
+                await response.write(b'\n'.join(lines) + b'\n')
+                lines = []
+        if lines:
+            await response.write(b'\n'.join(lines) + b'\n')
+        await response.write_eof()
+        return response
+
+    async def _start_batch_item(
+        self,
+        cls,
+        line: bytes,
+        number: int,
+        priority: Optional[int],
+        idempotency: IdempotencyIndex,
+    ):
+        # Deduplicated by arguments only, if the use case asks for it
+        try:
+            kwargs = loads(line)
+        except ValueError:
+            return {'line': number, 'error': 'Not JSON'}
+        if not isinstance(kwargs, dict):
+            return {'line': number, 'error': 'Not an object'}
+        try:
+            key = self._idempotency_key(cls, kwargs, None)
+            if key is not None:
+                id = idempotency.get(key)
+                if id is not None:
+                    return {'line': number, 'id': id, 'replayed': True}
+            instance = cls(**kwargs)
+        except ValidationError as e:
+            return {'line': number, 'error': e.errors()}
+        if key is not None:
+            idempotency.add(key, instance.id)
+        try:
+            await instance.start(self.scheduler, priority)
+        except QueueFull as e:
+            if key is not None:
+                idempotency.discard(key, instance.id)
+            return {'line': number, 'error': 'Too many use cases queued', 'retry_after': e.retry_after}
+        return {'line': number, 'id': instance.id}
+
+    def _idempotency_key(self, cls, kwargs: Dict, header: Optional[str]) -> Optional[Tuple[str, str, str]]:
+        # The Idempotency-Key header, or the hash of the validated arguments
+        # of a deduplicate use case; None if neither. Scoped by use case.
+        if header is not None:
+            return (self.name, cls.__name__, header)
+        if cls.deduplicate:
+            # Raises ValidationError like the constructor
+            return (self.name, cls.__name__, arguments_key(cls._validate_arguments(kwargs)))
+        return None
 
     async def get_use_case(self, request):
+        # Schemas of the arguments, the result and the client actions, with
+        # an ETag for If-None-Match
         use_case = request.match_info.get('use_case')
-        raise NotImplementedError(use_case)
+        response = self._use_case_schemas.get(use_case)
+        if response is None:
+            cls = self.use_case_classes.get(use_case)
+            if cls is None:
+                raise web.HTTPNotFound(reason=f'No use case {use_case}')
+            # Registered after the app was loaded
+            response = self._use_case_schemas[use_case] = StaticJSONResponse(cls.json_schema)
+        return response(request)
 
     async def get_task_list(self, request):
-        raise NotImplementedError
+        # Task id -> use case, status and creation time, newest first. The
+        # X-Next-Cursor header is set when there may be more tasks: pass it
+        # as ?cursor= to get them.
+        query = request.query
+        try:
+            status = UseCaseStatus(query['status']) if 'status' in query else None
+        except ValueError:
+            raise web.HTTPBadRequest(reason=f'Unknown status {query["status"]}')
+        try:
+            limit = int(query.get('limit', DEFAULT_TASK_PAGE))
+            cursor = int(query['cursor']) if 'cursor' in query else None
+            created_after = float(query['created_after']) if 'created_after' in query else None
+            created_before = float(query['created_before']) if 'created_before' in query else None
+        except ValueError:
+            raise web.HTTPBadRequest(reason='limit, cursor, created_after and created_before must be numbers')
+        if not 0 < limit <= MAX_TASK_PAGE:
+            raise web.HTTPBadRequest(reason=f'limit must be in 1..{MAX_TASK_PAGE}')
+
+        task_ids, next_cursor = TASK_INDEX.query(
+            self.name,
+            use_case=query.get('use_case'),
+            status=status,
+            created_after=created_after,
+            created_before=created_before,
+            cursor=cursor,
+            limit=limit,
+        )
+        headers = {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else None
+        return json_response({task_id: TASK_INDEX.get(task_id).as_dict() for task_id in task_ids}, headers=headers)
 
     async def get_task(self, request):
         task_id = request.match_info.get('task_id')
-        raise NotImplementedError(task_id)
+        retention = request.app['RETENTION']
+        if task_id not in RUNNING_TASKS and retention is not None:
+            task = await retention.get_archived('task', task_id)
+            if task is not None and task['use_case'] in self.use_case_classes:
+                return json_response(task)
+
+        use_case = self._get_running_task(request)
+        if retention is not None:
+            retention.touch(task_id)
+        return json_response(use_case.as_dict())
+
+    async def cancel_task(self, request):
+        use_case = self._get_running_task(request)
+        if not use_case.cancel():
+            raise web.HTTPConflict(reason=f'Task is {use_case.status.value}')
+        return json_response(use_case.as_dict())
+
+    async def get_scheduler(self, request):  # NOQA
+        return json_response(self.scheduler.stats())
+
+    async def get_cache(self, request):  # NOQA
+        # Counters of the cacheable client action fields of the use cases
+        stats = {}
+        for name, cls in self.use_case_classes.items():
+            for attr in dir(cls):
+                field = inspect.getattr_static(cls, attr)
+                if isinstance(field, ClientActionField) and field.cache_ttl is not None:
+                    stats[f'{name}.{attr}'] = field.cache_stats()
+        return json_response(stats)
 
     async def post_client_action(self, request):
-        task_id = request.match_info.get('task_id')
-        raise NotImplementedError(task_id)
+        use_case = self._get_running_task(request)
+        data = await read_json(request)
+        if not isinstance(data, dict) or 'id' not in data or 'status' not in data:
+            raise web.HTTPBadRequest(reason='Body must be an object with id and status')
+
+        client_action = use_case.client_actions.get(data['id'])
+        if client_action is None:
+            raise web.HTTPNotFound(reason=f'No client action {data["id"]}')
+        try:
+            status = Status(data['status'])
+        except ValueError:
+            raise web.HTTPBadRequest(reason=f'Bad status {data["status"]}')
+
+        try:
+            if status != Status.RUNNING:
+                DISPATCHER.check_lease(client_action, data.get('lease'))
+            if status == Status.RUNNING:
+                client_action.set_running()
+            elif status == Status.DONE:
+                client_action.set_result(data.get('result'))
+            elif status == Status.ERROR:
+                client_action.set_error(data.get('error'))
+            else:
+                raise web.HTTPBadRequest(reason=f'Can\'t set status {status.value}')
+        except UnexpectedStatus:
+            raise web.HTTPConflict(reason=f'Client action {client_action.id} is {client_action.status.value}')
+        except LeaseExpired:
+            raise web.HTTPConflict(reason=f'Lease of client action {client_action.id} expired')
+        return json_response(client_action)
 
     async def get_client_action(self, request):
+        # ?status= filters the list, ?wait=N holds the request up to N seconds
+        # while the filtered list is empty (long polling), or until the task
+        # finishes. Without ?status, any client action the task already has
+        # is returned at once, so to wait for a new one, ask for
+        # ?status=PENDING.
+        use_case = self._get_running_task(request)
+        status = self._get_status(request)
+        try:
+            wait = min(float(request.query.get('wait', 0)), MAX_LONG_POLL)
+        except ValueError:
+            raise web.HTTPBadRequest(reason='wait must be a number')
+
+        # Subscribe before reading, so nothing created in between is missed
+        with TASK_CLIENT_ACTIONS.subscribe(use_case.id) as queue:
+            client_actions = self._filter_client_actions(use_case, status)
+            if not client_actions and wait > 0 and not use_case.is_finished():
+                try:
+                    await asyncio.wait_for(self._wait_client_action(queue, status), wait)
+                except asyncio.TimeoutError:
+                    pass
+                client_actions = self._filter_client_actions(use_case, status)
+
+        return json_response(client_actions)
+
+    async def stream_client_action(self, request):
+        # Server-sent events: every client action of the task, then every
+        # new client action and status transition as it happens, until a
+        # final "task" event once the task has finished
+        use_case = self._get_running_task(request)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+        })
+
+        with TASK_CLIENT_ACTIONS.subscribe(use_case.id) as queue:
+            await response.prepare(request)
+            for client_action in list(use_case.client_actions.values()):
+                await response.write(self._client_action_event(client_action))
+
+            finished = use_case.is_finished()
+            while not finished:
+                try:
+                    item = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    await response.write(b': heartbeat\n\n')
+                    continue
+                finished = isinstance(item, UseCase)
+                if not finished:
+                    await response.write(self._client_action_event(item))
+            await response.write(self._task_event(use_case))
+        await response.write_eof()
+        return response
+
+    def _get_running_task(self, request) -> UseCase:
         task_id = request.match_info.get('task_id')
-        raise NotImplementedError(task_id)
+        use_case = RUNNING_TASKS.get(task_id)
+        if use_case is None or use_case.domain_app != self.name:
+            raise web.HTTPNotFound(reason=f'No task {task_id}')
+        return use_case
+
+    @staticmethod
+    def _get_timeout(request) -> Optional[float]:
+        if 'timeout' not in request.query:
+            return None
+        try:
+            timeout = float(request.query['timeout'])
+        except ValueError:
+            timeout = 0
+        if not timeout > 0:
+            raise web.HTTPBadRequest(reason='timeout must be a positive number')
+        return timeout
+
+    @staticmethod
+    def _get_status(request) -> Optional[Status]:
+        status = request.query.get('status')
+        if status is None:
+            return None
+        try:
+            return Status(status)
+        except ValueError:
+            raise web.HTTPBadRequest(reason=f'Bad status {status}')
+
+    @staticmethod
+    def _filter_client_actions(use_case: UseCase, status: Optional[Status]) -> List[ClientAction]:
+        return [
+            ca for ca in use_case.client_actions.values()
+            if status is None or ca.status == status
+        ]
+
+    @staticmethod
+    async def _wait_client_action(queue: asyncio.Queue, status: Optional[Status]):
+        while True:
+            item = await queue.get()
+            if isinstance(item, UseCase):
+                # The task finished, no more client actions will come
+                return
+            if status is None or item.status == status:
+                return
+
+    @staticmethod
+    def _client_action_event(client_action: ClientAction) -> bytes:
+        return b'id: %s\nevent: %s\ndata: %s\n\n' % (
+            client_action.id.encode(),
+            client_action.status.value.encode(),
+            encode(client_action),
+        )
+
+    @staticmethod
+    def _task_event(use_case: UseCase) -> bytes:
+        return b'id: %s\nevent: task\ndata: %s\n\n' % (use_case.id.encode(), encode(use_case.as_dict()))
 
     def __repr__(self):
         return f'Domain App <{self.name}>'
 
 
-async def read_domain_app(domain_app_name: str) -> DomainApp:
-    domain_app = DomainApp(domain_app_name)
+async def read_domain_app(
+    domain_app_name: str,
+    scheduler: Optional[Scheduler] = None,
+    lazy: bool = False,
+) -> DomainApp:
+    domain_app = DomainApp(domain_app_name, scheduler)
+    if not lazy:
+        domain_app.load()
     return domain_app
 
 
-async def read_domain_apps(apps: List[str]) -> List[DomainApp]:
+async def read_domain_apps(
+    apps: List[str],
+    concurrency: Optional[int] = None,
+    queue_size: Optional[int] = None,
+    lazy: bool = False,
+    parallel: bool = False,
+) -> List[DomainApp]:
+    # Every domain app gets its own scheduler with these limits.
+    # lazy: nothing is imported until the first request to the app;
+    # parallel: apps are imported at once in a thread pool.
     domain_apps = []
     for domain_app_name in apps:
-        app = await read_domain_app(domain_app_name)
+        app = await read_domain_app(domain_app_name, Scheduler(concurrency, queue_size), lazy=lazy or parallel)
         domain_apps.append(app)
+
+    if parallel and not lazy and domain_apps:
+        started = time.perf_counter()
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=len(domain_apps), thread_name_prefix='dno-load') as executor:
+            await asyncio.gather(*(loop.run_in_executor(executor, app.load) for app in domain_apps))
+        logger.info('Loaded %d domain apps in %.3fs', len(domain_apps), time.perf_counter() - started)
     return domain_apps
 
 
-async def app_factory(apps: List[str]) -> web.Application:
-    domain_apps = await read_domain_apps(apps)
+def _as_is(handler):
+    return handler
+
 
-    app = web.Application()
+async def app_factory(
+    apps: List[str],
+    concurrency: Optional[int] = None,
+    queue_size: Optional[int] = None,
+    retention: Optional[Retention] = None,
+    lazy: bool = False,
+    parallel: bool = False,
+    journal: Optional[Journal] = None,
+    trace_sample_rate: float = 0.0,
+    trace_exporter: Optional[SpanExporter] = None,
+    push_endpoints: Optional[List[Endpoint]] = None,
+    idempotency: Optional[IdempotencyIndex] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    watchdog: Optional[Watchdog] = None,
+    storage: Optional[StorageBackend] = None,
+) -> web.Application:
+    domain_apps = await read_domain_apps(apps, concurrency, queue_size, lazy=lazy, parallel=parallel)
+
+    middlewares = [metrics_middleware, tracing_middleware]
+    if rate_limiter is not None:
+        # Limits and sheds the submissions, marked below
+        middlewares.append(rate_limiter.middleware)
+        limited = rate_limiter.routes
+    else:
+        limited = {}
+    app = web.Application(middlewares=middlewares)
     app['APPS'] = apps
+    app['APPS_RESPONSE'] = StaticJSONResponse(apps)
+    app['DOMAIN_APPS'] = {domain_app.name: domain_app for domain_app in domain_apps}
+    app['RETENTION'] = retention
+    app['RATE_LIMITER'] = rate_limiter
+    if storage is not None:
+        # Instead of memory, e.g. SQLiteStorage; set before the journal
+        # recovers tasks into it
+        app['STORAGE'] = storage
+        app.cleanup_ctx.append(use_storage)
+    # Submissions with an Idempotency-Key seen within its ttl return the
+    # task they started
+    app['IDEMPOTENCY'] = idempotency if idempotency is not None else IdempotencyIndex()
+    if retention is not None:
+        app.cleanup_ctx.append(retention.cleanup_ctx)
+    if journal is not None:
+        # Recovers unfinished tasks on startup
+        app.cleanup_ctx.append(journal.cleanup_ctx)
+    if trace_exporter is not None:
+        # Traces trace_sample_rate of the requests and use cases
+        TRACER.configure(trace_sample_rate, trace_exporter)
+        app.cleanup_ctx.append(TRACER.cleanup_ctx)
+    if rate_limiter is not None:
+        app.cleanup_ctx.extend(rate_limiter.cleanup_ctx())
+    if watchdog is not None:
+        # Reports where the event loop gets blocked
+        app['WATCHDOG'] = watchdog
+        app.cleanup_ctx.append(watchdog.cleanup_ctx)
+        app.router.add_get('/watchdog', get_watchdog)
     app.router.add_get('/', get_apps)
+    app.router.add_get('/metrics', get_metrics)
+    app.router.add_post('/client_action/claim', claim_client_actions)
+    app.router.add_post('/client_action/batch', post_client_action_batch)
+    app.router.add_get('/client_action/push', get_push_endpoints)
+    app.router.add_post('/client_action/push', post_push_endpoint)
+    app.router.add_delete('/client_action/push', delete_push_endpoint)
+    app.cleanup_ctx.append(release_expired_leases)
+    # Client actions of these names are pushed to workers instead of claimed
+    for endpoint in push_endpoints or ():
+        PUSHER.register(endpoint)
+    app.cleanup_ctx.append(PUSHER.cleanup_ctx)
     for domain_app in domain_apps:
+        route = domain_app.when_loaded if lazy else _as_is
+
         url = '/%s/call' % domain_app.name
-        app.router.add_get(url, domain_app.get_use_case_list)
+        app.router.add_get(url, route(domain_app.get_use_case_list))
 
         url = '/%s/call/{use_case}' % domain_app.name
-        app.router.add_post(url, domain_app.post_use_case)
+        limited[app.router.add_post(url, route(domain_app.post_use_case))] = domain_app.name
 
         url = '/%s/call/{use_case}' % domain_app.name
-        app.router.add_get(url, domain_app.get_use_case)
+        app.router.add_get(url, route(domain_app.get_use_case))
+
+        url = '/%s/call/{use_case}/batch' % domain_app.name
+        batch = app.router.add_post(url, route(domain_app.post_use_case_batch))
+        limited[batch] = domain_app.name
+        if rate_limiter is not None:
+            rate_limiter.batch_routes.add(batch)
 
         url = '/%s/task' % domain_app.name
-        app.router.add_get(url, domain_app.get_task_list)
+        app.router.add_get(url, route(domain_app.get_task_list))
 
         url = '/%s/task/{task_id}' % domain_app.name
-        app.router.add_get(url, domain_app.get_task)
+        app.router.add_get(url, route(domain_app.get_task))
+
+        url = '/%s/task/{task_id}/cancel' % domain_app.name
+        app.router.add_post(url, route(domain_app.cancel_task))
 
         url = '/%s/task/{task_id}/client_action' % domain_app.name
-        app.router.add_post(url, domain_app.post_client_action)
+        limited[app.router.add_post(url, route(domain_app.post_client_action))] = domain_app.name
 
         url = '/%s/task/{task_id}/client_action' % domain_app.name
-        app.router.add_get(url, domain_app.get_client_action)
+        app.router.add_get(url, route(domain_app.get_client_action))
+
+        url = '/%s/task/{task_id}/client_action/stream' % domain_app.name
+        app.router.add_get(url, route(domain_app.stream_client_action))
+
+        url = '/%s/scheduler' % domain_app.name
+        app.router.add_get(url, route(domain_app.get_scheduler))
+
+        url = '/%s/cache' % domain_app.name
+        app.router.add_get(url, route(domain_app.get_cache))
     return app
 
 
@@ -1,10 +1,22 @@
 import asyncio
+import json
+import time
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from enum import Enum
-from typing import Any, Dict, Optional, Type, Union
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple, Type, Union
 from uuid import uuid4
 
 from pydantic import BaseModel
 
+from .timers import TIMERS, Timer
+from .tracing import TRACER, Span
+from .validation import compile_validator
+
+if TYPE_CHECKING:
+    from .use_case import UseCase
+
 
 class BadClientActionDeclaration(Exception):
     pass
@@ -44,35 +56,194 @@ class Status(Enum):
     ERROR = 'ERROR'
 
 
-class ClientActionField:
-    args: BaseModel
-    result: BaseModel
+# Called with the client action after it is created and after every status transition
+LISTENERS: List[Callable[['ClientAction'], None]] = []
+
 
-    def __init__(self, name: str, args, result):
+class ClientActionField:
+    args: Type[BaseModel]
+    result: Type[BaseModel]
+
+    def __init__(
+        self,
+        name: str,
+        args,
+        result,
+        cache_ttl: Optional[float] = None,
+        cache_size: int = 1024,
+        timeout: Optional[float] = None,
+    ):
         if not issubclass(args, BaseModel):
             raise BadClientActionDeclaration(f'{self.__class__.__name__}.args')
         if not issubclass(result, BaseModel):
             raise BadClientActionDeclaration(f'{self.__class__.__name__}.result')
         self.name = name
-        self.__annotations__['args'] = args
-        self.__annotations__['result'] = result
+        self.args = args
+        self.result = result
+        # Compiled once here: calls share no mutable state
+        self._validate_args = compile_validator(args)
+        self._span_name = f'client_action {name}'
+        # An action unfinished this many seconds after it was issued fails
+        # with a Timeout error
+        self.timeout = timeout
+
+        # Cacheable (idempotent) actions: calls with the same arguments share
+        # one pending client action, and a DONE one is reused for cache_ttl
+        # seconds. At most cache_size results are kept, least recently used
+        # are dropped first.
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[str, Tuple[float, ClientAction]]' = OrderedDict()
+        self._in_flight: Dict[str, ClientAction] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.coalesced = 0
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        # self.field(...) inside UseCase.run creates actions of that task
+        return partial(self.call, instance)
 
     async def __call__(self, **kwargs):
+        return await self.call(None, **kwargs)
+
+    async def call(self, use_case: Optional['UseCase'], /, **kwargs):
+        # Traced from here to the end of the action, in the use case's trace
+        span = TRACER.start_span(self._span_name)
+
         # Check arguments
-        self.args = self.__annotations__['args'](**kwargs)
+        try:
+            values = self._validate_args(kwargs)
+        except Exception:
+            span.finish('ERROR')
+            raise
 
         id = uuid4().hex
         # TODO Подумать: надо ли присваивать id здесь или внутри класса Storage
 
-        client_action = ClientAction(self.name, id, kwargs, Status.PENDING)
-
+        seq = None
+        if use_case is not None:
+            seq = use_case.calls
+            use_case.calls += 1
+
+        if use_case is not None and use_case.replay:
+            client_action = self._replay(use_case, seq, id, kwargs)
+            if client_action is not None:
+                span.event('replayed')
+                span.finish()
+                return client_action
+
+        key = None
+        if self.cache_ttl is not None:
+            key = json.dumps(values, sort_keys=True, default=str)
+            client_action = self._cached(key)
+            if client_action is not None:
+                # Shared with other tasks, so not journaled for this one
+                if use_case is not None:
+                    use_case.client_actions[client_action.id] = client_action
+                if not client_action.is_finished():
+                    if client_action.holders is None:
+                        client_action.holders = {client_action.task_id}
+                    client_action.holders.add(use_case.id if use_case is not None else None)
+                if span.sampled:
+                    span.attributes['client_action.id'] = client_action.id
+                    span.event('cached' if client_action.is_finished() else 'coalesced')
+                span.finish()
+                return client_action
+
+        task_id = use_case.id if use_case is not None else None
+        client_action = ClientAction(self.name, id, kwargs, Status.PENDING, task_id=task_id)
+        client_action.seq = seq
+        if span.sampled:
+            span.attributes['client_action.id'] = id
+            client_action.span = span
+        if self.timeout is not None:
+            client_action._timer = TIMERS.call_later(self.timeout, client_action._time_out)
+        if key is not None:
+            self._in_flight[key] = client_action
+            asyncio.ensure_future(self._cache_result(key, client_action))
+
+        if use_case is not None:
+            # Before the await: concurrent calls of one use case (see
+            # dno.fan_out) get their positions, and so replay, in call order
+            use_case.client_actions[id] = client_action
         await Storage.add(client_action)
+        client_action._notify()
+
+        return client_action
 
+    def cache_stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'coalesced': self.coalesced,
+            'size': len(self._cache),
+            'in_flight': len(self._in_flight),
+        }
+
+    def _cached(self, key: str) -> Optional['ClientAction']:
+        cached = self._cache.get(key)
+        if cached is not None:
+            expires, client_action = cached
+            if expires > time.monotonic():
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return client_action
+            del self._cache[key]
+
+        client_action = self._in_flight.get(key)
+        if client_action is not None:
+            if client_action.status != Status.ERROR:
+                self.coalesced += 1
+                return client_action
+            # Failed (or aborted with its task) before _cache_result got to
+            # run: never handed to another call
+            del self._in_flight[key]
+
+        self.cache_misses += 1
+        return None
+
+    async def _cache_result(self, key: str, client_action: 'ClientAction'):
+        try:
+            await client_action.wait()
+        finally:
+            # Unless _cached dropped it already, for a newer one maybe
+            if self._in_flight.get(key) is client_action:
+                del self._in_flight[key]
+        if client_action.status == Status.DONE:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, client_action)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _replay(self, use_case: 'UseCase', seq: int, id: str, kwargs: Dict[str, Any]) -> Optional['ClientAction']:
+        # The outcome recorded for this call before a restart, as a finished
+        # client action which is neither stored nor handed out to workers
+        recorded = use_case.replay.pop(seq, None)
+        if recorded is None:
+            return None
+        if recorded['name'] != self.name or (
+            recorded.get('args') is not None and recorded['args'] != json.loads(json.dumps(kwargs, default=str))
+        ):
+            # run() took another path than before (or concurrent calls were
+            # made in another order), nothing further can be replayed
+            use_case.replay.clear()
+            return None
+
+        client_action = ClientAction(self.name, id, kwargs, Status(recorded['status']), task_id=use_case.id)
+        client_action.result = recorded.get('result')
+        client_action.error = recorded.get('error')
+        client_action.seq = seq
+        use_case.client_actions[id] = client_action
         return client_action
 
 
 class ClientAction:
-    __slots__ = ('id', 'name', 'args', 'status', 'result', 'error')
+    __slots__ = (
+        'id', 'name', 'args', 'status', 'result', 'error', 'task_id',
+        'changed_at', 'previous_status', 'previous_duration', 'span', 'seq', 'holders', '_timer', '_waiter',
+    )
 
     id: str
     name: str
@@ -80,14 +251,40 @@ class ClientAction:
     args: Dict[str, Any]
     result: Optional[Dict]
     error: Optional[Dict]
-
-    def __init__(self, name: str, id: str, args: Dict[str, Any], status: Status):
+    task_id: Optional[str]
+
+    def __init__(
+        self,
+        name: str,
+        id: str,
+        args: Dict[str, Any],
+        status: Status,
+        task_id: Optional[str] = None,
+    ):
         self.id = id
         self.name = name
         self.args = args
         self.status = status
         self.result = None
         self.error = None
+        self.task_id = task_id
+        # Monotonic time of the last transition (or creation), and the status
+        # before it with the seconds spent in that status; None for a new action
+        self.changed_at = time.monotonic()
+        self.previous_status: Optional[Status] = None
+        self.previous_duration: Optional[float] = None
+        # Of a sampled trace (see dno.tracing)
+        self.span: Optional[Span] = None
+        # Position of the call in run() of the task that issued it (see
+        # dno.journal)
+        self.seq: Optional[int] = None
+        # Ids of the tasks waiting on it once other calls got it in flight
+        # from a field cache, its issuer included; None stands for a caller
+        # outside any task. None while not shared.
+        self.holders: Optional[Set[Optional[str]]] = None
+        # Deadline, see ClientActionField.timeout
+        self._timer: Optional[Timer] = None
+        self._waiter: Optional[asyncio.Future] = None
 
     def __repr__(self):
         return f'ClientAction({self.id}, {self.name}, {self.status}, {self.result}, {self.error})'
@@ -95,19 +292,33 @@ class ClientAction:
     def set_running(self):
         if self.status != Status.PENDING:
             raise UnexpectedStatus(self.status)
-        self.status = Status.RUNNING
+        self._changed(Status.RUNNING)
+
+    def set_pending(self):
+        # Back to the queue, e.g. when the worker's lease expired
+        if self.status != Status.RUNNING:
+            raise UnexpectedStatus(self.status)
+        self._changed(Status.PENDING)
 
     def set_result(self, result: Optional[Dict] = None):
         if self.status != Status.RUNNING:
             raise UnexpectedStatus(self.status)
-        self.status = Status.DONE
         self.result = result # or {}
+        self._changed(Status.DONE)
 
     def set_error(self, error: Optional[Dict] = None):
         if self.status != Status.RUNNING:
             raise UnexpectedStatus(self.status)
-        self.status = Status.ERROR
         self.error = error # or {}
+        self._changed(Status.ERROR)
+
+    def abort(self, error: Dict):
+        # Fails the action whether a worker has it or not: past its deadline,
+        # or when its use case is cancelled
+        if self.is_finished():
+            raise UnexpectedStatus(self.status)
+        self.error = error
+        self._changed(Status.ERROR)
 
     def is_finished(self):
         return self.status in (
@@ -115,13 +326,128 @@ class ClientAction:
             Status.ERROR,
         )
 
+    def shared(self) -> bool:
+        # Still waited on by more than one caller
+        return self.holders is not None and len(self.holders) > 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'task_id': self.task_id,
+            'status': self.status.value,
+            'args': self.args,
+            'result': self.result,
+            'error': self.error,
+        }
+
+    def _changed(self, status: Status):
+        now = time.monotonic()
+        self.previous_status, self.status = self.status, status
+        self.previous_duration = now - self.changed_at
+        self.changed_at = now
+
+        Storage.update(self)
+        if self.is_finished():
+            self._wake_up()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self.span is not None:
+            self.span.event(status.value)
+            if self.is_finished():
+                self.span.finish('OK' if status == Status.DONE else 'ERROR')
+        self._notify()
+
+    def _time_out(self):
+        self._timer = None
+        if not self.is_finished():
+            self.abort({'type': 'Timeout', 'message': 'No result before the deadline'})
+
+    def _notify(self):
+        for listener in LISTENERS:
+            listener(self)
+
+    def _wake_up(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
     async def wait(self):
-        while not self.is_finished():
-            await asyncio.sleep(0)  # TODO sleep(0) or sleep(N)?
+        if self.is_finished():
+            return
+        if self.span is not None:
+            self.span.event('wait')
+        # One future per action is shared by all its waiters, so a parked
+        # waiter costs nothing until set_result/set_error resolves it
+        if self._waiter is None:
+            self._waiter = asyncio.get_event_loop().create_future()
+        # shield: a cancelled waiter must not cancel the shared future
+        await asyncio.shield(self._waiter)
+
+
+class StorageBackend(metaclass=ABCMeta):
+    @abstractmethod
+    async def get(self, id: str) -> ClientAction:
+        pass
+
+    @abstractmethod
+    async def add(self, client_action: ClientAction):
+        pass
+
+    @abstractmethod
+    async def delete(self, id: str):
+        pass
+
+    @abstractmethod
+    async def find(
+        self,
+        status: Optional[Status] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[ClientAction]:
+        pass
+
+    def update(self, client_action: ClientAction):
+        # Called synchronously on every status transition
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryStorage(StorageBackend):
+    def __init__(self):
+        self._storage: Dict[str, ClientAction] = {}
+
+    async def get(self, id: str) -> ClientAction:
+        return self._storage[id]
+
+    async def add(self, client_action: ClientAction):
+        self._storage[client_action.id] = client_action
+
+    async def delete(self, id: str):
+        del self._storage[id]
+
+    async def find(
+        self,
+        status: Optional[Status] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[ClientAction]:
+        found = []
+        for client_action in self._storage.values():
+            if limit is not None and len(found) >= limit:
+                break
+            if status is not None and client_action.status != status:
+                continue
+            if name is not None and client_action.name != name:
+                continue
+            found.append(client_action)
+        return found
 
 
 class Storage:
-    _STORAGE: Dict[str, ClientAction] = {}
+    _BACKEND: StorageBackend = MemoryStorage()
 
     def __init__(self):
         # Only class methods are allowed
@@ -129,13 +455,35 @@ class Storage:
         raise NotImplementedError
 
     @classmethod
-    async def get(cls, id: str):
-        return cls._STORAGE[id]
+    def set_backend(cls, backend: StorageBackend) -> StorageBackend:
+        previous, cls._BACKEND = cls._BACKEND, backend
+        return previous
+
+    @classmethod
+    def get_backend(cls) -> StorageBackend:
+        return cls._BACKEND
+
+    @classmethod
+    async def get(cls, id: str) -> ClientAction:
+        return await cls._BACKEND.get(id)
 
     @classmethod
     async def add(cls, client_action: ClientAction):
-        cls._STORAGE[client_action.id] = client_action
+        await cls._BACKEND.add(client_action)
 
     @classmethod
     async def delete(cls, id: str):
-        del cls._STORAGE[id]
+        await cls._BACKEND.delete(id)
+
+    @classmethod
+    async def find(
+        cls,
+        status: Optional[Status] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[ClientAction]:
+        return await cls._BACKEND.find(status=status, name=name, limit=limit)
+
+    @classmethod
+    def update(cls, client_action: ClientAction):
+        cls._BACKEND.update(client_action)
@@ -0,0 +1,121 @@
+import heapq
+import time
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+from . import client_action
+from .client_action import ClientAction, Status, UnexpectedStatus
+
+
+__all__ = ['Lease', 'LeaseExpired', 'Dispatcher', 'DISPATCHER']
+
+
+class LeaseExpired(Exception):
+    pass
+
+
+class Lease:
+    __slots__ = ('id', 'expires')
+
+    def __init__(self, id: str, expires: float):
+        self.id = id
+        self.expires = expires
+
+    def __repr__(self):
+        return f'Lease({self.id}, {self.expires})'
+
+
+class Dispatcher:
+    # Hands PENDING client actions of every task out to workers. Claimed
+    # actions are RUNNING under a lease; when it expires they go back to
+    # PENDING, so a crashed worker doesn't strand them.
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        # name -> PENDING client actions in creation order
+        self._pending: Dict[str, Dict[str, ClientAction]] = {}
+        # client action id -> (client action, lease), for claimed RUNNING actions
+        self._leased: Dict[str, Tuple[ClientAction, Lease]] = {}
+        self._expiry: List[Tuple[float, str, str]] = []
+
+    def on_change(self, ca: ClientAction):
+        if ca.status == Status.PENDING:
+            self._pending.setdefault(ca.name, {})[ca.id] = ca
+        else:
+            self._discard_pending(ca)
+        if ca.status != Status.RUNNING:
+            self._leased.pop(ca.id, None)
+
+    def claim(
+        self,
+        limit: int,
+        lease_time: float,
+        names: Optional[Iterable[str]] = None,
+    ) -> Tuple[Lease, List[ClientAction]]:
+        self.release_expired()
+
+        claimed = []
+        # Each name once, or its actions would be claimed twice
+        for name in (list(self._pending) if names is None else dict.fromkeys(names)):
+            claimed.extend(islice(self._pending.get(name, {}).values(), limit - len(claimed)))
+            if len(claimed) >= limit:
+                break
+
+        return self.lease(claimed, lease_time), claimed
+
+    def lease(self, claimed: List[ClientAction], lease_time: float) -> Lease:
+        # Moves PENDING client actions to RUNNING under one new lease; all of
+        # them or, raising UnexpectedStatus, none
+        for ca in claimed:
+            if ca.status != Status.PENDING:
+                raise UnexpectedStatus(ca.status)
+        if len({ca.id for ca in claimed}) != len(claimed):
+            raise ValueError('Client action leased twice')
+        lease = Lease(uuid4().hex, self._clock() + lease_time)
+        for ca in claimed:
+            ca.set_running()
+            self._leased[ca.id] = (ca, lease)
+            heapq.heappush(self._expiry, (lease.expires, lease.id, ca.id))
+        return lease
+
+    def check_lease(self, ca: ClientAction, lease_id: Optional[str] = None):
+        # Only the current, unexpired lease may finish a claimed action: a
+        # request without a lease id finishes only unclaimed ones
+        if ca.id not in self._leased:
+            if lease_id is not None:
+                raise LeaseExpired(ca.id)
+            return
+        _, lease = self._leased[ca.id]
+        if lease_id != lease.id or lease.expires <= self._clock():
+            raise LeaseExpired(ca.id)
+
+    def release_expired(self) -> int:
+        now = self._clock()
+        released = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, lease_id, id = heapq.heappop(self._expiry)
+            if id not in self._leased:
+                continue
+            ca, lease = self._leased[id]
+            # The action may have been released and claimed again since
+            if lease.id == lease_id and ca.status == Status.RUNNING:
+                ca.set_pending()
+                released += 1
+        return released
+
+    def pending(self, name: str) -> List[ClientAction]:
+        return list(self._pending.get(name, {}).values())
+
+    def pending_count(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    def _discard_pending(self, ca: ClientAction):
+        pending = self._pending.get(ca.name)
+        if pending is not None and pending.pop(ca.id, None) is not None and not pending:
+            del self._pending[ca.name]
+
+
+DISPATCHER = Dispatcher()
+
+client_action.LISTENERS.append(DISPATCHER.on_change)
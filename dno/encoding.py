@@ -0,0 +1,77 @@
+import hashlib
+import json
+from enum import Enum
+from typing import Any, Mapping, Optional
+
+from aiohttp import web
+from pydantic import BaseModel
+
+from .client_action import ClientAction
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+__all__ = ['encode', 'dumps', 'loads', 'json_response', 'StaticJSONResponse']
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, ClientAction):
+        return obj.as_dict()
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    def encode(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    def encode(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+    loads = json.loads
+
+
+def dumps(obj: Any) -> str:
+    return encode(obj).decode()
+
+
+def json_response(
+    data: Any,
+    status: int = web.HTTPOk.status_code,
+    headers: Optional[Mapping[str, str]] = None,
+) -> web.Response:
+    return web.Response(body=encode(data), status=status, headers=headers, content_type='application/json')
+
+
+class StaticJSONResponse:
+    # Serialized once, served with a strong ETag; a matching If-None-Match
+    # gets 304 without a body
+
+    def __init__(self, data: Any):
+        self.body = encode(data)
+        self.etag = '"%s"' % hashlib.sha256(self.body).hexdigest()[:32]
+
+    def __call__(self, request: web.Request) -> web.Response:
+        headers = {'ETag': self.etag}
+        if self._matches(request.headers.get('If-None-Match')):
+            return web.Response(status=web.HTTPNotModified.status_code, headers=headers)
+        return web.Response(body=self.body, headers=headers, content_type='application/json')
+
+    def _matches(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        # Weak comparison, as If-None-Match requires
+        return any(
+            etag.strip().replace('W/', '', 1) == self.etag
+            for etag in if_none_match.split(',')
+        )
@@ -0,0 +1,48 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Set
+
+from . import client_action, use_case
+
+
+__all__ = ['Subscriptions', 'TASK_CLIENT_ACTIONS']
+
+
+class Subscriptions:
+    def __init__(self):
+        self._queues: Dict[str, Set[asyncio.Queue]] = {}
+
+    @contextmanager
+    def subscribe(self, key: str) -> Iterator[asyncio.Queue]:
+        queue = asyncio.Queue()
+        self._queues.setdefault(key, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._queues[key]
+            queues.discard(queue)
+            if not queues:
+                del self._queues[key]
+
+    def publish(self, key: str, item: Any):
+        for queue in self._queues.get(key, ()):
+            queue.put_nowait(item)
+
+
+# task id -> client actions of that task, on creation and on every status
+# transition, then the task itself once it has finished
+TASK_CLIENT_ACTIONS = Subscriptions()
+
+
+def _publish_client_action(ca: client_action.ClientAction):
+    if ca.task_id is not None:
+        TASK_CLIENT_ACTIONS.publish(ca.task_id, ca)
+
+
+def _publish_task(uc: use_case.UseCase):
+    if uc.is_finished():
+        TASK_CLIENT_ACTIONS.publish(uc.id, uc)
+
+
+client_action.LISTENERS.append(_publish_client_action)
+use_case.LISTENERS.append(_publish_task)
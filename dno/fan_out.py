@@ -0,0 +1,154 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from .client_action import ClientAction, Status
+
+
+__all__ = ['ClientActionFailed', 'Step', 'gather', 'run_steps']
+
+
+# Issues a client action, e.g. partial(self.install_os, id=vm_id) or
+# lambda: self.install_os(id=vm_id); steps get the client actions of the
+# steps they come after as keyword arguments
+Call = Callable[..., Awaitable[ClientAction]]
+
+
+class ClientActionFailed(Exception):
+    def __init__(self, client_action: ClientAction):
+        super().__init__(client_action.name, client_action.error)
+        self.client_action = client_action
+
+    def __repr__(self):
+        return f'Client action {self.client_action.name} failed: {self.client_action.error}'
+
+
+class Step:
+    def __init__(self, call: Call, after: Iterable[str] = ()):
+        self.call = call
+        self.after = tuple(after)
+
+    def __repr__(self):
+        return f'Step({self.call}, after={self.after})'
+
+
+async def gather(calls: Iterable[Call], limit: Optional[int] = None, fail_fast: bool = True) -> List[ClientAction]:
+    # Issues the client actions at once, at most `limit` unfinished at a
+    # time, and waits for all of them; returns them finished, in the order
+    # of calls. fail_fast: the first ERROR raises ClientActionFailed, and
+    # the calls not issued yet are dropped. Otherwise failed actions are
+    # returned like the others. An exception raised by a call itself (bad
+    # arguments) always fails fast. Either way, or when the caller is
+    # cancelled, no sibling is left running.
+    steps = {str(i): Step(call) for i, call in enumerate(calls)}
+    finished = await run_steps(steps, limit, fail_fast)
+    return [finished[str(i)] for i in range(len(steps))]
+
+
+async def run_steps(
+    steps: Dict[str, Step],
+    limit: Optional[int] = None,
+    fail_fast: bool = True,
+) -> Dict[str, ClientAction]:
+    # Runs every step as soon as the steps it comes after are DONE, with
+    # gather's limit and error policy; returns step name -> finished client
+    # action. Without fail_fast, steps after a failed one are skipped and
+    # missing from the result.
+    dependents: Dict[str, List[str]] = {name: [] for name in steps}
+    waiting_for: Dict[str, int] = {}
+    for name, step in steps.items():
+        for before in step.after:
+            if before not in steps:
+                raise ValueError(f'Step {name} comes after unknown step {before}')
+            dependents[before].append(name)
+        waiting_for[name] = len(step.after)
+    _check_acyclic(steps, dependents, waiting_for)
+
+    semaphore = asyncio.Semaphore(limit) if limit is not None else None
+    # Set on the first failure, before the slot of the failed step is given
+    # to a waiting one
+    failed = asyncio.Event()
+    finished: Dict[str, ClientAction] = {}
+    running: Dict[asyncio.Future, str] = {}
+    # Every client action the steps issued
+    issued: List[ClientAction] = []
+
+    def start(name: str):
+        step = steps[name]
+        kwargs = {before: finished[before] for before in step.after}
+        running[asyncio.ensure_future(_run(step.call, kwargs, semaphore, failed, fail_fast, issued))] = name
+
+    try:
+        for name, count in waiting_for.items():
+            if not count:
+                start(name)
+
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = running.pop(task)
+                client_action = task.result()
+                if client_action is None:
+                    continue
+                finished[name] = client_action
+                if client_action.status != Status.DONE:
+                    if fail_fast:
+                        raise ClientActionFailed(client_action)
+                    continue
+                for dependent in dependents[name]:
+                    waiting_for[dependent] -= 1
+                    if not waiting_for[dependent]:
+                        start(dependent)
+    finally:
+        if running:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            # Nobody waits for them any more: no worker should take them.
+            # Those shared through a field cache are left to the others.
+            for client_action in issued:
+                if not client_action.is_finished() and not client_action.shared():
+                    client_action.abort({'type': 'Cancelled', 'message': 'A sibling client action failed'})
+    return finished
+
+
+async def _run(
+    call: Call,
+    kwargs: Dict[str, ClientAction],
+    semaphore: Optional[asyncio.Semaphore],
+    failed: asyncio.Event,
+    fail_fast: bool,
+    issued: List[ClientAction],
+) -> Optional[ClientAction]:
+    if semaphore is not None:
+        await semaphore.acquire()
+    try:
+        if failed.is_set():
+            # Not issued
+            return None
+        client_action = await call(**kwargs)
+        issued.append(client_action)
+        await client_action.wait()
+        if fail_fast and client_action.status != Status.DONE:
+            failed.set()
+        return client_action
+    except Exception:
+        failed.set()
+        raise
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+
+def _check_acyclic(steps: Dict[str, Step], dependents: Dict[str, List[str]], waiting_for: Dict[str, int]):
+    counts = dict(waiting_for)
+    ready = [name for name, count in counts.items() if not count]
+    seen: Set[str] = set()
+    while ready:
+        name = ready.pop()
+        seen.add(name)
+        for dependent in dependents[name]:
+            counts[dependent] -= 1
+            if not counts[dependent]:
+                ready.append(dependent)
+    if len(seen) != len(steps):
+        raise ValueError(f'Steps {sorted(set(steps) - seen)} depend on each other')
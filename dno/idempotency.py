@@ -0,0 +1,68 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from pydantic import BaseModel
+
+
+__all__ = ['IdempotencyIndex', 'arguments_key']
+
+
+class IdempotencyIndex:
+    # Key -> id of the task a submission with that key started, for `ttl`
+    # seconds. Keys expire in the order they were added, so expired ones are
+    # dropped from the front; beyond max_size the oldest go first. Every
+    # operation is O(1), amortized.
+
+    def __init__(self, ttl: float = 600.0, max_size: int = 100000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        # key -> (expires, task id), oldest first
+        self._keys: 'OrderedDict[Hashable, Tuple[float, str]]' = OrderedDict()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        self._expire()
+        entry = self._keys.get(key)
+        if entry is None:
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def add(self, key: Hashable, id: str):
+        self._keys.pop(key, None)
+        self._keys[key] = (self._clock() + self.ttl, id)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def discard(self, key: Hashable, id: str):
+        # Only if it still points at that task
+        entry = self._keys.get(key)
+        if entry is not None and entry[1] == id:
+            del self._keys[key]
+
+    def _expire(self):
+        now = self._clock()
+        while self._keys:
+            key, (expires, _) = next(iter(self._keys.items()))
+            if expires > now:
+                break
+            del self._keys[key]
+
+
+def arguments_key(arguments: Dict[str, Any]) -> str:
+    # The same for the same validated arguments, whatever their order
+    data = json.dumps(arguments, sort_keys=True, separators=(',', ':'), default=_default)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    return str(obj)
@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from . import client_action as client_action_module
+from . import use_case as use_case_module
+from .client_action import ClientAction
+from .encoding import dumps
+from .scheduler import QueueFull, Scheduler
+from .use_case import REGISTERED, Status, UseCase
+
+
+__all__ = ['Journal']
+
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    # Append-only log of use case progress in `path` (a directory):
+    #
+    #   {"op": "start", "task": id, "app": ..., "use_case": ..., "args": {...}}
+    #   {"op": "result", "task": id, "seq": n, "name": ..., "args": {...}, "status": ..., "result": ..., "error": ...}
+    #   {"op": "finish", "task": id}
+    #
+    # "seq" is the index of the ClientActionField call in run(). Every
+    # `snapshot_every` records the unfinished tasks are written to a snapshot
+    # and the log is truncated, so recovery reads at most the snapshot plus
+    # that many records. Replaying a record twice changes nothing.
+
+    def __init__(self, path: str, snapshot_every: int = 10000, sync: bool = False):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.sync = sync
+        os.makedirs(path, exist_ok=True)
+        self.log_path = os.path.join(path, 'journal.log')
+        self.snapshot_path = os.path.join(path, 'snapshot.json')
+
+        # Unfinished tasks: start record plus 'results' by seq
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._records = 0
+        self._file = None
+
+    def open(self):
+        self._tasks = self._read()
+        self._file = open(self.log_path, 'a', encoding='utf-8')
+        # Start from a fresh snapshot, so the old log is not replayed again
+        self.snapshot()
+        client_action_module.LISTENERS.append(self.on_client_action)
+        use_case_module.LISTENERS.append(self.on_use_case)
+
+    def close(self):
+        client_action_module.LISTENERS.remove(self.on_client_action)
+        use_case_module.LISTENERS.remove(self.on_use_case)
+        self._file.close()
+        self._file = None
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        return list(self._tasks.values())
+
+    async def recover(self, get_scheduler: Callable[[str], Optional[Scheduler]]) -> List[UseCase]:
+        # Starts every unfinished task again under its old id; results of
+        # client actions it had finished are replayed instead of issued
+        recovered = []
+        for task in self.unfinished():
+            cls = REGISTERED.get(task['app'], {}).get(task['use_case'])
+            if cls is None:
+                logger.error('Can\'t recover task %s: no use case %s.%s', task['task'], task['app'], task['use_case'])
+                continue
+            try:
+                use_case = cls(**task['args'])
+            except ValidationError as e:
+                # The use case changed its arguments since
+                logger.error('Can\'t recover task %s: %s', task['task'], e)
+                continue
+            use_case.id = task['task']
+            use_case.replay = {int(seq): result for seq, result in task['results'].items()}
+            try:
+                # Accepted before the restart, so not refused for a full queue now
+                await use_case.start(get_scheduler(task['app']), force=True)
+            except QueueFull:
+                logger.error('Can\'t recover task %s: queue is full', task['task'])
+                continue
+            recovered.append(use_case)
+        return recovered
+
+    def on_use_case(self, use_case: UseCase):
+        if use_case.status == Status.PENDING and use_case.id not in self._tasks:
+            self._write({
+                'op': 'start',
+                'task': use_case.id,
+                'app': use_case.domain_app,
+                'use_case': use_case.__class__.__name__,
+                'args': use_case.arguments(),
+            })
+        elif use_case.is_finished() and use_case.id in self._tasks:
+            self._write({'op': 'finish', 'task': use_case.id})
+
+    def on_client_action(self, ca: ClientAction):
+        # Only actions issued by the run() of a journaled task have a seq
+        if not ca.is_finished() or ca.seq is None or ca.task_id not in self._tasks:
+            return
+        self._write({
+            'op': 'result',
+            'task': ca.task_id,
+            'seq': ca.seq,
+            'name': ca.name,
+            'args': ca.args,
+            'status': ca.status.value,
+            'result': ca.result,
+            'error': ca.error,
+        })
+
+    def snapshot(self):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(dumps(list(self._tasks.values())))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Everything in the log is in the snapshot now
+        self._file.truncate(0)
+        self._file.flush()
+        self._records = 0
+
+    def _write(self, record: Dict[str, Any]):
+        line = dumps(record)
+        # Apply first: the record is JSON-encoded, as it will be read back
+        _apply(self._tasks, json.loads(line))
+        self._file.write(line + '\n')
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+        self._records += 1
+        if self._records >= self.snapshot_every:
+            self.snapshot()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        tasks = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                for task in json.load(f):
+                    tasks[task['task']] = task
+        if os.path.exists(self.log_path):
+            with open(self.log_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A record torn by the crash
+                        logger.warning('Skipping broken journal record: %r', line)
+                        continue
+                    _apply(tasks, record)
+        return tasks
+
+    async def cleanup_ctx(self, app):
+        self.open()
+        domain_apps = app['DOMAIN_APPS']
+        for task in self.unfinished():
+            if task['app'] in domain_apps:
+                await domain_apps[task['app']].ensure_loaded()
+        recovered = await self.recover(
+            lambda name: domain_apps[name].scheduler if name in domain_apps else None
+        )
+        if recovered:
+            logger.info('Recovered %d tasks from %s', len(recovered), self.path)
+        yield
+        self.close()
+
+    def __repr__(self):
+        return f'Journal({self.path})'
+
+
+def _apply(tasks: Dict[str, Dict[str, Any]], record: Dict[str, Any]):
+    op = record['op']
+    if op == 'start':
+        tasks[record['task']] = {
+            'task': record['task'],
+            'app': record['app'],
+            'use_case': record['use_case'],
+            'args': record['args'],
+            'results': {},
+        }
+    elif op == 'result':
+        task = tasks.get(record['task'])
+        if task is not None:
+            task['results'][str(record['seq'])] = {
+                'name': record['name'],
+                'args': record.get('args'),
+                'status': record['status'],
+                'result': record['result'],
+                'error': record['error'],
+            }
+    elif op == 'finish':
+        tasks.pop(record['task'], None)
@@ -0,0 +1,210 @@
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+from . import client_action, use_case
+from .client_action import ClientAction
+from .use_case import Status, UseCase
+
+
+__all__ = ['Histogram', 'HistogramFamily', 'Metrics', 'METRICS', 'metrics_middleware']
+
+
+# Seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    # Counts per bucket, made cumulative only when rendered. Everything runs
+    # on the event loop thread, so no locks; observe() allocates nothing.
+    __slots__ = ('labels', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.labels = labels
+        self.buckets = buckets
+        # The last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HistogramFamily:
+    # Histograms of one metric by label values. Hot paths look a histogram
+    # up by a key they already have (a class, a route, an action name):
+    #
+    #   (family.children.get(key) or family.add(key, labels)).observe(value)
+    #
+    # so the labels tuple is only built the first time.
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.children: Dict[Hashable, Histogram] = {}
+        # Keys with the same labels share one histogram
+        self._by_labels: Dict[Tuple[str, ...], Histogram] = {}
+
+    def add(self, key: Hashable, labels: Tuple[str, ...]) -> Histogram:
+        histogram = self.children.get(key)
+        if histogram is None:
+            histogram = self._by_labels.get(labels)
+            if histogram is None:
+                histogram = self._by_labels[labels] = Histogram(labels, self.buckets)
+            self.children[key] = histogram
+        return histogram
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for histogram in self._by_labels.values():
+            labels = _labels(self.labelnames, histogram.labels)
+            # le follows the labels, if any
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {histogram.count}'
+            yield f'{self.name}_sum{{{labels}}} {histogram.sum}'
+            yield f'{self.name}_count{{{labels}}} {histogram.count}'
+
+
+class Metrics:
+    # Use case and client action metrics, fed by their LISTENERS, and HTTP
+    # handler latency, fed by metrics_middleware. Gauges are counted on
+    # every transition, so a scrape doesn't walk the tasks.
+
+    def __init__(self):
+        self.use_case_queue = HistogramFamily(
+            'dno_use_case_queue_seconds', 'Time use cases wait in the scheduler queue', ('app', 'use_case'),
+        )
+        self.use_case_run = HistogramFamily(
+            'dno_use_case_run_seconds', 'Run duration of use cases', ('app', 'use_case'),
+        )
+        self.client_action_pending = HistogramFamily(
+            'dno_client_action_pending_seconds', 'Time client actions spend PENDING', ('name',),
+        )
+        self.client_action_running = HistogramFamily(
+            'dno_client_action_running_seconds', 'Time client actions spend RUNNING', ('name',),
+        )
+        self.http = HistogramFamily(
+            'dno_http_request_seconds', 'HTTP handler latency', ('method', 'route'),
+        )
+        self.histograms = [
+            self.use_case_queue,
+            self.use_case_run,
+            self.client_action_pending,
+            self.client_action_running,
+            self.http,
+        ]
+
+        # app -> status -> use cases; DONE and ERROR are totals since start
+        self.use_cases: Dict[str, Dict[Status, int]] = {}
+        # status -> client actions; DONE and ERROR are totals since start
+        self.client_actions: Dict[client_action.Status, int] = {status: 0 for status in client_action.Status}
+
+    def on_use_case(self, uc: UseCase):
+        counts = self.use_cases.get(uc.domain_app)
+        if counts is None:
+            counts = self.use_cases[uc.domain_app] = {status: 0 for status in Status}
+        counts[uc.status] += 1
+
+        cls = uc.__class__
+        if uc.status == Status.RUNNING:
+            # Unless executed without start()
+            if uc.queued_at is not None:
+                counts[Status.PENDING] -= 1
+                histogram = self.use_case_queue.children.get(cls) or \
+                    self.use_case_queue.add(cls, (uc.domain_app, cls.__name__))
+                histogram.observe(uc.started_at - uc.queued_at)
+        elif uc.status != Status.PENDING:
+            if uc.started_at is None:
+                # Cancelled while queued
+                if uc.queued_at is not None:
+                    counts[Status.PENDING] -= 1
+                return
+            counts[Status.RUNNING] -= 1
+            histogram = self.use_case_run.children.get(cls) or \
+                self.use_case_run.add(cls, (uc.domain_app, cls.__name__))
+            histogram.observe(uc.finished_at - uc.started_at)
+
+    def on_client_action(self, ca: ClientAction):
+        self.client_actions[ca.status] += 1
+        previous = ca.previous_status
+        if previous is None:
+            return
+        self.client_actions[previous] -= 1
+        family = self.client_action_pending if previous == client_action.Status.PENDING else self.client_action_running
+        histogram = family.children.get(ca.name) or family.add(ca.name, (ca.name,))
+        histogram.observe(ca.previous_duration)
+
+    def render(self, gauges: Optional[List[Tuple[str, str, List[Tuple[Dict[str, Any], float]]]]] = None) -> str:
+        # gauges: extra (name, help, [(labels, value)]) to expose
+        lines = []
+        lines.extend(_gauge(
+            'dno_use_cases',
+            'Use cases by status; DONE and ERROR count every finished one',
+            [
+                ({'app': app, 'status': status.value}, count)
+                for app, counts in self.use_cases.items()
+                for status, count in counts.items()
+            ],
+        ))
+        lines.extend(_gauge(
+            'dno_client_actions',
+            'Client actions by status; DONE and ERROR count every finished one',
+            [({'status': status.value}, count) for status, count in self.client_actions.items()],
+        ))
+        for name, help, samples in gauges or ():
+            lines.extend(_gauge(name, help, samples))
+        for family in self.histograms:
+            lines.extend(family.render())
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str]) -> str:
+    return ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+def _gauge(name: str, help: str, samples: List[Tuple[Dict[str, Any], float]]) -> Iterable[str]:
+    yield f'# HELP {name} {help}'
+    yield f'# TYPE {name} gauge'
+    for labels, value in samples:
+        yield f'{name}{{{_labels(labels, labels.values())}}} {value}'
+
+
+METRICS = Metrics()
+
+use_case.LISTENERS.append(METRICS.on_use_case)
+client_action.LISTENERS.append(METRICS.on_client_action)
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler: Callable):
+    started = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        route = request.match_info.route
+        resource = route.resource
+        # Requests matching no route (a new route object each) by method
+        key = route if resource is not None else request.method
+        histogram = METRICS.http.children.get(key)
+        if histogram is None:
+            histogram = METRICS.http.add(key, (request.method, resource.canonical if resource else 'unmatched'))
+        histogram.observe(time.perf_counter() - started)
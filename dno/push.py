@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import aiohttp
+
+from . import client_action
+from .client_action import ClientAction, Status
+from .dispatch import DISPATCHER, Dispatcher
+from .encoding import encode
+
+
+__all__ = ['Endpoint', 'Pusher', 'PUSHER']
+
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint:
+    # A worker webhook taking client actions of some names. New PENDING
+    # actions are POSTed to it in batches, the body being what
+    # /client_action/claim returns: {"lease", "expires_in", "client_actions"}.
+    # The worker answers them through /client_action/batch under that lease.
+
+    def __init__(
+        self,
+        url: str,
+        names: Iterable[str],
+        batch_size: int = 100,
+        window: float = 0.01,
+        concurrency: int = 4,
+        retries: int = 5,
+        backoff: float = 0.1,
+        max_backoff: float = 10.0,
+        lease: float = 60.0,
+    ):
+        self.url = url
+        self.names = list(names)
+        self.batch_size = batch_size
+        # How long a new action waits for others to share its request
+        self.window = window
+        # Requests in flight at once
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+
+        self.pushed = 0
+        self.failed = 0
+        self._buffer: Dict[str, ClientAction] = {}
+        self._in_flight = 0
+        self._handle: Optional[asyncio.Handle] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'names': self.names,
+            'batch_size': self.batch_size,
+            'window': self.window,
+            'concurrency': self.concurrency,
+            'retries': self.retries,
+            'lease': self.lease,
+            'buffered': len(self._buffer),
+            'in_flight': self._in_flight,
+            'pushed': self.pushed,
+            'failed': self.failed,
+        }
+
+    def __repr__(self):
+        return f'Endpoint({self.url}, {self.names})'
+
+
+class Pusher:
+    # Pushes client actions to the endpoints registered for their names.
+    # Pushed actions are leased like claimed ones: when a push fails for
+    # good, or the worker never answers, the lease expires and the actions
+    # are pushed again.
+
+    def __init__(self, dispatcher: Dispatcher = DISPATCHER, clock=time.monotonic):
+        self.dispatcher = dispatcher
+        self._clock = clock
+        # name -> endpoint
+        self._endpoints: Dict[str, Endpoint] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._sending: Set[asyncio.Task] = set()
+        self._closed = False
+
+    def register(self, endpoint: Endpoint):
+        # Replaces the endpoints of its names; actions PENDING already are
+        # pushed too
+        for name in endpoint.names:
+            previous = self._endpoints.get(name)
+            if previous is not None:
+                self._unregister(previous)
+            self._endpoints[name] = endpoint
+        for name in endpoint.names:
+            for ca in self.dispatcher.pending(name):
+                self.on_change(ca)
+
+    def unregister(self, url: str) -> bool:
+        endpoints = {endpoint for endpoint in self._endpoints.values() if endpoint.url == url}
+        for endpoint in endpoints:
+            self._unregister(endpoint)
+        return bool(endpoints)
+
+    def endpoints(self) -> List[Endpoint]:
+        return list({id(endpoint): endpoint for endpoint in self._endpoints.values()}.values())
+
+    def on_change(self, ca: ClientAction):
+        endpoint = self._endpoints.get(ca.name)
+        if endpoint is None:
+            return
+        if ca.status != Status.PENDING:
+            endpoint._buffer.pop(ca.id, None)
+            return
+        endpoint._buffer[ca.id] = ca
+        if len(endpoint._buffer) >= endpoint.batch_size:
+            self._flush(endpoint)
+        elif endpoint._handle is None:
+            endpoint._handle = asyncio.get_event_loop().call_later(endpoint.window, self._flush, endpoint)
+
+    async def close(self):
+        # Buffered actions stay PENDING, for the next start or for pollers
+        self._closed = True
+        for endpoint in self.endpoints():
+            if endpoint._handle is not None:
+                endpoint._handle.cancel()
+                endpoint._handle = None
+        for task in self._sending:
+            task.cancel()
+        await asyncio.gather(*self._sending, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def cleanup_ctx(self, app):
+        self._closed = False
+        yield
+        await self.close()
+
+    def _unregister(self, endpoint: Endpoint):
+        for name in endpoint.names:
+            if self._endpoints.get(name) is endpoint:
+                del self._endpoints[name]
+        if endpoint._handle is not None:
+            endpoint._handle.cancel()
+            endpoint._handle = None
+
+    def _flush(self, endpoint: Endpoint):
+        if endpoint._handle is not None:
+            endpoint._handle.cancel()
+            endpoint._handle = None
+        if self._closed:
+            return
+        while endpoint._buffer and endpoint._in_flight < endpoint.concurrency:
+            ids = list(islice(endpoint._buffer, endpoint.batch_size))
+            batch = [endpoint._buffer.pop(id) for id in ids]
+            lease = self.dispatcher.lease(batch, endpoint.lease)
+            endpoint._in_flight += 1
+            task = asyncio.ensure_future(self._send(endpoint, lease.id, lease.expires, batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, endpoint: Endpoint, lease: str, expires: float, batch: List[ClientAction]):
+        try:
+            if self._session is None:
+                self._session = aiohttp.ClientSession()
+            body = encode({
+                'lease': lease,
+                'expires_in': expires - self._clock(),
+                'client_actions': batch,
+            })
+            for attempt in range(endpoint.retries + 1):
+                if attempt:
+                    delay = min(endpoint.max_backoff, endpoint.backoff * 2 ** (attempt - 1))
+                    if self._clock() + delay >= expires:
+                        # Pushed again once the lease expires
+                        break
+                    await asyncio.sleep(delay)
+                try:
+                    async with self._session.post(
+                        endpoint.url,
+                        data=body,
+                        headers={'Content-Type': 'application/json'},
+                    ) as resp:
+                        if resp.status < 300:
+                            endpoint.pushed += len(batch)
+                            return
+                        logger.warning('Push of %d client actions to %s: %s', len(batch), endpoint.url, resp.status)
+                        if 400 <= resp.status < 500 and resp.status not in (408, 429):
+                            break
+                except aiohttp.ClientError as e:
+                    logger.warning('Push of %d client actions to %s: %r', len(batch), endpoint.url, e)
+            endpoint.failed += len(batch)
+        finally:
+            endpoint._in_flight -= 1
+            if endpoint._buffer and endpoint._handle is None:
+                self._flush(endpoint)
+
+
+PUSHER = Pusher()
+
+client_action.LISTENERS.append(PUSHER.on_change)
@@ -0,0 +1,186 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+
+__all__ = ['Limit', 'TokenBucket', 'LagMonitor', 'RateLimiter']
+
+
+class Limit:
+    # `rate` requests a second, in bursts of up to `burst` (a second's worth
+    # by default)
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else rate)
+
+    def __repr__(self):
+        return f'Limit({self.rate}, {self.burst})'
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, limit: Limit, now: float):
+        self.rate = limit.rate
+        self.burst = limit.burst
+        self.tokens = limit.burst
+        self.updated = now
+
+    def wait(self, now: float) -> float:
+        # Seconds until a token is there; 0 if it is now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class LagMonitor:
+    # Measures how late the event loop wakes up from a sleep of `interval`
+    # seconds; `lag` is the last measurement
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lag = 0.0
+
+    async def cleanup_ctx(self, app):
+        async def run():
+            loop = asyncio.get_event_loop()
+            while True:
+                started = loop.time()
+                await asyncio.sleep(self.interval)
+                self.lag = max(0.0, loop.time() - started - self.interval)
+
+        task = asyncio.ensure_future(run())
+        yield
+        task.cancel()
+
+
+class RateLimiter:
+    # Token buckets for submissions (starting use cases and posting client
+    # action results): one per domain app, per use case and per caller, the
+    # caller being the `caller_header` of the request or its address. A
+    # submission takes a token from each bucket it falls under, or gets 429
+    # with Retry-After. Beyond max_callers, the least recently seen caller's
+    # bucket is dropped. With lag_threshold, submissions get 503 while the
+    # event loop lags more than that many seconds, before the backlog grows.
+    # Batch routes are shed as a whole but charged per item, by their
+    # handler through charge().
+
+    def __init__(
+        self,
+        apps: Optional[Dict[str, Limit]] = None,
+        use_cases: Optional[Dict[Tuple[str, str], Limit]] = None,
+        callers: Optional[Limit] = None,
+        caller_header: str = 'X-Caller-Id',
+        max_callers: int = 10000,
+        lag_threshold: Optional[float] = None,
+        lag_monitor: Optional[LagMonitor] = None,
+        clock=time.monotonic,
+    ):
+        self.apps = apps or {}
+        # (domain app, use case) -> limit
+        self.use_cases = use_cases or {}
+        self.callers = callers
+        self.caller_header = caller_header
+        self.max_callers = max_callers
+        self.lag_threshold = lag_threshold
+        self.lag_monitor = lag_monitor or (LagMonitor() if lag_threshold is not None else None)
+        self._clock = clock
+
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._callers: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        # Submission route -> its domain app, filled by app_factory
+        self.routes: Dict[web.AbstractRoute, str] = {}
+        # Those of the routes submitting many items in a request
+        self.batch_routes: Set[web.AbstractRoute] = set()
+
+        self.limited = 0
+        self.shed = 0
+
+    def check(self, app: str, use_case: Optional[str], caller: Optional[str]) -> float:
+        # 0 and a token taken from each bucket, or the seconds to wait
+        now = self._clock()
+        buckets = self._get_buckets(app, use_case, caller, now)
+        wait = max((bucket.wait(now) for bucket in buckets), default=0.0)
+        if wait:
+            self.limited += 1
+            return wait
+        for bucket in buckets:
+            bucket.take()
+        return 0.0
+
+    def charge(self, request: web.Request) -> float:
+        # check() for one item of a request to a batch route
+        return self.check(
+            self.routes[request.match_info.route],
+            request.match_info.get('use_case'),
+            self._caller(request),
+        )
+
+    def lagging(self) -> bool:
+        return self.lag_threshold is not None and self.lag_monitor.lag > self.lag_threshold
+
+    def cleanup_ctx(self) -> List[Callable]:
+        return [self.lag_monitor.cleanup_ctx] if self.lag_monitor is not None else []
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler: Callable):
+        app = self.routes.get(request.match_info.route)
+        if app is None:
+            return await handler(request)
+
+        if self.lagging():
+            self.shed += 1
+            raise web.HTTPServiceUnavailable(
+                reason='Overloaded',
+                headers={'Retry-After': str(max(1, math.ceil(self.lag_monitor.lag)))},
+            )
+        if request.match_info.route in self.batch_routes:
+            return await handler(request)
+        wait = self.check(app, request.match_info.get('use_case'), self._caller(request))
+        if wait:
+            raise web.HTTPTooManyRequests(
+                reason='Rate limit exceeded',
+                headers={'Retry-After': str(max(1, math.ceil(wait)))},
+            )
+        return await handler(request)
+
+    def _caller(self, request: web.Request) -> Optional[str]:
+        return request.headers.get(self.caller_header) or request.remote
+
+    def _get_buckets(self, app: str, use_case: Optional[str], caller: Optional[str], now: float) -> List[TokenBucket]:
+        buckets = []
+        limit = self.apps.get(app)
+        if limit is not None:
+            buckets.append(self._bucket(app, limit, now))
+        if use_case is not None:
+            key = (app, use_case)
+            limit = self.use_cases.get(key)
+            if limit is not None:
+                buckets.append(self._bucket(key, limit, now))
+        if self.callers is not None and caller is not None:
+            bucket = self._callers.get(caller)
+            if bucket is None:
+                bucket = self._callers[caller] = TokenBucket(self.callers, now)
+                if len(self._callers) > self.max_callers:
+                    self._callers.popitem(last=False)
+            else:
+                self._callers.move_to_end(caller)
+            buckets.append(bucket)
+        return buckets
+
+    def _bucket(self, key: Hashable, limit: Limit, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit, now)
+        return bucket
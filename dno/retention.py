@@ -0,0 +1,180 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import use_case as use_case_module
+from .client_action import ClientAction, Storage
+from .encoding import dumps
+from .task_index import TASK_INDEX
+from .use_case import RUNNING_TASKS, UseCase
+
+
+__all__ = ['Archive', 'Retention']
+
+
+class Archive:
+    # Evicted tasks and their client actions, still fetchable by id
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS archive ('
+                'kind TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (kind, id))'
+            )
+        # Only one thread touches the connection after __init__
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dno-archive')
+
+    async def put(self, records: List[Tuple[str, str, str]]):
+        # (kind, id, JSON data) rows, in one transaction
+        await self._run(self._put, records)
+
+    async def get(self, kind: str, id: str) -> Optional[Dict[str, Any]]:
+        row = await self._run(self._get, kind, id)
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    async def close(self):
+        await self._run(self._connection.close)
+        self._executor.shutdown()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def _put(self, records: List[Tuple[str, str, str]]):
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO archive (kind, id, data) VALUES (?, ?, ?)', records)
+
+    def _get(self, kind: str, id: str) -> Optional[Tuple[str]]:
+        return self._connection.execute('SELECT data FROM archive WHERE kind = ? AND id = ?', (kind, id)).fetchone()
+
+    def __repr__(self):
+        return f'Archive({self.path})'
+
+
+class Retention:
+    # Evicts finished use cases (and their client actions) from RUNNING_TASKS
+    # and Storage: the least recently finished or fetched first, once there
+    # are more than max_count of them or they are older than max_age seconds.
+    # Eviction runs in batches of `batch` between other work on the loop.
+    # Client actions still unfinished then (left to a worker by run(), or
+    # shared with other tasks through a field cache) stay in Storage until
+    # they finish, and are archived and dropped by a later batch.
+
+    def __init__(
+        self,
+        max_age: Optional[float] = None,
+        max_count: Optional[int] = None,
+        archive: Optional[Archive] = None,
+        batch: int = 100,
+        interval: float = 1.0,
+        clock=time.monotonic,
+    ):
+        self.max_age = max_age
+        self.max_count = max_count
+        self.archive = archive
+        self.batch = batch
+        self.interval = interval
+        self._clock = clock
+        # task id -> finished or last fetched at, oldest first
+        self._finished: 'OrderedDict[str, float]' = OrderedDict()
+        # Client actions of evicted tasks still unfinished, by id
+        self._lingering: Dict[str, ClientAction] = {}
+        self.evicted = 0
+
+    def on_change(self, use_case: UseCase):
+        if use_case.is_finished():
+            self._finished[use_case.id] = self._clock()
+            self._finished.move_to_end(use_case.id)
+
+    def touch(self, task_id: str):
+        if task_id in self._finished:
+            self._finished[task_id] = self._clock()
+            self._finished.move_to_end(task_id)
+
+    def finished_count(self) -> int:
+        return len(self._finished)
+
+    async def evict(self) -> int:
+        # One batch; returns how many use cases were evicted
+        await self._retire()
+        now = self._clock()
+        expired = []
+        for task_id, finished_at in self._finished.items():
+            if len(expired) >= self.batch:
+                break
+            over_count = self.max_count is not None and len(self._finished) - len(expired) > self.max_count
+            over_age = self.max_age is not None and now - finished_at > self.max_age
+            if not over_count and not over_age:
+                break
+            expired.append(task_id)
+        if not expired:
+            return 0
+
+        use_cases = [RUNNING_TASKS[task_id] for task_id in expired if task_id in RUNNING_TASKS]
+        if self.archive is not None:
+            records = []
+            for use_case in use_cases:
+                task = use_case.as_dict()
+                task['client_actions'] = [ca.as_dict() for ca in use_case.client_actions.values()]
+                records.append(('task', use_case.id, dumps(task)))
+                records.extend(('client_action', ca['id'], dumps(ca)) for ca in task['client_actions'])
+            # Written before anything is dropped, so the records are always fetchable
+            await self.archive.put(records)
+
+        for use_case in use_cases:
+            for ca_id, client_action in use_case.client_actions.items():
+                if not client_action.is_finished():
+                    self._lingering[ca_id] = client_action
+                    continue
+                try:
+                    await Storage.delete(ca_id)
+                except KeyError:
+                    pass
+            RUNNING_TASKS.pop(use_case.id, None)
+            TASK_INDEX.remove(use_case.id)
+        for task_id in expired:
+            self._finished.pop(task_id, None)
+        self.evicted += len(expired)
+        return len(expired)
+
+    async def _retire(self):
+        # Archives and drops the lingering client actions finished since
+        finished = [ca for ca in self._lingering.values() if ca.is_finished()]
+        if not finished:
+            return
+        if self.archive is not None:
+            await self.archive.put([('client_action', ca.id, dumps(ca.as_dict())) for ca in finished])
+        for client_action in finished:
+            del self._lingering[client_action.id]
+            try:
+                await Storage.delete(client_action.id)
+            except KeyError:
+                pass
+
+    async def get_archived(self, kind: str, id: str) -> Optional[Dict[str, Any]]:
+        if self.archive is None:
+            return None
+        return await self.archive.get(kind, id)
+
+    async def run(self):
+        while True:
+            if await self.evict() < self.batch:
+                await asyncio.sleep(self.interval)
+            else:
+                # More to evict: let other tasks run between the batches
+                await asyncio.sleep(0)
+
+    async def cleanup_ctx(self, app):
+        use_case_module.LISTENERS.append(self.on_change)
+        task = asyncio.ensure_future(self.run())
+        yield
+        task.cancel()
+        use_case_module.LISTENERS.remove(self.on_change)
@@ -0,0 +1,149 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from .use_case import UseCase
+
+
+__all__ = ['QueueFull', 'Scheduler', 'DEFAULT_SCHEDULER']
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+    def __repr__(self):
+        return f'Queue is full, retry after {self.retry_after}s'
+
+
+# (-priority, sequence number, enqueued at, use case)
+Item = Tuple[int, int, float, 'UseCase']
+
+
+class Scheduler:
+    # Runs started use cases with at most `limit` of them at once (and at
+    # most UseCase.max_concurrency of one class). The rest wait in a priority
+    # queue of at most `max_queue` use cases; beyond that submit raises
+    # QueueFull instead of piling up more work.
+
+    def __init__(self, limit: Optional[int] = None, max_queue: Optional[int] = None):
+        self.limit = limit
+        self.max_queue = max_queue
+
+        self._queue: List[Item] = []
+        # Items whose class is at its max_concurrency, in priority order
+        self._blocked: Dict[type, Deque[Item]] = {}
+        self._queued = 0
+        self._sequence = itertools.count()
+
+        self._running: Set[asyncio.Task] = set()
+        self._running_by_class: Dict[type, int] = {}
+
+        self._waited_count = 0
+        self._waited_total = 0.0
+        self._waited_max = 0.0
+        self._run_count = 0
+        self._run_total = 0.0
+
+    def submit(self, use_case: 'UseCase', priority: Optional[int] = None, force: bool = False):
+        # force: queued even beyond max_queue, e.g. tasks recovered on startup
+        queue_full = self.max_queue is not None and self._queued >= self.max_queue
+        if queue_full and not force and not self._has_free_slot(type(use_case)):
+            raise QueueFull(self.retry_after())
+
+        if priority is None:
+            priority = use_case.priority
+        item = (-priority, next(self._sequence), time.monotonic(), use_case)
+        heapq.heappush(self._queue, item)
+        self._queued += 1
+        self._dispatch()
+
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def running(self) -> int:
+        return len(self._running)
+
+    def retry_after(self) -> int:
+        # Time for the running use cases to drain the queue once, by the
+        # average run duration so far
+        if not self._run_count:
+            return 1
+        average = self._run_total / self._run_count
+        return max(1, math.ceil(average * self._queued / (self.limit or len(self._running) or 1)))
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        oldest = min(
+            (item[2] for items in (self._queue, *self._blocked.values()) for item in items),
+            default=None,
+        )
+        return {
+            'limit': self.limit,
+            'max_queue': self.max_queue,
+            'running': len(self._running),
+            'queued': self._queued,
+            'oldest_queued_wait': now - oldest if oldest is not None else 0.0,
+            'started': self._waited_count,
+            'average_wait': self._waited_total / self._waited_count if self._waited_count else 0.0,
+            'max_wait': self._waited_max,
+        }
+
+    def _has_free_slot(self, cls: type) -> bool:
+        if self.limit is not None and len(self._running) >= self.limit:
+            return False
+        return cls.max_concurrency is None or self._running_by_class.get(cls, 0) < cls.max_concurrency
+
+    def _dispatch(self):
+        while self._queue and (self.limit is None or len(self._running) < self.limit):
+            item = heapq.heappop(self._queue)
+            cls = type(item[3])
+            if cls.max_concurrency is not None and self._running_by_class.get(cls, 0) >= cls.max_concurrency:
+                self._blocked.setdefault(cls, deque()).append(item)
+                continue
+            self._start(item)
+
+    def _start(self, item: Item):
+        _, _, enqueued, use_case = item
+        cls = type(use_case)
+        self._queued -= 1
+        self._running_by_class[cls] = self._running_by_class.get(cls, 0) + 1
+
+        waited = time.monotonic() - enqueued
+        self._waited_count += 1
+        self._waited_total += waited
+        self._waited_max = max(self._waited_max, waited)
+
+        task = asyncio.ensure_future(self._run(use_case))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, use_case: 'UseCase'):
+        cls = type(use_case)
+        started = time.monotonic()
+        try:
+            await use_case.execute()
+        finally:
+            self._run_count += 1
+            self._run_total += time.monotonic() - started
+
+            self._running_by_class[cls] -= 1
+            if not self._running_by_class[cls]:
+                del self._running_by_class[cls]
+            blocked = self._blocked.get(cls)
+            if blocked:
+                heapq.heappush(self._queue, blocked.popleft())
+                if not blocked:
+                    del self._blocked[cls]
+            # The finished task is still counted as running until its done
+            # callback, so make room for the next one explicitly
+            self._running.discard(asyncio.current_task())
+            self._dispatch()
+
+
+DEFAULT_SCHEDULER = Scheduler()
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from .client_action import ClientAction, Status, StorageBackend
+
+
+__all__ = ['SQLiteStorage']
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS client_action (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        status TEXT NOT NULL,
+        args TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        task_id TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS client_action_status ON client_action (status)',
+    'CREATE INDEX IF NOT EXISTS client_action_name ON client_action (name)',
+    'CREATE INDEX IF NOT EXISTS client_action_task_id ON client_action (task_id)',
+)
+
+# Added to tables created before them, as (name, definition)
+MIGRATIONS = (
+    ('task_id', 'task_id TEXT'),
+)
+
+COLUMNS = 'id, name, status, args, result, error, task_id'
+
+Row = Tuple[str, str, str, str, Optional[str], Optional[str], Optional[str]]
+
+
+def _dumps(value) -> Optional[str]:
+    if value is None:
+        return None
+    return json.dumps(value, default=str)
+
+
+def _loads(value: Optional[str]):
+    if value is None:
+        return None
+    return json.loads(value)
+
+
+def to_row(client_action: ClientAction) -> Row:
+    return (
+        client_action.id,
+        client_action.name,
+        client_action.status.value,
+        _dumps(client_action.args),
+        _dumps(client_action.result),
+        _dumps(client_action.error),
+        client_action.task_id,
+    )
+
+
+def from_row(row: Row) -> ClientAction:
+    id, name, status, args, result, error, task_id = row
+    client_action = ClientAction(name, id, _loads(args), Status(status), task_id=task_id)
+    client_action.result = _loads(result)
+    client_action.error = _loads(error)
+    return client_action
+
+
+class SQLiteStorage(StorageBackend):
+    # Writes made while a transaction is in flight are queued and committed
+    # together by the next one, so many concurrent ClientActionField calls
+    # cost a single commit. Unfinished actions stay in memory: the use case
+    # waiting on an action and the worker updating it share one object.
+    # When a transaction fails, the add() calls waiting on it raise and its
+    # writes are queued again, for the next transaction or flush() to retry.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.execute(SCHEMA[0])
+            columns = {row[1] for row in self._connection.execute('PRAGMA table_info(client_action)')}
+            for column, definition in MIGRATIONS:
+                if column not in columns:
+                    self._connection.execute(f'ALTER TABLE client_action ADD COLUMN {definition}')
+            for statement in SCHEMA[1:]:
+                self._connection.execute(statement)
+
+        # Only one thread touches the connection after __init__
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dno-sqlite')
+        self._live: Dict[str, ClientAction] = {}
+        # id -> action to upsert, or None to delete
+        self._pending: Dict[str, Optional[ClientAction]] = {}
+        self._batch: Optional[asyncio.Future] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def get(self, id: str) -> ClientAction:
+        if id in self._live:
+            return self._live[id]
+        if id in self._pending:
+            client_action = self._pending[id]
+            if client_action is None:
+                raise KeyError(id)
+            return client_action
+
+        rows = await self._query(f'SELECT {COLUMNS} FROM client_action WHERE id = ?', (id,))
+        if not rows:
+            raise KeyError(id)
+        return self._restore(rows[0])
+
+    async def add(self, client_action: ClientAction):
+        self._live[client_action.id] = client_action
+        await self._schedule(client_action.id, client_action)
+
+    async def delete(self, id: str):
+        if id not in self._live and id not in self._pending:
+            await self.get(id)  # KeyError like the in-memory backend
+        self._live.pop(id, None)
+        await self._schedule(id, None)
+
+    def update(self, client_action: ClientAction):
+        self._live[client_action.id] = client_action
+        self._schedule(client_action.id, client_action)
+
+    async def find(
+        self,
+        status: Optional[Status] = None,
+        name: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[ClientAction]:
+        await self.flush()
+
+        conditions, params = [], []
+        if status is not None:
+            conditions.append('status = ?')
+            params.append(status.value)
+        if name is not None:
+            conditions.append('name = ?')
+            params.append(name)
+        sql = f'SELECT {COLUMNS} FROM client_action'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        rows = await self._query(sql, tuple(params))
+        return [self._restore(row) for row in rows]
+
+    async def flush(self):
+        if self._pending and self._batch is None:
+            # Left by a failed transaction
+            self._schedule_write()
+        if self._batch is not None:
+            await asyncio.shield(self._batch)
+        if self._writer is not None and not self._writer.done():
+            await asyncio.shield(self._writer)
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            await asyncio.get_event_loop().run_in_executor(self._executor, self._connection.close)
+            self._executor.shutdown()
+
+    def _restore(self, row: Row) -> ClientAction:
+        id = row[0]
+        if id in self._live:
+            return self._live[id]
+        client_action = from_row(row)
+        if not client_action.is_finished():
+            self._live[id] = client_action
+        return client_action
+
+    async def _query(self, sql: str, params: tuple) -> List[Row]:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self._execute_query, sql, params)
+
+    def _execute_query(self, sql: str, params: tuple) -> List[Row]:
+        return self._connection.execute(sql, params).fetchall()
+
+    def _schedule(self, id: str, client_action: Optional[ClientAction]) -> asyncio.Future:
+        self._pending[id] = client_action
+        return self._schedule_write()
+
+    def _schedule_write(self) -> asyncio.Future:
+        if self._batch is None:
+            loop = asyncio.get_event_loop()
+            self._batch = loop.create_future()
+            self._batch.add_done_callback(_log_batch_error)
+            if self._writer is None or self._writer.done():
+                self._writer = loop.create_task(self._write())
+        return self._batch
+
+    async def _write(self):
+        loop = asyncio.get_event_loop()
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            batch, self._batch = self._batch, None
+
+            # Rows are built on the loop thread, so the transaction writes a
+            # consistent snapshot of every action
+            upserts = [to_row(ca) for ca in pending.values() if ca is not None]
+            deletes = [(id,) for id, ca in pending.items() if ca is None]
+            try:
+                await loop.run_in_executor(self._executor, self._execute_write, upserts, deletes)
+            except Exception as e:
+                # Queued again behind newer writes of the same actions, and
+                # retried with the writes queued meanwhile if any, or else by
+                # the next write or flush()
+                for id, client_action in pending.items():
+                    self._pending.setdefault(id, client_action)
+                batch.set_exception(e)
+                if self._batch is None:
+                    return
+                continue
+            batch.set_result(None)
+
+            for id, client_action in pending.items():
+                if client_action is not None and client_action.is_finished() and id not in self._pending:
+                    self._live.pop(id, None)
+
+    def _execute_write(self, upserts: List[Row], deletes: List[Tuple[str]]):
+        with self._connection:
+            if upserts:
+                self._connection.executemany(
+                    f'INSERT OR REPLACE INTO client_action ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    upserts,
+                )
+            if deletes:
+                self._connection.executemany('DELETE FROM client_action WHERE id = ?', deletes)
+
+    def __repr__(self):
+        return f'SQLiteStorage({self.path})'
+
+
+def _log_batch_error(batch: asyncio.Future):
+    if not batch.cancelled() and batch.exception() is not None:
+        logger.error('Failed to write client actions', exc_info=batch.exception())
@@ -0,0 +1,147 @@
+import itertools
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Optional, Tuple
+
+from . import use_case as use_case_module
+from .use_case import Status, UseCase
+
+
+__all__ = ['TaskIndex', 'TASK_INDEX']
+
+
+class Entry:
+    __slots__ = ('seq', 'created', 'app', 'use_case', 'status')
+
+    def __init__(self, seq: int, created: float, app: str, use_case: str, status: Status):
+        self.seq = seq
+        self.created = created
+        self.app = app
+        self.use_case = use_case
+        self.status = status
+
+    def as_dict(self):
+        return {'use_case': self.use_case, 'status': self.status.value, 'created': self.created}
+
+
+class TaskIndex:
+    # Started use cases by domain app, use case name and status, each index a
+    # sorted list of sequence numbers (creation order). A page is found by
+    # bisection, so its cost doesn't depend on how many tasks are stored;
+    # the cursor of a page is the sequence number it ends at, so new tasks
+    # don't shift later pages. Newest tasks come first.
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._sequence = itertools.count()
+        self._entries: Dict[str, Entry] = {}
+        self._ids: Dict[int, str] = {}
+        # (app,), (app, 'use_case', name) or (app, 'status', status) -> sorted seqs
+        self._indexes: Dict[Tuple, List[int]] = {}
+        # All seqs and their creation times, both sorted: maps a time to a seq
+        self._seqs: List[int] = []
+        self._created: List[float] = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def on_change(self, use_case: UseCase):
+        entry = self._entries.get(use_case.id)
+        if entry is None:
+            self._add(use_case)
+        elif entry.status != use_case.status:
+            self._discard((entry.app, 'status', entry.status), entry.seq)
+            entry.status = use_case.status
+            insort(self._indexes.setdefault((entry.app, 'status', entry.status), []), entry.seq)
+
+    def remove(self, task_id: str):
+        entry = self._entries.pop(task_id, None)
+        if entry is None:
+            return
+        del self._ids[entry.seq]
+        for key in self._keys(entry):
+            self._discard(key, entry.seq)
+        i = bisect_left(self._seqs, entry.seq)
+        del self._seqs[i]
+        del self._created[i]
+
+    def get(self, task_id: str) -> Optional[Entry]:
+        return self._entries.get(task_id)
+
+    def query(
+        self,
+        app: str,
+        use_case: Optional[str] = None,
+        status: Optional[Status] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        cursor: Optional[int] = None,
+        limit: int = 100,
+    ) -> Tuple[List[str], Optional[int]]:
+        # Returns task ids of the page and the cursor of the next one (None
+        # for the last page). With both use_case and status the smaller
+        # index is walked and filtered by the other.
+        candidates = [self._indexes.get((app,), [])]
+        if use_case is not None:
+            candidates.append(self._indexes.get((app, 'use_case', use_case), []))
+        if status is not None:
+            candidates.append(self._indexes.get((app, 'status', status), []))
+        seqs = min(candidates[1:] or candidates, key=len)
+
+        # Seqs in [low, high)
+        low, high = 0, len(self._ids) and self._seqs[-1] + 1
+        if created_after is not None:
+            i = bisect_right(self._created, created_after)
+            low = self._seqs[i] if i < len(self._seqs) else high
+        if created_before is not None:
+            i = bisect_left(self._created, created_before)
+            high = min(high, self._seqs[i] if i < len(self._seqs) else high)
+        if cursor is not None:
+            high = min(high, cursor)
+
+        page = []
+        i = bisect_left(seqs, high)
+        while i > 0 and len(page) < limit:
+            i -= 1
+            seq = seqs[i]
+            if seq < low:
+                break
+            entry = self._entries[self._ids[seq]]
+            if use_case is not None and entry.use_case != use_case:
+                continue
+            if status is not None and entry.status != status:
+                continue
+            page.append(seq)
+
+        next_cursor = page[-1] if len(page) == limit and i > 0 and seqs[i - 1] >= low else None
+        return [self._ids[seq] for seq in page], next_cursor
+
+    def _add(self, use_case: UseCase):
+        seq = next(self._sequence)
+        # Kept non-decreasing, so times can be bisected along with seqs
+        created = self._clock()
+        if self._created and created < self._created[-1]:
+            created = self._created[-1]
+        entry = Entry(seq, created, use_case.domain_app, use_case.__class__.__name__, use_case.status)
+        self._entries[use_case.id] = entry
+        self._ids[seq] = use_case.id
+        self._seqs.append(seq)
+        self._created.append(created)
+        for key in self._keys(entry):
+            # The newest seq, so appending keeps the index sorted
+            self._indexes.setdefault(key, []).append(seq)
+
+    @staticmethod
+    def _keys(entry: Entry):
+        return (entry.app,), (entry.app, 'use_case', entry.use_case), (entry.app, 'status', entry.status)
+
+    def _discard(self, key: Tuple, seq: int):
+        seqs = self._indexes[key]
+        del seqs[bisect_left(seqs, seq)]
+        if not seqs:
+            del self._indexes[key]
+
+
+TASK_INDEX = TaskIndex()
+
+use_case_module.LISTENERS.append(TASK_INDEX.on_change)
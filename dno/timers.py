@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Callable, List, Optional
+
+
+__all__ = ['Timer', 'TimerWheel', 'TIMERS']
+
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'cancelled', '_wheel')
+
+    def __init__(self, wheel: 'TimerWheel', deadline: float, callback: Callable[[], None]):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+        self._wheel = wheel
+
+    def cancel(self):
+        # The timer stays in its slot until the slot comes up, or the wheel
+        # goes idle, then it's dropped; what it would call is let go now
+        if not self.cancelled:
+            self.cancelled = True
+            self.callback = None
+            self._wheel._count -= 1
+
+    def __repr__(self):
+        return f'Timer({self.deadline}, {self.callback})'
+
+
+class TimerWheel:
+    # Hierarchical timing wheel: `levels` wheels of `slots` slots each,
+    # a slot of level n spanning tick * slots ** n seconds. Scheduling and
+    # cancelling are O(1); a timer is moved down a level at most `levels`
+    # times before it fires. Timers due further out than the wheels reach
+    # wait in the last slot and are scheduled again when it comes up.
+    # The whole wheel is driven by one loop.call_later per tick, and only
+    # while it has timers.
+
+    def __init__(self, tick: float = 0.1, slots: int = 256, levels: int = 4, clock=time.monotonic):
+        if slots & (slots - 1):
+            raise ValueError('slots must be a power of two')
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._clock = clock
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._wheels: List[List[List[Timer]]] = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._origin = clock()
+        # Ticks since origin that have been processed
+        self._current = 0
+        # Timers scheduled, and timers in the slots, cancelled ones included
+        self._count = 0
+        self._stored = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, deadline: float, callback: Callable[[], None]) -> Timer:
+        # Calls callback() once the clock passes deadline, at most a tick late
+        if self._handle is None:
+            # Idle since the last timer: no ticks to catch up with
+            self._current = int((self._clock() - self._origin) / self.tick)
+        timer = Timer(self, deadline, callback)
+        self._insert(timer)
+        self._count += 1
+        self._stored += 1
+        if self._handle is None:
+            self._handle = asyncio.get_event_loop().call_later(self.tick, self._on_tick)
+        return timer
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> Timer:
+        return self.schedule(self._clock() + delay, callback)
+
+    def advance(self) -> int:
+        # Fires the timers due by now; returns how many fired
+        fired = 0
+        now_tick = int((self._clock() - self._origin) / self.tick)
+        while self._current < now_tick and self._count:
+            self._current += 1
+            self._cascade(1)
+            slot = self._wheels[0][self._current & self._mask]
+            if not slot:
+                continue
+            self._wheels[0][self._current & self._mask] = []
+            for timer in slot:
+                if timer.cancelled:
+                    self._stored -= 1
+                    continue
+                if timer.deadline > self._clock():
+                    # Beyond the reach of the wheels when scheduled
+                    self._insert(timer)
+                    continue
+                self._count -= 1
+                self._stored -= 1
+                callback, timer.callback = timer.callback, None
+                timer.cancelled = True
+                fired += 1
+                try:
+                    callback()
+                except Exception:
+                    logger.exception('Timer callback %r failed', callback)
+        if not self._count:
+            # Idle: nothing to catch up with when the next timer comes
+            self._current = now_tick
+            if self._stored:
+                self._purge()
+        return fired
+
+    def _purge(self):
+        # Drops the cancelled timers left in the slots
+        for wheel in self._wheels:
+            for index in range(self.slots):
+                wheel[index] = []
+        self._stored = 0
+
+    def _on_tick(self):
+        self._handle = None
+        self.advance()
+        if self._count:
+            self._handle = asyncio.get_event_loop().call_later(self.tick, self._on_tick)
+
+    def _insert(self, timer: Timer, cascading: bool = False):
+        expires = math.ceil((timer.deadline - self._origin) / self.tick)
+        # Never into a slot already processed: while cascading the slot of
+        # the current tick is still to come
+        expires = max(expires, self._current if cascading else self._current + 1)
+        delta = expires - self._current
+        for level in range(self.levels):
+            if delta < 1 << (self._bits * (level + 1)):
+                self._wheels[level][(expires >> (self._bits * level)) & self._mask].append(timer)
+                return
+        # Out of reach: the last slot of the top level before it comes round
+        level = self.levels - 1
+        expires = self._current + (1 << (self._bits * self.levels)) - 1
+        self._wheels[level][(expires >> (self._bits * level)) & self._mask].append(timer)
+
+    def _cascade(self, level: int):
+        # When a level wraps, the next slot of the level above is spread
+        # over the levels below
+        if level >= self.levels or (self._current >> (self._bits * (level - 1))) & self._mask:
+            return
+        self._cascade(level + 1)
+        index = (self._current >> (self._bits * level)) & self._mask
+        slot = self._wheels[level][index]
+        if not slot:
+            return
+        self._wheels[level][index] = []
+        for timer in slot:
+            if not timer.cancelled:
+                self._insert(timer, cascading=True)
+
+
+TIMERS = TimerWheel()
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+
+__all__ = [
+    'Span', 'Tracer', 'TRACER', 'SpanExporter', 'MemoryExporter', 'FileExporter', 'tracing_middleware',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = (
+        'tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'events',
+        'start', 'end', 'status',
+    )
+
+    sampled = True
+
+    def __init__(
+        self,
+        tracer: 'Tracer',
+        trace_id: str,
+        parent_id: Optional[str],
+        name: str,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes if attributes is not None else {}
+        self.events: Optional[List[Tuple[str, float]]] = None
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.status = 'OK'
+
+    def event(self, name: str):
+        if self.events is None:
+            self.events = []
+        self.events.append((name, time.time()))
+
+    def finish(self, status: str = 'OK'):
+        if self.end is not None:
+            return
+        self.end = time.time()
+        self.status = status
+        self.tracer._finished(self)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.end - self.start if self.end is not None else None,
+            'status': self.status,
+            'attributes': self.attributes,
+            'events': [{'name': name, 'time': at} for name, at in self.events or ()],
+        }
+
+    def __repr__(self):
+        return f'Span({self.name}, {self.trace_id}, {self.span_id})'
+
+
+class _NotSampled:
+    # Stands for every span of a trace that wasn't sampled: its children
+    # aren't sampled either, and everything it's asked to do costs a call
+    __slots__ = ()
+
+    sampled = False
+
+    def event(self, name: str):
+        pass
+
+    def finish(self, status: str = 'OK'):
+        pass
+
+    def __repr__(self):
+        return 'NOT_SAMPLED'
+
+
+NOT_SAMPLED = _NotSampled()
+
+_CURRENT: ContextVar[Optional[Any]] = ContextVar('dno_span', default=None)
+
+# start_span(parent=CURRENT): the span of the running context
+CURRENT = object()
+
+
+class SpanExporter:
+    async def export(self, spans: List[Span]):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryExporter(SpanExporter):
+    def __init__(self):
+        self.spans: List[Dict[str, Any]] = []
+
+    async def export(self, spans: List[Span]):
+        self.spans.extend(span.as_dict() for span in spans)
+
+
+class FileExporter(SpanExporter):
+    # One JSON object per span and line, appended in a thread
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dno-trace')
+
+    async def export(self, spans: List[Span]):
+        await asyncio.get_event_loop().run_in_executor(self._executor, self._write, spans)
+
+    async def close(self):
+        await asyncio.get_event_loop().run_in_executor(self._executor, self._file.close)
+        self._executor.shutdown()
+
+    def _write(self, spans: List[Span]):
+        self._file.write(''.join(json.dumps(span.as_dict(), default=str) + '\n' for span in spans))
+        self._file.flush()
+
+    def __repr__(self):
+        return f'FileExporter({self.path})'
+
+
+class Tracer:
+    # Starts a trace for sample_rate of the roots (HTTP requests, or use
+    # cases and client actions started outside of one); spans of a trace
+    # follow its root. Finished spans are buffered and exported in batches
+    # of batch_size or every interval seconds; beyond max_queue buffered
+    # spans new ones are dropped. With sample_rate 0 (the default) a span
+    # is one comparison.
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        exporter: Optional[SpanExporter] = None,
+        batch_size: int = 512,
+        interval: float = 1.0,
+        max_queue: int = 10000,
+        random: Callable[[], float] = random.random,
+    ):
+        self.configure(sample_rate, exporter)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self._random = random
+        self._buffer: List[Span] = []
+        self._flushing: Optional[asyncio.Future] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    def configure(self, sample_rate: float, exporter: Optional[SpanExporter] = None):
+        self.sample_rate = sample_rate if exporter is not None else 0.0
+        self.exporter = exporter
+
+    def current(self):
+        return _CURRENT.get()
+
+    def start_span(self, name: str, parent=CURRENT, attributes: Optional[Dict[str, Any]] = None):
+        # A Span, or NOT_SAMPLED
+        if parent is CURRENT:
+            parent = _CURRENT.get()
+        if parent is None:
+            if not self.sample_rate or self._random() >= self.sample_rate:
+                return NOT_SAMPLED
+            return Span(self, '%032x' % random.getrandbits(128), None, name, attributes)
+        if parent is NOT_SAMPLED:
+            return NOT_SAMPLED
+        return Span(self, parent.trace_id, parent.span_id, name, attributes)
+
+    def activate(self, span):
+        # Makes span the parent of spans started in this context; returns the
+        # token for deactivate()
+        return _CURRENT.set(span)
+
+    def deactivate(self, token):
+        _CURRENT.reset(token)
+
+    async def flush(self):
+        if self._flushing is not None:
+            await asyncio.shield(self._flushing)
+        while self._buffer:
+            spans, self._buffer = self._buffer, []
+            self._flushing = asyncio.ensure_future(self._export(spans))
+            try:
+                await asyncio.shield(self._flushing)
+            finally:
+                self._flushing = None
+
+    async def cleanup_ctx(self, app):
+        async def run():
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush()
+
+        task = asyncio.ensure_future(run())
+        yield
+        task.cancel()
+        await self.flush()
+        if self.exporter is not None:
+            await self.exporter.close()
+        self.configure(0.0)
+
+    def _finished(self, span: Span):
+        if len(self._buffer) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._buffer.append(span)
+        if len(self._buffer) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def _export(self, spans: List[Span]):
+        try:
+            await self.exporter.export(spans)
+        except Exception:
+            logger.exception('Can\'t export %d spans to %r', len(spans), self.exporter)
+
+
+TRACER = Tracer()
+
+
+@web.middleware
+async def tracing_middleware(request: web.Request, handler: Callable):
+    span = TRACER.start_span('HTTP')
+    if not span.sampled:
+        return await handler(request)
+
+    resource = request.match_info.route.resource
+    span.name = f'{request.method} {resource.canonical if resource else "unmatched"}'
+    span.attributes['http.method'] = request.method
+    span.attributes['http.path'] = request.path
+    token = TRACER.activate(span)
+    status = 'OK'
+    try:
+        response = await handler(request)
+        span.attributes['http.status'] = response.status
+        return response
+    except web.HTTPException as e:
+        span.attributes['http.status'] = e.status
+        raise
+    except BaseException as e:
+        status = 'ERROR'
+        span.attributes['error'] = repr(e)
+        raise
+    finally:
+        TRACER.deactivate(token)
+        span.finish(status)
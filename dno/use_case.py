@@ -1,22 +1,36 @@
 import asyncio
 import inspect
+import os
+import time
 from abc import ABCMeta, abstractmethod
 from enum import Enum
 from typing import Any, Dict, Optional
-from uuid import uuid4
 
 from pydantic import BaseModel
 
-# from . import client_action
+from .client_action import ClientActionField
+from .scheduler import DEFAULT_SCHEDULER, Scheduler
+from .timers import TIMERS
+from .tracing import TRACER
+from .validation import arguments_model, compile_validator
 
 
 __all__ = ['UseCase', 'Status']
 
 
+# domain app -> use case name -> class. The domain app of a use case is the
+# top-level package it is defined in (test_app.use_cases -> test_app),
+# unless the class sets domain_app itself.
 REGISTERED = {}
 
 RUNNING_TASKS = {}
 
+# Annotations of UseCase which are not arguments of use cases
+NOT_ARGUMENTS = {'id', 'status', 'result', 'error'}
+
+# Called with the use case on every status transition
+LISTENERS = []
+
 
 class Status(Enum):
     PENDING = 'PENDING'
@@ -31,42 +45,231 @@ class UseCase(metaclass=ABCMeta):
     error: Optional[Dict[str, Any]]
     result: Optional[BaseModel]
 
+    # Not annotated, so they are not taken for arguments:
+    # default priority in the scheduler queue (higher runs first)
+    priority = 0
+    # at most this many use cases of the class run at once
+    max_concurrency = None
+    # seconds from start() to fail with a Timeout error, unless finished
+    timeout = None
+    # submissions with the same arguments as a recent one return its task
+    # instead of starting another (see dno.idempotency)
+    deduplicate = False
+
+    # State of a use case, on the class until an instance sets its own, so
+    # creating one costs only its arguments, id and client_actions:
+    # index of a client action call in run() -> its recorded outcome, fed
+    # back instead of issuing the action again (see dno.journal); only ever
+    # replaced on an instance, never changed here
+    replay = {}
+    # ClientActionField calls made by run() so far: the position of the
+    # next one, cache hits included
+    calls = 0
+    # Monotonic times of start(), of the scheduler running it and of the end
+    queued_at = None
+    started_at = None
+    finished_at = None
+    # Span of the request that started it, the parent of its trace
+    trace_parent = None
+    # Task running run(), the deadline timer and whether cancel() was called
+    _task = None
+    _timer = None
+    _cancelled = False
+
     def __init_subclass__(cls, **kwargs):
+        if 'domain_app' not in cls.__dict__:
+            cls.domain_app = cls.__module__.split('.')[0]
+        # Arguments are validated by a model compiled once per class. Set on
+        # the instance, they would replace the attributes of the framework
+        # (a `timeout` argument would become the deadline), so such names
+        # are refused before the class is registered.
+        cls.arguments_model = arguments_model(cls, UseCase, NOT_ARGUMENTS)
+        clashes = sorted(name for name in cls.arguments_model.__fields__ if name in RESERVED)
+        if clashes:
+            raise Exception('Arguments clash with UseCase attributes', cls.__name__, clashes)
         if not inspect.isabstract(cls):
             if not cls.__annotations__.get('result') or \
                     not issubclass(cls.__annotations__.get('result'), BaseModel):
                 raise Exception('No result type', cls.__name__, cls.__annotations__)
 
-            REGISTERED[cls.__name__] = cls
+            use_cases = REGISTERED.setdefault(cls.domain_app, {})
+            registered = use_cases.get(cls.__name__)
+            if registered is not None and registered.__module__ != cls.__module__:
+                raise Exception('Use case is already registered', cls.domain_app, cls.__name__, registered)
+            use_cases[cls.__name__] = cls
+
+        cls._validate_arguments = staticmethod(compile_validator(cls.arguments_model))
+        cls._span_name = f'use_case {cls.domain_app}.{cls.__name__}'
+        if not inspect.isabstract(cls):
+            # Served by GET /{app}/call/{use_case}; generated once, here
+            cls.json_schema = _json_schema(cls)
 
     def __init__(self, **kwargs):
-        # Check args of __init__
-        annotations = set(self.__annotations__.keys())
-        for k, v in kwargs.items():
-            type_ = self.__annotations__[k]
-            if not isinstance(v, type_):
-                raise RuntimeError(f'Value "{v}" is not instance of class {type_}')
-            setattr(self, k, v)
-            annotations.remove(k)
-
-        annotations -= {'id', 'status', 'result', 'error'}
-        if annotations:
-            raise RuntimeError(
-                f'Not all arguments are got in instance.__init__ of class {self.__class__}: {annotations}'
-            )
+        # Raises pydantic.ValidationError for missing, unknown or bad arguments
+        self.__dict__.update(self._validate_arguments(kwargs))
 
-        self.id = uuid4().hex
+        self.id = os.urandom(16).hex()
+        self.client_actions = {}
 
     @abstractmethod
     async def run(self):
         pass
 
-    async def start(self):
-        if self.status != Status.PENDING:
+    async def start(
+        self,
+        scheduler: Optional[Scheduler] = None,
+        priority: Optional[int] = None,
+        timeout: Optional[float] = None,
+        force: bool = False,
+    ):
+        if self.status != Status.PENDING or self.id in RUNNING_TASKS:
             raise Exception('Can\'t start use case twice')
 
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.run())
+        # May raise QueueFull (unless forced), then the use case is not started
+        (scheduler or DEFAULT_SCHEDULER).submit(self, priority, force)
         RUNNING_TASKS[self.id] = self
+        self.trace_parent = TRACER.current()
+        # Queued
+        self.queued_at = time.monotonic()
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is not None:
+            self._timer = TIMERS.call_later(
+                timeout, lambda: self.cancel('Timeout', f'Not finished in {timeout}s'),
+            )
+        self._set_status(Status.PENDING)
+
+    def cancel(self, reason: str = 'Cancelled', message: str = 'Cancelled') -> bool:
+        # Fails the use case with {"type": reason, "message": message}: a
+        # queued one is never run, a running one has run() cancelled. Its
+        # unfinished client actions fail the same way. False if it had
+        # finished already.
+        if self.is_finished() or self._cancelled:
+            return False
+        self._cancelled = True
+        self.error = {'type': reason, 'message': message}
+        self._release_client_actions(abort=True)
+
+        if self._task is not None:
+            # execute() sets the status once run() is out
+            self._task.cancel()
+        else:
+            self.finished_at = time.monotonic()
+            self._set_status(Status.FAILED)
+        return True
+
+    async def execute(self):
+        # Called by the scheduler when the use case gets its turn
+        if self.is_finished():
+            # Cancelled while queued
+            return
+        self._task = asyncio.current_task()
+        self.started_at = time.monotonic()
+        span = TRACER.start_span(self._span_name, parent=self.trace_parent)
+        if span.sampled:
+            span.attributes['task.id'] = self.id
+            if self.queued_at is not None:
+                span.attributes['queued'] = self.started_at - self.queued_at
+        token = TRACER.activate(span)
+        self._set_status(Status.RUNNING)
+        try:
+            result = await self.run()
+            if self._cancelled:
+                # run() swallowed the cancellation
+                raise asyncio.CancelledError
+            result_type = self.__annotations__['result']
+            if not isinstance(result, result_type):
+                result = result_type.parse_obj(result)
+        except asyncio.CancelledError:
+            if not self._cancelled:
+                raise
+            if hasattr(self._task, 'uncancel'):
+                self._task.uncancel()
+            self.finished_at = time.monotonic()
+            self._set_status(Status.FAILED)
+            span.finish('ERROR')
+        except Exception as e:
+            self.error = {'type': e.__class__.__name__, 'message': str(e)}
+            # Left behind by run(), they would still be handed to workers
+            self._release_client_actions(abort=True)
+            self.finished_at = time.monotonic()
+            self._set_status(Status.FAILED)
+            span.finish('ERROR')
+        else:
+            self.result = result
+            self._release_client_actions(abort=False)
+            self.finished_at = time.monotonic()
+            self._set_status(Status.FINISHED)
+            span.finish()
+        finally:
+            self._task = None
+            TRACER.deactivate(token)
+
+    def is_finished(self):
+        return self.status in (
+            Status.FINISHED,
+            Status.FAILED,
+        )
+
+    def _release_client_actions(self, abort: bool):
+        # This task no longer waits on its unfinished client actions. With
+        # abort, those it issued fail with its error, unless other callers
+        # got them from a field cache and still wait on them.
+        for client_action in list(self.client_actions.values()):
+            if client_action.is_finished():
+                continue
+            if client_action.holders is not None:
+                client_action.holders.discard(self.id)
+                if client_action.holders:
+                    continue
+            elif client_action.task_id != self.id:
+                continue
+            if abort:
+                client_action.abort(dict(self.error))
+
+    def _set_status(self, status: Status):
+        self.status = status
+        if self._timer is not None and self.is_finished():
+            self._timer.cancel()
+            self._timer = None
+        for listener in LISTENERS:
+            listener(self)
+
+    def arguments(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.arguments_model.__fields__}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'use_case': self.__class__.__name__,
+            'status': self.status.value,
+            'result': getattr(self, 'result', None),
+            'error': getattr(self, 'error', None),
+            'client_actions': list(self.client_actions),
+        }
+
+
+# Names of UseCase attributes and methods, which arguments can't take
+RESERVED = frozenset(dir(UseCase)) | {'domain_app', 'arguments_model', 'json_schema'}
+
+
+def _json_schema(cls) -> Dict[str, Any]:
+    # JSON schemas of the arguments, the result and the client actions of a
+    # use case
+    client_actions = {}
+    for attr in dir(cls):
+        field = inspect.getattr_static(cls, attr)
+        if isinstance(field, ClientActionField):
+            client_actions[attr] = {
+                'name': field.name,
+                'args': field.args.schema(),
+                'result': field.result.schema(),
+            }
+    return {
+        'name': cls.__name__,
+        'domain_app': cls.domain_app,
+        'arguments': cls.arguments_model.schema(),
+        'result': cls.__annotations__['result'].schema(),
+        'client_actions': client_actions,
+    }
 
-        self.status = Status.RUNNING  # TODO ???? Возможно это все не нужно, чтобы запускать из базы данных объекты
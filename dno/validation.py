@@ -0,0 +1,74 @@
+from typing import Any, Callable, ClassVar, Dict, Type, get_origin
+
+from pydantic import BaseModel, Extra, create_model, validate_model
+
+
+__all__ = ['Validator', 'compile_validator', 'arguments_model']
+
+
+Validator = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+# Values of exactly these types pass pydantic unchanged
+SCALARS = (str, int, float, bool, bytes)
+
+
+def compile_validator(model: Type[BaseModel]) -> Validator:
+    # kwargs -> validated values, without building a model instance.
+    # When every field is a required scalar, kwargs with exactly those keys
+    # and exact types are returned as is instead of going through pydantic.
+    fields = model.__fields__
+    scalars = {
+        name: field.outer_type_
+        for name, field in fields.items()
+        if field.required and field.outer_type_ in SCALARS and not field.class_validators
+    }
+    if len(scalars) != len(fields) or model.__pre_root_validators__ or model.__post_root_validators__ \
+            or _changes_strings(model.__config__):
+        scalars = None
+
+    def validate(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        if scalars is not None and len(kwargs) == len(scalars):
+            for name, value in kwargs.items():
+                if scalars.get(name) is not type(value):
+                    break
+            else:
+                return dict(kwargs)
+
+        values, _, error = validate_model(model, kwargs)
+        if error is not None:
+            raise error
+        return values
+
+    return validate
+
+
+def _changes_strings(config) -> bool:
+    # Whether pydantic may change or reject a str or bytes value of the
+    # exact type, by the model config
+    return bool(
+        getattr(config, 'anystr_strip_whitespace', False)
+        or getattr(config, 'anystr_lower', False)
+        or getattr(config, 'anystr_upper', False)
+        or getattr(config, 'min_anystr_length', None)
+        or getattr(config, 'max_anystr_length', None) is not None
+    )
+
+
+class ForbidExtra:
+    extra = Extra.forbid
+
+
+def arguments_model(cls: type, base: type, exclude) -> Type[BaseModel]:
+    # Model of the annotated attributes of cls and its bases up to base,
+    # with class attribute values as defaults. Defaults come from those
+    # classes only, never from base or above.
+    classes = cls.__mro__[:cls.__mro__.index(base)]
+    fields = {}
+    for klass in reversed(classes):
+        for name, type_ in klass.__dict__.get('__annotations__', {}).items():
+            if name in exclude or name.startswith('_') or get_origin(type_) is ClassVar:
+                continue
+            default = next((k.__dict__[name] for k in classes if name in k.__dict__), ...)
+            fields[name] = (type_, default)
+    return create_model(f'{cls.__name__}Arguments', __config__=ForbidExtra, **fields)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from .metrics import METRICS, HistogramFamily
+from .use_case import UseCase
+
+
+__all__ = ['Stall', 'Watchdog']
+
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Stall:
+    # The loop blocked for longer than the threshold: where it was stuck,
+    # and in which use case if any
+    __slots__ = ('started', 'duration', 'stack', 'use_case', 'task_id')
+
+    def __init__(self, started: float, stack: List[str], use_case: Optional[str], task_id: Optional[str]):
+        # Wall clock time the loop was due back
+        self.started = started
+        # Set once the loop is back
+        self.duration: Optional[float] = None
+        self.stack = stack
+        self.use_case = use_case
+        self.task_id = task_id
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'started': self.started,
+            'duration': self.duration,
+            'use_case': self.use_case,
+            'task_id': self.task_id,
+            'stack': self.stack,
+        }
+
+    def __repr__(self):
+        return f'Stall({self.use_case}, {self.task_id}, {self.duration})'
+
+
+class Watchdog:
+    # The loop beats every `interval` seconds, observing how late each beat
+    # is into a lag histogram (dno_loop_lag_seconds). A thread checks on the
+    # beats as often; when one is more than `threshold` seconds late, it
+    # captures the stack of the loop thread once, with the use case whose
+    # run() is on it. The last max_stalls stalls are kept. While the loop
+    # keeps up, this costs a timer callback and a thread wake-up per interval.
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, max_stalls: int = 100):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: Deque[Stall] = deque(maxlen=max_stalls)
+        self.histogram = HistogramFamily('dno_loop_lag_seconds', 'Event loop lag', (), LAG_BUCKETS)
+        self._lag = self.histogram.add((), ())
+        # Last lag measured
+        self.lag = 0.0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # Monotonic time the next beat is due, and the stall of that beat
+        self._due = 0.0
+        self._stall: Optional[Stall] = None
+
+    def start(self):
+        # In the loop to watch
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._schedule()
+        self._thread = threading.Thread(target=self._watch, name='dno-watchdog', daemon=True)
+        self._thread.start()
+        METRICS.histograms.append(self.histogram)
+
+    def stop(self):
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.histogram in METRICS.histograms:
+            METRICS.histograms.remove(self.histogram)
+
+    async def cleanup_ctx(self, app):
+        self.start()
+        yield
+        self.stop()
+
+    def _schedule(self):
+        self._due = time.monotonic() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _beat(self):
+        self.lag = max(0.0, time.monotonic() - self._due)
+        self._lag.observe(self.lag)
+        stall = self._stall
+        if stall is not None:
+            self._stall = None
+            stall.duration = self.lag
+            logger.warning(
+                'Event loop blocked for %.3fs in %s %s:\n%s',
+                stall.duration, stall.use_case, stall.task_id, ''.join(stall.stack),
+            )
+        self._schedule()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            due = self._due
+            if self._stall is None and time.monotonic() - due > self.threshold:
+                stall = self._capture(due)
+                self.stalls.append(stall)
+                # Unless the loop came back meanwhile, its next beat
+                # completes the stall
+                if self._due == due:
+                    self._stall = stall
+
+    def _capture(self, due: float) -> Stall:
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        use_case = None
+        # A running coroutine's frames lead back to the ones awaiting it
+        while frame is not None:
+            if frame.f_code is UseCase.execute.__code__:
+                use_case = frame.f_locals.get('self')
+                break
+            frame = frame.f_back
+        return Stall(
+            time.time() - (time.monotonic() - due),
+            stack,
+            use_case.__class__.__name__ if use_case is not None else None,
+            use_case.id if use_case is not None else None,
+        )
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import aiohttp
+
+from .encoding import encode, loads
+
+
+__all__ = ['Worker', 'WorkerError']
+
+
+logger = logging.getLogger(__name__)
+
+
+# Answers the args of a client action with its result (a dict or a model);
+# an exception becomes the error of the action
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class WorkerError(Exception):
+    pass
+
+
+class Worker:
+    # Answers client actions of a dno server by name:
+    #
+    #   worker = Worker('http://dno:8080', {'install_os': install_os})
+    #   await worker.run()  # until worker.stop()
+    #
+    # Keeps up to `prefetch` claimed actions in hand, runs at most
+    # `concurrency` handlers at once, and acknowledges results in batches of
+    # up to `ack_batch` while it goes on claiming. Claims and acks share one
+    # keep-alive connection pool. An action whose ack is lost goes back to
+    # PENDING when its lease expires, so handlers should be idempotent.
+
+    def __init__(
+        self,
+        url: str,
+        handlers: Optional[Dict[str, Handler]] = None,
+        prefetch: int = 16,
+        concurrency: Optional[int] = None,
+        lease: float = 60.0,
+        ack_batch: int = 100,
+        ack_delay: float = 0.005,
+        idle_delay: float = 0.5,
+        connections: int = 4,
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
+        if prefetch < 1:
+            raise ValueError('prefetch must be positive')
+        self.url = url.rstrip('/')
+        self.handlers: Dict[str, Handler] = dict(handlers or {})
+        self.prefetch = prefetch
+        self.concurrency = concurrency or prefetch
+        self.lease = lease
+        self.ack_batch = ack_batch
+        # How long a result waits for others to share its ack request
+        self.ack_delay = ack_delay
+        # Pause between claims that found nothing
+        self.idle_delay = idle_delay
+        self.connections = connections
+
+        self._session = session
+        self._own_session = session is None
+        # Created by run(), in its loop
+        self._stopping: Optional[asyncio.Event] = None
+        # Set while fewer than prefetch actions are in hand
+        self._room: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._acks: Optional[asyncio.Queue] = None
+        self._in_hand = 0
+        self._running: Set[asyncio.Task] = set()
+
+        self.handled = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def handler(self, name: str):
+        # Decorator: @worker.handler('install_os')
+        def register(handler: Handler) -> Handler:
+            self.handlers[name] = handler
+            return handler
+
+        return register
+
+    async def run(self):
+        if not self.handlers:
+            raise WorkerError('No handlers')
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connections))
+        self._stopping = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._acks = asyncio.Queue(maxsize=self.ack_batch)
+        acks = asyncio.ensure_future(self._ack_loop())
+        try:
+            await self._claim_loop()
+        finally:
+            # Finish what is in hand and acknowledge it
+            if self._running:
+                await asyncio.gather(*self._running, return_exceptions=True)
+            await self._acks.put(None)
+            await acks
+            if self._own_session:
+                await self._session.close()
+                self._session = None
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+            # Wake a claim loop waiting for room
+            self._room.set()
+
+    async def _claim_loop(self):
+        names = list(self.handlers)
+        while not self._stopping.is_set():
+            await self._room.wait()
+            if self._stopping.is_set():
+                break
+            try:
+                lease, claimed = await self._claim(self.prefetch - self._in_hand, names)
+            except (aiohttp.ClientError, WorkerError) as e:
+                logger.warning('Can\'t claim client actions: %r', e)
+                await self._sleep(self.idle_delay)
+                continue
+            if not claimed:
+                await self._sleep(self.idle_delay)
+                continue
+
+            self._in_hand += len(claimed)
+            if self._in_hand >= self.prefetch:
+                self._room.clear()
+            for client_action in claimed:
+                task = asyncio.ensure_future(self._handle(lease, client_action))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _claim(self, limit: int, names: List[str]):
+        body = {'limit': limit, 'lease': self.lease, 'names': names}
+        async with self._post('/client_action/claim', body) as resp:
+            if resp.status != 200:
+                raise WorkerError(f'Claim failed: {resp.status} {resp.reason}')
+            claimed = await resp.json(loads=loads)
+        return claimed['lease'], claimed['client_actions']
+
+    async def _handle(self, lease: str, client_action: Dict[str, Any]):
+        async with self._slots:
+            item = {'id': client_action['id'], 'lease': lease}
+            try:
+                item['result'] = await self.handlers[client_action['name']](client_action['args'])
+            except Exception as e:
+                logger.exception('Handler of %s failed', client_action['name'])
+                item['error'] = {'type': e.__class__.__name__, 'message': str(e)}
+        try:
+            await self._acks.put(item)
+        finally:
+            self._in_hand -= 1
+            self._room.set()
+
+    async def _ack_loop(self):
+        while True:
+            item = await self._acks.get()
+            if item is None:
+                return
+            await asyncio.sleep(self.ack_delay)
+            batch = [item]
+            stop = False
+            while len(batch) < self.ack_batch and not self._acks.empty():
+                item = self._acks.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._ack(batch)
+            if stop:
+                return
+
+    async def _ack(self, batch: List[Dict[str, Any]]):
+        try:
+            async with self._post('/client_action/batch', batch) as resp:
+                if resp.status != 200:
+                    raise WorkerError(f'Batch failed: {resp.status} {resp.reason}')
+                outcomes = await resp.json(loads=loads)
+        except (aiohttp.ClientError, WorkerError) as e:
+            # Left to expire and be claimed again
+            logger.warning('Can\'t acknowledge %d client actions: %r', len(batch), e)
+            self.rejected += len(batch)
+            return
+        for item, outcome in zip(batch, outcomes):
+            if 'status' not in outcome:
+                logger.warning('Client action %s not acknowledged: %s', outcome['id'], outcome['error'])
+                self.rejected += 1
+            elif 'error' in item:
+                self.failed += 1
+            else:
+                self.handled += 1
+
+    def _post(self, path: str, body: Any):
+        return self._session.post(
+            self.url + path,
+            data=encode(body),
+            headers={'Content-Type': 'application/json'},
+        )
+
+    async def _sleep(self, delay: float):
+        # Returns early on stop()
+        try:
+            await asyncio.wait_for(self._stopping.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
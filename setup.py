@@ -12,6 +12,9 @@ setup(
         'aiohttp==3.7.3',
         'pydantic==1.7.3',
     ],
+    extras_require={
+        'fast': ['orjson'],
+    },
     version='0.1',
     license='GNU GPL v3',
     description='Package for web-based operations with domain objects',
@@ -42,6 +42,7 @@ class InstallOSResult(BaseModel):
     os: OSEnum
     username: str
     password: str
+    ip: str
 
 
 class CreateServerResult(BaseModel):
@@ -41,20 +41,25 @@ class CreateServer(Server):
             if (
                 vc.cpu_available >= self.cpu
                 and vc.memory_available >= self.memory
-                and vc.hdd_available >= self.memory
+                and vc.hdd_available >= self.hdd
             ):
                 return vc
 
     async def run(self):
         vcs = await self.get_vcs()
+        await vcs.wait()
+        vcs = models.VCList.parse_obj(vcs.result)
         vc = await self.get_appropriate_vc(vcs.result)
         if vc is None:
             raise Exception(f'No appropriate VC for cpu {self.cpu} memory {self.memory} hdd {self.hdd}')
 
         vm_id = await self.create_vm(name=self.name, cpu=self.cpu, memory=self.memory, hdd=self.hdd)
-        vm_id = vm_id.id
+        await vm_id.wait()
+        vm_id = models.CreateVMResult.parse_obj(vm_id.result).id
 
         os_result = await self.install_os(id=vm_id)
+        await os_result.wait()
+        os_result = models.InstallOSResult.parse_obj(os_result.result)
 
         return {
             'id': vm_id,
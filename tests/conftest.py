@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+
+class Clock:
+    # Monotonic clock the test moves by hand; every read adds `step`
+    def __init__(self, step: float = 0.0):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return Clock()
+
+
+async def _settle():
+    # Lets the tasks woken so far run, and those they wake in turn
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture()
+def settle():
+    return _settle
@@ -1,7 +1,61 @@
+import asyncio
+import json
+
 import pytest
 from aiohttp import web
+from pydantic import BaseModel
+
+from dno import app, client_action, use_case
+from tests import test_use_case  # NOQA: F401 (registers DummyUseCase in another domain app)
+
+
+class EchoModel(BaseModel):
+    text: str
+
+
+class Echo(use_case.UseCase):
+    domain_app = 'test_app'
+
+    text: str
+    delay: float
+
+    result: EchoModel
+
+    echo = client_action.ClientActionField(
+        name='echo',
+        args=EchoModel,
+        result=EchoModel,
+    )
+
+    async def run(self):
+        await asyncio.sleep(self.delay)
+        ca = await self.echo(text=self.text)
+        await ca.wait()
+        return ca.result
+
+
+class CachedEcho(Echo):
+    domain_app = 'test_app'
+
+    result: EchoModel
+
+    echo = client_action.ClientActionField(
+        name='cached echo',
+        args=EchoModel,
+        result=EchoModel,
+        cache_ttl=60,
+    )
+
+
+class DedupedEcho(Echo):
+    domain_app = 'test_app'
+
+    result: EchoModel
+
+    deduplicate = True
 
-from dno import app
+
+CREATE_SERVER_ARGS = {'name': 'server', 'cpu': 1, 'memory': 1024, 'hdd': 10}
 
 
 @pytest.fixture
@@ -17,13 +71,28 @@ def cli(loop, aiohttp_client):
 
 @pytest.fixture
 async def task(cli):
-    resp = await cli.post('/test_app/call/CreateServer')
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
     assert resp.status == web.HTTPOk.status_code
     j = await resp.json()
     assert 'id' in j
     yield j['id']
 
 
+@pytest.fixture
+async def echo_task(cli):
+    uc = Echo(text='hello', delay=0.05)
+    await uc.start()
+    yield uc
+
+
+async def get_echo_action(cli, echo_task):
+    resp = await cli.get(f'/test_app/task/{echo_task.id}/client_action?status=PENDING&wait=5')
+    assert resp.status == web.HTTPOk.status_code
+    j = await resp.json()
+    assert len(j) == 1
+    return j[0]
+
+
 async def test_apps(cli):
     assert cli.server.app['APPS'] == ['test_app']
     resp = await cli.get('/')
@@ -43,9 +112,24 @@ async def test_get_use_cases_404(cli):
 
 
 async def test_get_call(cli):
-    resp = await cli.get('/test_app/call')
+    resp = await cli.get('/test_app/call/CreateServer')
     assert resp.status == web.HTTPOk.status_code
-    raise NotImplementedError
+    j = await resp.json()
+    assert j['name'] == 'CreateServer'
+    assert j['arguments']['required'] == ['name', 'cpu', 'memory', 'hdd']
+    assert j['result']['title'] == 'CreateServerResult'
+    assert set(j['client_actions']) == {'get_vcs', 'create_vm', 'install_os'}
+    assert j['client_actions']['create_vm']['name'] == 'Create Virtual Machine'
+    assert j['client_actions']['create_vm']['args']['title'] == 'CreateVMArgs'
+
+    etag = resp.headers['ETag']
+    resp = await cli.get('/test_app/call/CreateServer', headers={'If-None-Match': etag})
+    assert resp.status == web.HTTPNotModified.status_code
+
+
+async def test_get_call_404(cli):
+    resp = await cli.get('/test_app/call/no_use_case')
+    assert resp.status == web.HTTPNotFound.status_code
 
 
 async def test_post_call_404(cli):
@@ -54,20 +138,359 @@ async def test_post_call_404(cli):
 
 
 async def test_post_call(cli):
-    resp = await cli.post('/test_app/call/CreateServer')
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
     assert resp.status == web.HTTPOk.status_code
     assert 'id' in await resp.json()
 
 
+async def test_post_call_bad_arguments(cli):
+    resp = await cli.post('/test_app/call/CreateServer', json={'name': 'server'})
+    assert resp.status == web.HTTPBadRequest.status_code
+
+
+async def test_post_call_queue_full(loop, aiohttp_client):
+    cli = await aiohttp_client(await app.app_factory(['test_app'], concurrency=1, queue_size=1))
+    statuses = []
+    for _ in range(3):
+        resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
+        statuses.append(resp.status)
+    assert statuses == [web.HTTPOk.status_code, web.HTTPOk.status_code, web.HTTPServiceUnavailable.status_code]
+    assert int(resp.headers['Retry-After']) >= 1
+
+    resp = await cli.get('/test_app/scheduler')
+    assert resp.status == web.HTTPOk.status_code
+    j = await resp.json()
+    assert j['running'] == 1
+    assert j['queued'] == 1
+
+
+async def test_get_metrics(cli, task):
+    resp = await cli.get('/test_app/task')
+    assert resp.status == web.HTTPOk.status_code
+
+    resp = await cli.get('/metrics')
+    assert resp.status == web.HTTPOk.status_code
+    assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = await resp.text()
+    assert 'dno_scheduler_running{app="test_app"} 1' in text
+    assert 'dno_http_request_seconds_count{method="GET",route="/test_app/task"}' in text
+    assert 'dno_use_case_queue_seconds_count{app="test_app",use_case="CreateServer"}' in text
+
+
+async def test_get_task(cli, task):
+    resp = await cli.get(f'/test_app/task/{task}')
+    assert resp.status == web.HTTPOk.status_code
+    j = await resp.json()
+    assert j['id'] == task
+    assert j['use_case'] == 'CreateServer'
+
+
 async def test_get_task_list(cli, task):
     resp = await cli.get('/test_app/task')
     assert resp.status == web.HTTPOk.status_code
     assert task in await resp.json()
 
 
+async def test_get_task_list_page(cli, task):
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
+    newest = (await resp.json())['id']
+
+    resp = await cli.get('/test_app/task?use_case=CreateServer&status=RUNNING&limit=1')
+    assert resp.status == web.HTTPOk.status_code
+    j = await resp.json()
+    assert list(j) == [newest]
+    assert j[newest]['use_case'] == 'CreateServer'
+
+    resp = await cli.get(f'/test_app/task?use_case=CreateServer&limit=1&cursor={resp.headers["X-Next-Cursor"]}')
+    assert list(await resp.json()) == [task]
+
+    resp = await cli.get('/test_app/task?status=UNKNOWN')
+    assert resp.status == web.HTTPBadRequest.status_code
+
+
 async def test_get_client_action(cli, task):
-    raise NotImplementedError
+    resp = await cli.get(f'/test_app/task/{task}/client_action?wait=5')
+    assert resp.status == web.HTTPOk.status_code
+    j = await resp.json()
+    assert [ca['name'] for ca in j] == ['Get VC list']
+    assert j[0]['status'] == 'PENDING'
 
 
 async def test_post_client_action(cli, task):
-    raise NotImplementedError
+    resp = await cli.get(f'/test_app/task/{task}/client_action?wait=5')
+    ca = (await resp.json())[0]
+    url = f'/test_app/task/{task}/client_action'
+
+    resp = await cli.post(url, json={'id': ca['id'], 'status': 'RUNNING'})
+    assert resp.status == web.HTTPOk.status_code
+    resp = await cli.post(url, json={'id': ca['id'], 'status': 'DONE', 'result': {'result': []}})
+    assert resp.status == web.HTTPOk.status_code
+    assert (await resp.json())['status'] == 'DONE'
+
+
+async def test_get_client_action_404(cli):
+    resp = await cli.get('/test_app/task/no_task/client_action')
+    assert resp.status == web.HTTPNotFound.status_code
+
+
+async def test_get_client_action_long_poll(cli, echo_task):
+    j = await get_echo_action(cli, echo_task)
+    assert j['name'] == 'echo'
+    assert j['task_id'] == echo_task.id
+    assert j['status'] == 'PENDING'
+    assert j['args'] == {'text': 'hello'}
+
+
+async def test_get_client_action_long_poll_timeout(cli, echo_task):
+    resp = await cli.get(f'/test_app/task/{echo_task.id}/client_action?status=DONE&wait=0.1')
+    assert resp.status == web.HTTPOk.status_code
+    assert await resp.json() == []
+
+
+async def test_get_client_action_long_poll_task_finished(cli, echo_task):
+    j = await get_echo_action(cli, echo_task)
+    url = f'/test_app/task/{echo_task.id}/client_action'
+    await cli.post(url, json={'id': j['id'], 'status': 'RUNNING'})
+
+    # Nothing is PENDING: the poll is held until the task finishes
+    poll = asyncio.ensure_future(cli.get(f'{url}?status=PENDING&wait=5'))
+    await asyncio.sleep(0.05)
+    assert not poll.done()
+    await cli.post(url, json={'id': j['id'], 'status': 'DONE', 'result': {'text': 'world'}})
+    resp = await asyncio.wait_for(poll, 1)
+    assert await resp.json() == []
+
+    # Once finished, it is not held at all
+    resp = await asyncio.wait_for(cli.get(f'{url}?status=PENDING&wait=5'), 1)
+    assert await resp.json() == []
+
+
+async def test_post_client_action_transitions(cli, echo_task):
+    j = await get_echo_action(cli, echo_task)
+    url = f'/test_app/task/{echo_task.id}/client_action'
+
+    resp = await cli.post(url, json={'id': j['id'], 'status': 'RUNNING'})
+    assert resp.status == web.HTTPOk.status_code
+    assert (await resp.json())['status'] == 'RUNNING'
+
+    resp = await cli.post(url, json={'id': j['id'], 'status': 'DONE', 'result': {'text': 'world'}})
+    assert resp.status == web.HTTPOk.status_code
+    assert (await resp.json())['result'] == {'text': 'world'}
+
+    resp = await cli.post(url, json={'id': j['id'], 'status': 'ERROR'})
+    assert resp.status == web.HTTPConflict.status_code
+
+    resp = await cli.post(url, json={'id': 'no_client_action', 'status': 'RUNNING'})
+    assert resp.status == web.HTTPNotFound.status_code
+
+    resp = await cli.post(url, json={'id': j['id'], 'status': 'SLEEPING'})
+    assert resp.status == web.HTTPBadRequest.status_code
+
+
+async def test_stream_client_action(cli, echo_task):
+    resp = await cli.get(f'/test_app/task/{echo_task.id}/client_action/stream')
+    assert resp.status == web.HTTPOk.status_code
+    assert resp.headers['Content-Type'] == 'text/event-stream'
+
+    assert (await resp.content.readline()).startswith(b'id: ')
+    assert await resp.content.readline() == b'event: PENDING\n'
+    data = await resp.content.readline()
+    assert data.startswith(b'data: ')
+    ca_id = json.loads(data[len(b'data: '):])['id']
+    assert await resp.content.readline() == b'\n'
+
+    echo_task.client_actions[ca_id].set_running()
+    assert await resp.content.readline() == f'id: {ca_id}\n'.encode()
+    assert await resp.content.readline() == b'event: RUNNING\n'
+
+    # The task finishing ends the stream
+    echo_task.client_actions[ca_id].set_result({'text': 'world'})
+    events = (await resp.content.read()).decode().split('\n\n')
+    assert events[-3].startswith(f'id: {ca_id}\nevent: DONE\n')
+    assert events[-2].startswith(f'id: {echo_task.id}\nevent: task\ndata: ')
+    assert json.loads(events[-2].split('data: ', 1)[1])['status'] == 'DONE'
+    assert events[-1] == ''
+
+    # Ends at once for a finished task
+    resp = await cli.get(f'/test_app/task/{echo_task.id}/client_action/stream')
+    events = (await resp.content.read()).decode().split('\n\n')
+    assert [event.split('\n')[1] for event in events[:-1]] == ['event: DONE', 'event: task']
+
+
+async def test_claim_and_batch(cli, echo_task):
+    await get_echo_action(cli, echo_task)
+
+    resp = await cli.post('/client_action/claim', json={'limit': 10, 'lease': 30, 'names': ['echo']})
+    assert resp.status == web.HTTPOk.status_code
+    j = await resp.json()
+    ca = next(ca for ca in j['client_actions'] if ca['task_id'] == echo_task.id)
+    assert ca['status'] == 'RUNNING'
+
+    resp = await cli.post('/client_action/batch', json=[
+        {'id': ca['id'], 'lease': j['lease'], 'result': {'text': 'world'}},
+        {'id': 'no_client_action', 'result': {}},
+    ])
+    assert resp.status == web.HTTPOk.status_code
+    assert await resp.json() == [
+        {'id': ca['id'], 'status': 'DONE'},
+        {'id': 'no_client_action', 'error': 'Not found'},
+    ]
+    assert echo_task.client_actions[ca['id']].result == {'text': 'world'}
+
+
+async def test_claim_bad_limit(cli):
+    resp = await cli.post('/client_action/claim', json={'limit': 0})
+    assert resp.status == web.HTTPBadRequest.status_code
+    resp = await cli.post('/client_action/claim', json={'names': [['x']]})
+    assert resp.status == web.HTTPBadRequest.status_code
+
+
+async def test_apps_not_modified(cli):
+    resp = await cli.get('/test_app/call')
+    etag = resp.headers['ETag']
+
+    resp = await cli.get('/test_app/call', headers={'If-None-Match': etag})
+    assert resp.status == web.HTTPNotModified.status_code
+    assert resp.headers['ETag'] == etag
+
+    resp = await cli.get('/', headers={'If-None-Match': etag})
+    assert resp.status == web.HTTPOk.status_code
+    assert await resp.json() == ['test_app']
+
+
+async def test_use_cases_of_other_app(cli):
+    resp = await cli.get('/test_app/call')
+    assert 'DummyUseCase' not in await resp.json()
+
+    resp = await cli.post('/test_app/call/DummyUseCase', json={'a': 1, 'b': 1.0})
+    assert resp.status == web.HTTPNotFound.status_code
+
+
+async def test_lazy_load(loop, aiohttp_client):
+    cli = await aiohttp_client(await app.app_factory(['test_app'], lazy=True))
+    domain_app = cli.server.app['DOMAIN_APPS']['test_app']
+    assert not domain_app.loaded
+
+    resp = await cli.get('/test_app/call')
+    assert resp.status == web.HTTPOk.status_code
+    assert 'CreateServer' in await resp.json()
+    assert domain_app.loaded
+
+
+async def test_parallel_load(loop, aiohttp_client):
+    cli = await aiohttp_client(await app.app_factory(['test_app'], parallel=True))
+    domain_app = cli.server.app['DOMAIN_APPS']['test_app']
+    assert domain_app.loaded
+    assert set(domain_app.load_times) == {'models', 'use_cases', 'total'}
+
+
+async def test_get_cache(cli):
+    first, second = CachedEcho(text='cached', delay=0), CachedEcho(text='cached', delay=0)
+    await first.start()
+    await second.start()
+    await asyncio.sleep(0.01)
+    assert list(first.client_actions) == list(second.client_actions)
+
+    resp = await cli.get('/test_app/cache')
+    assert resp.status == web.HTTPOk.status_code
+    j = await resp.json()
+    assert list(j) == ['CachedEcho.echo']
+    assert j['CachedEcho.echo']['coalesced'] >= 1
+
+
+async def test_create_server_done(cli, task):
+    vc = {'cpu_available': 4, 'memory_available': 4096, 'hdd_available': 100, 'cpu': 4, 'memory': 4096, 'hdd': 100}
+    answers = {
+        'Get VC list': lambda args: {'result': [vc]},
+        'Create Virtual Machine': lambda args: {'id': 'vm'},
+        'Install operation system on VM': lambda args: {
+            'id': args['id'], 'os': 'LINUX', 'username': 'root', 'password': 'secret', 'ip': '10.0.0.1',
+        },
+    }
+    # Through the task's own endpoint: actions other tests left PENDING in
+    # the dispatcher are none of its business
+    url = f'/test_app/task/{task}/client_action'
+    for _ in range(3):
+        resp = await cli.get(f'{url}?status=PENDING&wait=5')
+        (ca,) = await resp.json()
+        resp = await cli.post(url, json={'id': ca['id'], 'status': 'RUNNING'})
+        assert resp.status == web.HTTPOk.status_code
+        resp = await cli.post(url, json={'id': ca['id'], 'status': 'DONE', 'result': answers[ca['name']](ca['args'])})
+        assert resp.status == web.HTTPOk.status_code
+
+    resp = await cli.get(f'/test_app/task/{task}')
+    j = await resp.json()
+    assert j['status'] == 'DONE'
+    assert j['result'] == {'id': 'vm', 'os': 'LINUX', 'username': 'root', 'password': 'secret', 'ip': '10.0.0.1'}
+
+
+async def test_post_call_batch(cli):
+    lines = [json.dumps({'text': str(n), 'delay': 0}) for n in range(250)]
+    lines[1] = json.dumps({'text': 'no delay'})
+    lines[2] = '{not json'
+    lines[3] = ''
+    resp = await cli.post('/test_app/call/Echo/batch', data='\n'.join(lines).encode())
+    assert resp.status == web.HTTPOk.status_code
+    assert resp.headers['Content-Type'] == 'application/x-ndjson'
+    items = [json.loads(line) for line in (await resp.text()).splitlines()]
+
+    assert [item['line'] for item in items] == [1, 2, 3] + list(range(5, 251))
+    assert items[1]['error'][0]['loc'] == ['delay']
+    assert items[2]['error'] == 'Not JSON'
+    ids = [items[0]['id']] + [item['id'] for item in items[3:]]
+    assert all(use_case.RUNNING_TASKS[id].text in ('0', *map(str, range(4, 250))) for id in ids)
+
+    resp = await cli.post('/test_app/call/Unknown/batch', data=b'{}\n')
+    assert resp.status == web.HTTPNotFound.status_code
+
+
+async def test_cancel_task(cli):
+    resp = await cli.post('/test_app/call/Echo?timeout=0', json={'text': 'hello', 'delay': 10})
+    assert resp.status == web.HTTPBadRequest.status_code
+
+    resp = await cli.post('/test_app/call/Echo?timeout=60', json={'text': 'hello', 'delay': 10})
+    assert resp.status == web.HTTPOk.status_code
+    task_id = (await resp.json())['id']
+    await asyncio.sleep(0)
+
+    resp = await cli.post(f'/test_app/task/{task_id}/cancel')
+    assert resp.status == web.HTTPOk.status_code
+    assert (await resp.json())['error'] == {'type': 'Cancelled', 'message': 'Cancelled'}
+    await asyncio.sleep(0)
+    assert use_case.RUNNING_TASKS[task_id].status == use_case.Status.FAILED
+
+    resp = await cli.post(f'/test_app/task/{task_id}/cancel')
+    assert resp.status == web.HTTPConflict.status_code
+
+
+async def test_post_call_idempotency_key(cli):
+    headers = {'Idempotency-Key': 'create-1'}
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS, headers=headers)
+    assert resp.status == web.HTTPOk.status_code
+    first = (await resp.json())['id']
+
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS, headers=headers)
+    assert resp.status == web.HTTPOk.status_code
+    assert resp.headers['Idempotent-Replayed'] == 'true'
+    assert (await resp.json())['id'] == first
+
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
+    assert (await resp.json())['id'] != first
+
+
+async def test_post_call_deduplicate(cli):
+    resp = await cli.post('/test_app/call/DedupedEcho', json={'text': 'once', 'delay': 10})
+    first = (await resp.json())['id']
+    resp = await cli.post('/test_app/call/DedupedEcho', json={'delay': 10.0, 'text': 'once'})
+    assert (await resp.json())['id'] == first
+    resp = await cli.post('/test_app/call/DedupedEcho', json={'text': 'twice', 'delay': 10})
+    assert (await resp.json())['id'] != first
+
+    resp = await cli.post('/test_app/call/DedupedEcho', json={'text': 'once'})
+    assert resp.status == web.HTTPBadRequest.status_code
+
+    lines = [json.dumps({'text': 'once', 'delay': 10}), json.dumps({'text': 'batch', 'delay': 10})] * 2
+    resp = await cli.post('/test_app/call/DedupedEcho/batch', data='\n'.join(lines).encode())
+    items = [json.loads(line) for line in (await resp.text()).splitlines()]
+    assert items[0] == {'line': 1, 'id': first, 'replayed': True}
+    assert items[3] == {'line': 4, 'id': items[1]['id'], 'replayed': True}
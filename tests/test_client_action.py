@@ -1,9 +1,11 @@
+import asyncio
 from typing import Optional
 
 import pytest
 from pydantic import BaseModel, error_wrappers
 
 from dno import client_action
+from dno.validation import compile_validator
 
 
 @pytest.fixture()
@@ -94,6 +96,22 @@ class TestCreateInstance:
         else:
             raise Exception
 
+    async def test_args_model_config(self, loop, return_model):
+        class ArgsBaseModel(BaseModel):
+            a: int
+            b: str
+
+            class Config:
+                anystr_strip_whitespace = True
+                anystr_lower = True
+                max_anystr_length = 5
+
+        assert compile_validator(ArgsBaseModel)({'a': 1, 'b': '  ABC '}) == {'a': 1, 'b': 'abc'}
+
+        field = client_action.ClientActionField(name='config', args=ArgsBaseModel, result=return_model)
+        with pytest.raises(error_wrappers.ValidationError):
+            await field(a=1, b='abcdef')
+
 
 class TestFullCycleInstance:
     async def test_done(self, test_client_action_call):
@@ -199,3 +217,121 @@ class TestFullCycleInstance:
             pass
         else:
             raise Exception()
+
+
+class TestWait:
+    async def test_wait_result(self, test_client_action_call):
+        waiters = [asyncio.ensure_future(test_client_action_call.wait()) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert not any(w.done() for w in waiters)
+
+        test_client_action_call.set_running()
+        test_client_action_call.set_result({'test': 'result'})
+        await asyncio.wait_for(asyncio.gather(*waiters), 1)
+
+    async def test_wait_error(self, test_client_action_call):
+        waiter = asyncio.ensure_future(test_client_action_call.wait())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        test_client_action_call.set_running()
+        test_client_action_call.set_error({'test': 'error'})
+        await asyncio.wait_for(waiter, 1)
+
+    async def test_wait_finished(self, test_client_action_call):
+        test_client_action_call.set_running()
+        test_client_action_call.set_result()
+        await asyncio.wait_for(test_client_action_call.wait(), 1)
+
+    async def test_cancel_one_waiter(self, test_client_action_call):
+        cancelled = asyncio.ensure_future(test_client_action_call.wait())
+        waiter = asyncio.ensure_future(test_client_action_call.wait())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        test_client_action_call.set_running()
+        test_client_action_call.set_result()
+        await asyncio.wait_for(waiter, 1)
+        assert cancelled.cancelled()
+
+
+@pytest.fixture()
+def cached_field(args_model, return_model):
+    return client_action.ClientActionField(
+        name='test_cached_client_action',
+        args=args_model,
+        result=return_model,
+        cache_ttl=10,
+        cache_size=2,
+    )
+
+
+async def finish(ca, result=None):
+    ca.set_running()
+    ca.set_result(result)
+    # Let the field cache the result
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+class TestCache:
+    async def test_coalesced(self, loop, cached_field):
+        first, second = await asyncio.gather(cached_field(a=1, b='b'), cached_field(a=1, b='b'))
+        assert first is second
+        other = await cached_field(a=2, b='b')
+        assert other is not first
+        assert cached_field.cache_stats() == {'hits': 0, 'misses': 2, 'coalesced': 1, 'size': 0, 'in_flight': 2}
+
+    async def test_hit(self, loop, cached_field):
+        ca = await cached_field(a=1, b='b')
+        await finish(ca, {'test': 'result'})
+
+        assert await cached_field(b='b', a=1) is ca
+        assert cached_field.cache_stats()['hits'] == 1
+        assert cached_field.cache_stats()['size'] == 1
+
+    async def test_error_not_cached(self, loop, cached_field):
+        ca = await cached_field(a=1, b='b')
+        ca.set_running()
+        ca.set_error({'test': 'error'})
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        assert await cached_field(a=1, b='b') is not ca
+        assert cached_field.cache_stats()['size'] == 0
+
+    async def test_expired(self, loop, cached_field, monkeypatch):
+        ca = await cached_field(a=1, b='b')
+        await finish(ca)
+
+        now = client_action.time.monotonic()
+        monkeypatch.setattr(client_action.time, 'monotonic', lambda: now + 11)
+        assert await cached_field(a=1, b='b') is not ca
+        assert cached_field.cache_stats()['misses'] == 2
+
+    async def test_size(self, loop, cached_field):
+        cas = []
+        for a in range(3):
+            ca = await cached_field(a=a, b='b')
+            await finish(ca)
+            cas.append(ca)
+        assert cached_field.cache_stats()['size'] == 2
+
+        # The least recently used one was dropped
+        assert await cached_field(a=2, b='b') is cas[2]
+        assert await cached_field(a=0, b='b') is not cas[0]
+
+    async def test_use_case(self, loop, cached_field):
+        class Holder:
+            id = 'task'
+            replay = {}
+            calls = 0
+
+            def __init__(self):
+                self.client_actions = {}
+
+        first, second = Holder(), Holder()
+        ca = await cached_field.call(first, a=1, b='b')
+        assert await cached_field.call(second, a=1, b='b') is ca
+        assert list(second.client_actions) == [ca.id]
@@ -0,0 +1,97 @@
+from uuid import uuid4
+
+import pytest
+
+from dno import client_action, dispatch
+
+
+@pytest.fixture()
+def dispatcher(clock):
+    dispatcher = dispatch.Dispatcher(clock=clock)
+    client_action.LISTENERS.append(dispatcher.on_change)
+    yield dispatcher
+    client_action.LISTENERS.remove(dispatcher.on_change)
+
+
+def new_client_action(name='test_client_action'):
+    ca = client_action.ClientAction(name, uuid4().hex, {}, client_action.Status.PENDING)
+    ca._notify()
+    return ca
+
+
+def test_claim(dispatcher):
+    first, second, third = (new_client_action() for _ in range(3))
+
+    lease, claimed = dispatcher.claim(2, 10)
+    assert claimed == [first, second]
+    assert all(ca.status == client_action.Status.RUNNING for ca in claimed)
+    assert dispatcher.pending_count() == 1
+
+    _, claimed = dispatcher.claim(2, 10)
+    assert claimed == [third]
+
+    _, claimed = dispatcher.claim(2, 10)
+    assert claimed == []
+
+
+def test_claim_names(dispatcher):
+    new_client_action('first')
+    second = new_client_action('second')
+
+    _, claimed = dispatcher.claim(10, 10, names=['second', 'third'])
+    assert claimed == [second]
+
+
+def test_claim_names_twice(dispatcher):
+    ca = new_client_action('twice')
+    _, claimed = dispatcher.claim(10, 10, names=['twice', 'twice'])
+    assert claimed == [ca]
+
+
+def test_lease_all_or_none(dispatcher):
+    first, second = new_client_action(), new_client_action()
+    second.set_running()
+    with pytest.raises(client_action.UnexpectedStatus):
+        dispatcher.lease([first, second], 10)
+    assert first.status == client_action.Status.PENDING
+
+
+def test_lease_expired(dispatcher, clock):
+    ca = new_client_action()
+    lease, _ = dispatcher.claim(1, 10)
+    dispatcher.check_lease(ca, lease.id)
+
+    clock.now = 10
+    with pytest.raises(dispatch.LeaseExpired):
+        dispatcher.check_lease(ca, lease.id)
+    assert dispatcher.release_expired() == 1
+    assert ca.status == client_action.Status.PENDING
+
+    new_lease, claimed = dispatcher.claim(1, 10)
+    assert claimed == [ca]
+    with pytest.raises(dispatch.LeaseExpired):
+        dispatcher.check_lease(ca, lease.id)
+    dispatcher.check_lease(ca, new_lease.id)
+
+
+def test_lease_required(dispatcher, clock):
+    ca = new_client_action()
+    dispatcher.check_lease(ca)
+
+    lease, _ = dispatcher.claim(1, 10)
+    # Another worker can't finish it without the lease
+    with pytest.raises(dispatch.LeaseExpired):
+        dispatcher.check_lease(ca)
+    with pytest.raises(dispatch.LeaseExpired):
+        dispatcher.check_lease(ca, 'other')
+    dispatcher.check_lease(ca, lease.id)
+
+
+def test_finished_not_released(dispatcher, clock):
+    ca = new_client_action()
+    dispatcher.claim(1, 10)
+    ca.set_result({})
+
+    clock.now = 10
+    assert dispatcher.release_expired() == 0
+    assert ca.status == client_action.Status.DONE
@@ -0,0 +1,44 @@
+import json
+from typing import List
+
+from pydantic import BaseModel
+
+from dno import client_action, encoding
+from test_app import models
+
+
+class Servers(BaseModel):
+    servers: List[models.CreateServerResult]
+
+
+def test_encode_client_action():
+    ca = client_action.ClientAction('name', 'id', {'a': 1}, client_action.Status.PENDING, task_id='task')
+    assert json.loads(encoding.encode(ca)) == {
+        'id': 'id',
+        'name': 'name',
+        'task_id': 'task',
+        'status': 'PENDING',
+        'args': {'a': 1},
+        'result': None,
+        'error': None,
+    }
+
+
+def test_encode_models_and_enums():
+    server = models.CreateServerResult(id='1', os=models.OSEnum.LINUX, username='u', password='p', ip='10.0.0.1')
+    data = {'status': client_action.Status.DONE, 'result': Servers(servers=[server])}
+    assert json.loads(encoding.dumps(data)) == {
+        'status': 'DONE',
+        'result': {'servers': [{'id': '1', 'os': 'LINUX', 'username': 'u', 'password': 'p', 'ip': '10.0.0.1'}]},
+    }
+
+
+def test_static_response_etag():
+    response = encoding.StaticJSONResponse(['a', 'b'])
+    assert json.loads(response.body) == ['a', 'b']
+    assert response.etag.startswith('"') and response.etag.endswith('"')
+    assert response._matches(response.etag)
+    assert response._matches(f'"other", W/{response.etag}')
+    assert response._matches('*')
+    assert not response._matches('"other"')
+    assert not response._matches(None)
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from dno import client_action, fan_out
+
+
+class StepModel(BaseModel):
+    n: int
+
+
+@pytest.fixture()
+def issued():
+    return []
+
+
+@pytest.fixture()
+def call(issued):
+    field = client_action.ClientActionField(name='fan out step', args=StepModel, result=StepModel)
+
+    def call(n):
+        async def issue(**after):
+            ca = await field(n=n)
+            issued.append(ca)
+            return ca
+
+        return issue
+
+    return call
+
+
+def finish(ca, error=False):
+    ca.set_running()
+    if error:
+        ca.set_error({'n': ca.args['n']})
+    else:
+        ca.set_result({'n': ca.args['n']})
+
+
+async def test_gather_limit(loop, issued, call, settle):
+    gathered = asyncio.ensure_future(fan_out.gather([call(n) for n in range(3)], limit=2))
+    await settle()
+    assert [ca.args['n'] for ca in issued] == [0, 1]
+
+    finish(issued[1])
+    await settle()
+    assert [ca.args['n'] for ca in issued] == [0, 1, 2]
+    finish(issued[2])
+    finish(issued[0])
+
+    result = await asyncio.wait_for(gathered, 1)
+    assert [ca.args['n'] for ca in result] == [0, 1, 2]
+
+
+async def test_gather_fail_fast(loop, issued, call, settle):
+    gathered = asyncio.ensure_future(fan_out.gather([call(n) for n in range(3)], limit=2))
+    await settle()
+    finish(issued[0], error=True)
+
+    with pytest.raises(fan_out.ClientActionFailed) as e:
+        await asyncio.wait_for(gathered, 1)
+    assert e.value.client_action is issued[0]
+    await settle()
+    # The last call was never issued
+    assert len(issued) == 2
+
+
+async def test_gather_collect_all(loop, issued, call, settle):
+    gathered = asyncio.ensure_future(fan_out.gather([call(n) for n in range(2)], fail_fast=False))
+    await settle()
+    finish(issued[0], error=True)
+    finish(issued[1])
+
+    result = await asyncio.wait_for(gathered, 1)
+    assert [ca.status for ca in result] == [client_action.Status.ERROR, client_action.Status.DONE]
+
+
+async def test_gather_cancelled(loop, issued, call, settle):
+    tasks = len(asyncio.all_tasks())
+    gathered = asyncio.ensure_future(fan_out.gather([call(n) for n in range(3)]))
+    await settle()
+    assert len(asyncio.all_tasks()) == tasks + 4
+
+    gathered.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await gathered
+    assert len(asyncio.all_tasks()) == tasks
+
+
+async def test_run_steps(loop, issued, call, settle):
+    seen = {}
+
+    def step(n):
+        issue = call(n)
+
+        async def wrapper(**after):
+            seen[n] = sorted(after)
+            return await issue()
+
+        return wrapper
+
+    steps = {
+        'vcs': fan_out.Step(step(0)),
+        'vm': fan_out.Step(step(1), after=['vcs']),
+        'disk': fan_out.Step(step(2), after=['vcs']),
+        'os': fan_out.Step(step(3), after=['vm', 'disk']),
+    }
+    ran = asyncio.ensure_future(fan_out.run_steps(steps))
+    await settle()
+    assert [ca.args['n'] for ca in issued] == [0]
+    finish(issued[0])
+    await settle()
+    assert [ca.args['n'] for ca in issued] == [0, 1, 2]
+    finish(issued[1])
+    await settle()
+    assert len(issued) == 3
+    finish(issued[2])
+    await settle()
+    finish(issued[3])
+
+    result = await asyncio.wait_for(ran, 1)
+    assert {name: ca.args['n'] for name, ca in result.items()} == {'vcs': 0, 'vm': 1, 'disk': 2, 'os': 3}
+    assert seen == {0: [], 1: ['vcs'], 2: ['vcs'], 3: ['disk', 'vm']}
+
+
+async def test_run_steps_skip_after_error(loop, issued, call, settle):
+    steps = {
+        'first': fan_out.Step(call(0)),
+        'second': fan_out.Step(call(1), after=['first']),
+    }
+    ran = asyncio.ensure_future(fan_out.run_steps(steps, fail_fast=False))
+    await settle()
+    finish(issued[0], error=True)
+    result = await asyncio.wait_for(ran, 1)
+    assert list(result) == ['first']
+
+
+async def test_run_steps_bad_graph(loop, call):
+    with pytest.raises(ValueError):
+        await fan_out.run_steps({'a': fan_out.Step(call(0), after=['b']), 'b': fan_out.Step(call(1), after=['a'])})
+    with pytest.raises(ValueError):
+        await fan_out.run_steps({'a': fan_out.Step(call(0), after=['unknown'])})
+
+
+async def test_gather_fail_fast_aborts_siblings(loop, issued, call, settle):
+    gathered = asyncio.ensure_future(fan_out.gather([call(n) for n in range(3)]))
+    await settle()
+    finish(issued[0], error=True)
+
+    with pytest.raises(fan_out.ClientActionFailed):
+        await asyncio.wait_for(gathered, 1)
+    assert [ca.status for ca in issued] == [client_action.Status.ERROR] * 3
+    assert issued[1].error['type'] == 'Cancelled'
@@ -0,0 +1,38 @@
+from dno.idempotency import IdempotencyIndex, arguments_key
+
+
+def test_expiry(clock):
+    index = IdempotencyIndex(ttl=10, clock=clock)
+    index.add('a', '1')
+    clock.now = 5
+    index.add('b', '2')
+    assert index.get('a') == '1'
+
+    clock.now = 10
+    assert index.get('a') is None
+    assert index.get('b') == '2'
+    assert len(index) == 1
+    assert index.hits == 2
+
+
+def test_max_size():
+    index = IdempotencyIndex(max_size=2)
+    for n in range(3):
+        index.add(n, str(n))
+    assert len(index) == 2
+    assert index.get(0) is None
+    assert index.get(2) == '2'
+
+
+def test_discard():
+    index = IdempotencyIndex()
+    index.add('a', '1')
+    index.discard('a', '2')
+    assert index.get('a') == '1'
+    index.discard('a', '1')
+    assert index.get('a') is None
+
+
+def test_arguments_key():
+    assert arguments_key({'a': 1, 'b': [1, 2]}) == arguments_key({'b': [1, 2], 'a': 1})
+    assert arguments_key({'a': 1}) != arguments_key({'a': 2})
@@ -0,0 +1,170 @@
+import pytest
+from pydantic import BaseModel
+
+from dno import client_action, journal, scheduler, use_case
+
+
+class Step(BaseModel):
+    n: int
+
+
+class Steps(use_case.UseCase):
+    n: int
+
+    result: Step
+
+    step = client_action.ClientActionField(
+        name='step',
+        args=Step,
+        result=Step,
+    )
+
+    async def run(self):
+        n = self.n
+        for i in range(3):
+            ca = await self.step(n=n)
+            await ca.wait()
+            if ca.status == client_action.Status.ERROR:
+                raise Exception(ca.error)
+            n = ca.result['n']
+        return {'n': n}
+
+
+@pytest.fixture()
+def opened_journal(loop, tmp_path):
+    j = journal.Journal(str(tmp_path), snapshot_every=3)
+    j.open()
+    yield j
+    if j._file is not None:
+        j.close()
+
+
+@pytest.fixture()
+def answer(settle):
+    # Finishes the seq-th client action of a task, once it is issued
+    async def answer(uc: use_case.UseCase, seq: int):
+        await settle()
+        ca = list(uc.client_actions.values())[seq]
+        ca.set_running()
+        ca.set_result({'n': ca.args['n'] * 2})
+        await settle()
+
+    return answer
+
+
+async def test_recover(opened_journal, tmp_path, settle, answer):
+    uc = Steps(n=1)
+    await uc.start(scheduler.Scheduler())
+    await answer(uc, 0)
+    await answer(uc, 1)
+    opened_journal.close()
+    use_case.RUNNING_TASKS.pop(uc.id)
+
+    # Restart: the first two steps are replayed, the third is issued again
+    restarted = journal.Journal(str(tmp_path))
+    restarted.open()
+    try:
+        recovered, = await restarted.recover(lambda app: scheduler.Scheduler())
+        assert recovered.id == uc.id
+        await settle()
+        assert [ca.status for ca in recovered.client_actions.values()] == [
+            client_action.Status.DONE,
+            client_action.Status.DONE,
+            client_action.Status.PENDING,
+        ]
+        pending = list(recovered.client_actions.values())[2]
+        assert pending.args == {'n': 4}
+        with pytest.raises(KeyError):
+            await client_action.Storage.get(list(recovered.client_actions)[0])
+
+        await answer(recovered, 2)
+        assert recovered.status == use_case.Status.FINISHED
+        assert recovered.result == Step(n=8)
+        assert restarted.unfinished() == []
+    finally:
+        restarted.close()
+
+
+async def test_snapshot_compaction(opened_journal, tmp_path, answer):
+    uc = Steps(n=1)
+    await uc.start(scheduler.Scheduler())
+    for seq in range(3):
+        await answer(uc, seq)
+    assert uc.status == use_case.Status.FINISHED
+
+    # start, 3 results and finish: a snapshot was taken after the 3rd record
+    with open(opened_journal.log_path) as f:
+        assert len(f.readlines()) == 2
+    opened_journal.close()
+
+    restarted = journal.Journal(str(tmp_path))
+    restarted.open()
+    assert restarted.unfinished() == []
+    restarted.close()
+
+
+async def test_recover_other_args(opened_journal, tmp_path, settle, answer):
+    uc = Steps(n=1)
+    await uc.start(scheduler.Scheduler())
+    await answer(uc, 0)
+    await answer(uc, 1)
+    opened_journal.close()
+    use_case.RUNNING_TASKS.pop(uc.id)
+
+    restarted = journal.Journal(str(tmp_path))
+    restarted.open()
+    try:
+        # As if the second call had been made with other arguments
+        restarted._tasks[uc.id]['results']['1']['args'] = {'n': 99}
+        recovered, = await restarted.recover(lambda app: scheduler.Scheduler())
+        await settle()
+        assert [ca.status for ca in recovered.client_actions.values()] == [
+            client_action.Status.DONE,
+            client_action.Status.PENDING,
+        ]
+    finally:
+        restarted.close()
+
+
+async def test_recover_past_queue_and_bad_args(opened_journal, tmp_path):
+    ucs = [Steps(n=n) for n in range(2)]
+    for uc in ucs:
+        await uc.start(scheduler.Scheduler())
+    opened_journal.close()
+    for uc in ucs:
+        use_case.RUNNING_TASKS.pop(uc.id)
+
+    restarted = journal.Journal(str(tmp_path))
+    restarted.open()
+    try:
+        restarted._tasks[ucs[0].id]['args'] = {'n': 'not a number'}
+        recovered = await restarted.recover(lambda app: scheduler.Scheduler(limit=0, max_queue=0))
+        assert [uc.id for uc in recovered] == [ucs[1].id]
+    finally:
+        restarted.close()
+
+
+async def test_recover_after_cache_hit(opened_journal, tmp_path, settle):
+    field = client_action.ClientActionField(name='cached step', args=Step, result=Step, cache_ttl=60)
+
+    class CachedSteps(Steps):
+        result: Step
+
+        async def run(self):
+            for _ in range(2):
+                ca = await field.call(self, n=self.n)
+                await ca.wait()
+            ca = await self.step(n=self.n)
+            await ca.wait()
+            return ca.result
+
+    uc = CachedSteps(n=5)
+    await uc.start(scheduler.Scheduler())
+    await settle()
+    ca = list(uc.client_actions.values())[0]
+    ca.set_running()
+    ca.set_result({'n': 5})
+    await settle()
+    # The cache hit took position 1, the step is at 2
+    (step,) = [ca for ca in uc.client_actions.values() if ca.name == 'step']
+    assert step.seq == 2
@@ -0,0 +1,78 @@
+from pydantic import BaseModel
+
+from dno import client_action, metrics, use_case
+
+
+class Result(BaseModel):
+    n: int
+
+
+class Measured(use_case.UseCase):
+    domain_app = 'metrics_app'
+
+    n: int
+
+    result: Result
+
+    async def run(self):
+        return {'n': self.n}
+
+
+def test_histogram():
+    family = metrics.HistogramFamily('test_seconds', 'Test', ('name',), buckets=(0.1, 1.0))
+    histogram = family.add('a', ('a"b',))
+    assert family.add('a', ('ignored',)) is histogram
+    assert family.add('b', ('a"b',)) is histogram
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+
+    assert list(family.render()) == [
+        '# HELP test_seconds Test',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{name="a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{name="a\\"b",le="1.0"} 3',
+        'test_seconds_bucket{name="a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{name="a\\"b"} 5.65',
+        'test_seconds_count{name="a\\"b"} 4',
+    ]
+
+
+async def test_use_case(loop):
+    registry = metrics.Metrics()
+    uc = Measured(n=1)
+    uc.queued_at = 0.0
+    uc.status = use_case.Status.PENDING
+    registry.on_use_case(uc)
+    uc.started_at = 1.0
+    uc.status = use_case.Status.RUNNING
+    registry.on_use_case(uc)
+    assert registry.use_cases['metrics_app'][use_case.Status.PENDING] == 0
+    assert registry.use_cases['metrics_app'][use_case.Status.RUNNING] == 1
+
+    uc.finished_at = 3.0
+    uc.status = use_case.Status.FINISHED
+    registry.on_use_case(uc)
+    assert registry.use_cases['metrics_app'][use_case.Status.RUNNING] == 0
+    assert registry.use_cases['metrics_app'][use_case.Status.FINISHED] == 1
+    assert registry.use_case_queue.children[Measured].sum == 1.0
+    assert registry.use_case_run.children[Measured].sum == 2.0
+
+
+async def test_client_action(loop):
+    registry = metrics.Metrics()
+    ca = client_action.ClientAction('measured', 'id', {}, client_action.Status.PENDING)
+    registry.on_client_action(ca)
+    ca.set_running()
+    registry.on_client_action(ca)
+    ca.set_result({})
+    registry.on_client_action(ca)
+
+    assert registry.client_actions == {
+        client_action.Status.PENDING: 0,
+        client_action.Status.RUNNING: 0,
+        client_action.Status.DONE: 1,
+        client_action.Status.ERROR: 0,
+    }
+    assert registry.client_action_pending.children['measured'].count == 1
+    assert registry.client_action_running.children['measured'].count == 1
+    assert 'dno_client_actions{status="DONE"} 1' in registry.render()
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from pydantic import BaseModel
+
+from dno import app, client_action
+from dno.dispatch import DISPATCHER
+from dno.push import Endpoint, Pusher
+
+
+class PushModel(BaseModel):
+    n: int
+
+
+@pytest.fixture
+def field():
+    return client_action.ClientActionField(name='pushed', args=PushModel, result=PushModel)
+
+
+@pytest.fixture
+def stub(loop, aiohttp_server):
+    # A worker webhook failing the first `fail` requests with 503
+    received = []
+    state = {'fail': 0}
+
+    async def push(request):
+        if state['fail']:
+            state['fail'] -= 1
+            raise web.HTTPServiceUnavailable()
+        received.append(await request.json())
+        return web.Response()
+
+    stub_app = web.Application()
+    stub_app.router.add_post('/push', push)
+    server = loop.run_until_complete(aiohttp_server(stub_app))
+    return str(server.make_url('/push')), received, state
+
+
+@pytest.fixture
+def pusher(loop, monkeypatch):
+    pusher = Pusher()
+    monkeypatch.setattr(client_action, 'LISTENERS', client_action.LISTENERS + [pusher.on_change])
+    yield pusher
+    loop.run_until_complete(pusher.close())
+
+
+async def received_all(received, count):
+    while sum(len(batch['client_actions']) for batch in received) < count:
+        await asyncio.sleep(0.01)
+
+
+async def test_push_batches(pusher, stub, field):
+    url, received, _ = stub
+    pusher.register(Endpoint(url, ['pushed'], batch_size=3, window=0.01, concurrency=1))
+    cas = [await field(n=n) for n in range(5)]
+    await asyncio.wait_for(received_all(received, 5), 5)
+
+    assert [[ca['args']['n'] for ca in batch['client_actions']] for batch in received] == [[0, 1, 2], [3, 4]]
+    assert all(ca.status == client_action.Status.RUNNING for ca in cas)
+    # Answered under the pushed lease
+    DISPATCHER.check_lease(cas[0], received[0]['lease'])
+    assert pusher.endpoints()[0].as_dict()['pushed'] == 5
+
+
+async def test_push_retry(pusher, stub, field):
+    url, received, state = stub
+    state['fail'] = 2
+    pusher.register(Endpoint(url, ['pushed'], backoff=0.01))
+    await field(n=1)
+    await asyncio.wait_for(received_all(received, 1), 5)
+    assert state['fail'] == 0
+
+
+async def test_push_gives_up(pusher, stub, field):
+    url, received, state = stub
+    state['fail'] = 10
+    endpoint = Endpoint(url, ['pushed'], retries=1, backoff=0.01)
+    pusher.register(endpoint)
+    ca = await field(n=1)
+    while not endpoint.failed:
+        await asyncio.sleep(0.01)
+    # Left to its lease
+    assert ca.status == client_action.Status.RUNNING
+    assert received == []
+
+
+async def test_register_pushes_pending(pusher, stub, field):
+    url, received, _ = stub
+    ca = await field(n=7)
+    pusher.register(Endpoint(url, ['pushed']))
+    await asyncio.wait_for(received_all(received, 1), 5)
+    assert received[0]['client_actions'][0]['id'] == ca.id
+
+
+async def test_push_endpoint_api(loop, aiohttp_client):
+    cli = await aiohttp_client(await app.app_factory(['test_app']))
+    resp = await cli.post('/client_action/push', json={'url': 'http://localhost/push', 'names': []})
+    assert resp.status == web.HTTPBadRequest.status_code
+    resp = await cli.post('/client_action/push', json={
+        'url': 'http://localhost/push', 'names': ['api pushed'], 'batch_size': 0,
+    })
+    assert resp.status == web.HTTPBadRequest.status_code
+
+    resp = await cli.post('/client_action/push', json={
+        'url': 'http://localhost/push', 'names': ['api pushed'], 'batch_size': 10, 'retries': 0,
+    })
+    assert resp.status == web.HTTPOk.status_code
+    assert (await resp.json())['batch_size'] == 10
+    resp = await cli.get('/client_action/push')
+    assert [endpoint['names'] for endpoint in await resp.json()] == [['api pushed']]
+
+    resp = await cli.delete('/client_action/push', params={'url': 'http://localhost/push'})
+    assert resp.status == web.HTTPNoContent.status_code
+    resp = await cli.delete('/client_action/push', params={'url': 'http://localhost/push'})
+    assert resp.status == web.HTTPNotFound.status_code
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+from aiohttp import web
+
+from dno import app
+from dno.rate_limit import LagMonitor, Limit, RateLimiter, TokenBucket
+
+
+CREATE_SERVER_ARGS = {'name': 'server', 'cpu': 1, 'memory': 1024, 'hdd': 10}
+
+
+def test_token_bucket():
+    bucket = TokenBucket(Limit(rate=2, burst=2), 0.0)
+    for _ in range(2):
+        assert bucket.wait(0.0) == 0
+        bucket.take()
+    assert bucket.wait(0.0) == 0.5
+    assert bucket.wait(0.5) == 0
+    # Never more than the burst
+    assert bucket.wait(100.0) == 0
+    assert bucket.tokens == 2
+
+
+def test_check_all_buckets(clock):
+    limiter = RateLimiter(
+        apps={'a': Limit(rate=10)},
+        use_cases={('a', 'Slow'): Limit(rate=1)},
+        callers=Limit(rate=5),
+        max_callers=1,
+        clock=clock,
+    )
+    assert limiter.check('a', 'Slow', 'x') == 0
+    assert limiter.check('a', 'Slow', 'x') == 1.0
+    # Nothing taken from the other buckets by a limited submission
+    assert limiter._buckets['a'].tokens == 9
+
+    assert limiter.check('a', 'Fast', 'y') == 0
+    assert list(limiter._callers) == ['y']
+    assert limiter.limited == 1
+
+
+@pytest.fixture
+def limiter():
+    return RateLimiter(
+        apps={'test_app': Limit(rate=0.1, burst=2)},
+        lag_threshold=0.5,
+        lag_monitor=LagMonitor(interval=60),
+    )
+
+
+@pytest.fixture
+def cli(loop, aiohttp_client, limiter):
+    return loop.run_until_complete(aiohttp_client(loop.run_until_complete(
+        app.app_factory(['test_app'], rate_limiter=limiter)
+    )))
+
+
+async def test_rate_limited(cli):
+    for _ in range(2):
+        resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
+        assert resp.status == web.HTTPOk.status_code
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
+    assert resp.status == web.HTTPTooManyRequests.status_code
+    assert resp.headers['Retry-After'] == '10'
+
+    # Only submissions are limited
+    resp = await cli.get('/test_app/call')
+    assert resp.status == web.HTTPOk.status_code
+
+
+async def test_shed_when_lagging(cli, limiter):
+    limiter.lag_monitor.lag = 2.5
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
+    assert resp.status == web.HTTPServiceUnavailable.status_code
+    assert resp.headers['Retry-After'] == '3'
+    assert limiter.shed == 1
+
+
+async def test_batch_charged_per_item(cli, limiter):
+    body = '\n'.join(json.dumps(CREATE_SERVER_ARGS) for _ in range(3)) + '\n'
+    resp = await cli.post('/test_app/call/CreateServer/batch', data=body)
+    assert resp.status == web.HTTPOk.status_code
+    items = [json.loads(line) for line in (await resp.text()).splitlines()]
+    assert [item['line'] for item in items] == [1, 2, 3]
+    assert 'id' in items[0] and 'id' in items[1]
+    assert items[2]['error'] == 'Rate limit exceeded'
+    assert items[2]['retry_after'] == 10
+
+    # The bucket is empty for single submissions too
+    resp = await cli.post('/test_app/call/CreateServer', json=CREATE_SERVER_ARGS)
+    assert resp.status == web.HTTPTooManyRequests.status_code
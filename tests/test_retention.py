@@ -0,0 +1,114 @@
+import pytest
+from pydantic import BaseModel
+
+from dno import app, client_action, retention, use_case
+
+
+class Result(BaseModel):
+    n: int
+
+
+class Count(use_case.UseCase):
+    n: int
+
+    result: Result
+
+    action = client_action.ClientActionField(
+        name='count',
+        args=client_action.BaseModel,
+        result=client_action.BaseModel,
+    )
+
+    async def run(self):
+        await self.action()
+        return {'n': self.n}
+
+
+async def finished_use_cases(policy, count):
+    use_cases = []
+    for n in range(count):
+        uc = Count(n=n)
+        use_case.RUNNING_TASKS[uc.id] = uc
+        await uc.execute()
+        policy.on_change(uc)
+        use_cases.append(uc)
+    return use_cases
+
+
+async def test_max_count(loop, clock):
+    policy = retention.Retention(max_count=2, batch=2, clock=clock)
+    use_cases = await finished_use_cases(policy, 5)
+
+    assert await policy.evict() == 2
+    assert await policy.evict() == 1
+    assert await policy.evict() == 0
+    assert [uc.id in use_case.RUNNING_TASKS for uc in use_cases] == [False, False, False, True, True]
+
+    # Left unfinished by run(): kept until a worker finishes it
+    ca = next(iter(use_cases[0].client_actions.values()))
+    assert await client_action.Storage.get(ca.id) is ca
+    ca.set_running()
+    ca.set_result({})
+    assert await policy.evict() == 0
+    with pytest.raises(KeyError):
+        await client_action.Storage.get(ca.id)
+
+
+async def test_max_age_and_touch(loop, clock):
+    policy = retention.Retention(max_age=10, clock=clock)
+    first, second = await finished_use_cases(policy, 2)
+
+    clock.now = 5
+    policy.touch(first.id)
+    clock.now = 11
+    assert await policy.evict() == 1
+    assert first.id in use_case.RUNNING_TASKS
+    assert second.id not in use_case.RUNNING_TASKS
+
+
+async def test_archive(loop, clock, tmp_path):
+    archive = retention.Archive(str(tmp_path / 'archive.sqlite'))
+    policy = retention.Retention(max_count=0, archive=archive, clock=clock)
+    uc, = await finished_use_cases(policy, 1)
+    ca_id = next(iter(uc.client_actions))
+
+    assert await policy.evict() == 1
+    task = await policy.get_archived('task', uc.id)
+    assert task['status'] == 'DONE'
+    assert task['result'] == {'n': 0}
+    assert (await policy.get_archived('client_action', ca_id))['status'] == 'PENDING'
+    assert await policy.get_archived('task', 'no_task') is None
+    await archive.close()
+
+
+async def test_archived_client_action_answered(loop, aiohttp_client, clock, tmp_path):
+    archive = retention.Archive(str(tmp_path / 'archive.sqlite'))
+    policy = retention.Retention(max_count=0, archive=archive, clock=clock)
+    uc, = await finished_use_cases(policy, 1)
+    ca_id = next(iter(uc.client_actions))
+    assert await policy.evict() == 1
+
+    cli = await aiohttp_client(await app.app_factory(['test_app'], retention=policy))
+    uc.client_actions[ca_id].set_running()
+    resp = await cli.post('/client_action/batch', json=[{'id': ca_id, 'error': {}}])
+    assert await resp.json() == [{'id': ca_id, 'status': 'ERROR'}]
+
+    # Archived once finished
+    assert await policy.evict() == 0
+    resp = await cli.post('/client_action/batch', json=[{'id': ca_id, 'result': {}}, {'id': 'no_client_action'}])
+    assert await resp.json() == [
+        {'id': ca_id, 'error': 'Client action was evicted as ERROR'},
+        {'id': 'no_client_action', 'error': 'Not found'},
+    ]
+    await archive.close()
+
+
+async def test_shared_client_action_kept(loop, clock):
+    policy = retention.Retention(max_count=0, clock=clock)
+    uc, = await finished_use_cases(policy, 1)
+    ca = next(iter(uc.client_actions.values()))
+    # Another task got it from a field cache and still waits on it
+    ca.holders = {uc.id, 'other'}
+
+    assert await policy.evict() == 1
+    assert await client_action.Storage.get(ca.id) is ca
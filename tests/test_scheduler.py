@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from dno import scheduler, use_case
+
+
+class Result(BaseModel):
+    n: int
+
+
+class Gate(use_case.UseCase):
+    n: int
+
+    result: Result
+
+    started = []
+    gate = None
+
+    async def run(self):
+        self.started.append(self.n)
+        await self.gate.wait()
+        return {'n': self.n}
+
+
+class LimitedGate(Gate):
+    n: int
+
+    result: Result
+
+    max_concurrency = 1
+
+
+@pytest.fixture()
+async def gate(loop):
+    Gate.started = []
+    Gate.gate = asyncio.Event()
+    yield Gate.gate
+    # Every use case started or queued runs to the end before the loop closes
+    Gate.gate.set()
+    while True:
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        if not pending:
+            break
+        await asyncio.gather(*pending)
+
+
+async def test_limit_and_priority(gate, settle):
+    s = scheduler.Scheduler(limit=1)
+    for n, priority in [(1, 0), (2, 0), (3, 5)]:
+        await Gate(n=n).start(s, priority)
+    await settle()
+
+    assert Gate.started == [1]
+    assert s.running() == 1
+    assert s.queue_depth() == 2
+
+    gate.set()
+    await settle()
+    assert Gate.started == [1, 3, 2]
+    assert s.stats()['started'] == 3
+
+
+async def test_max_concurrency(gate, settle):
+    s = scheduler.Scheduler()
+    for n in range(3):
+        await LimitedGate(n=n).start(s)
+    await Gate(n=10).start(s)
+    await settle()
+
+    assert Gate.started == [0, 10]
+    assert s.queue_depth() == 2
+
+
+async def test_queue_full(gate):
+    s = scheduler.Scheduler(limit=1, max_queue=1)
+    await Gate(n=1).start(s)
+    await Gate(n=2).start(s)
+
+    uc = Gate(n=3)
+    with pytest.raises(scheduler.QueueFull):
+        await uc.start(s)
+    assert uc.id not in use_case.RUNNING_TASKS
+
+
+async def test_result_and_error(gate, settle):
+    s = scheduler.Scheduler()
+    gate.set()
+    ok = Gate(n=1)
+    await ok.start(s)
+    failed = Gate(n=2)
+    failed.run = lambda: asyncio.sleep(0, {'n': 'not a number'})
+    await failed.start(s)
+    await settle()
+
+    assert ok.status == use_case.Status.FINISHED
+    assert ok.result == Result(n=1)
+    assert failed.status == use_case.Status.FAILED
+    assert failed.error['type'] == 'ValidationError'
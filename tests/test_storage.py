@@ -0,0 +1,149 @@
+import asyncio
+import sqlite3
+from uuid import uuid4
+
+import pytest
+
+from dno import app, client_action
+from dno.sqlite_storage import SQLiteStorage
+
+
+def new_client_action(name='test_client_action', task_id=None):
+    return client_action.ClientAction(name, uuid4().hex, {'a': 1}, client_action.Status.PENDING, task_id=task_id)
+
+
+@pytest.fixture()
+async def sqlite_storage(loop, tmp_path):
+    backend = SQLiteStorage(str(tmp_path / 'dno.sqlite'))
+    previous = client_action.Storage.set_backend(backend)
+    yield backend
+    client_action.Storage.set_backend(previous)
+    await backend.close()
+
+
+class TestMemoryStorage:
+    async def test_find(self, loop):
+        backend = client_action.MemoryStorage()
+        first, second = new_client_action('first'), new_client_action('second')
+        await backend.add(first)
+        await backend.add(second)
+        first.set_running()
+
+        assert await backend.find(status=client_action.Status.RUNNING) == [first]
+        assert await backend.find(name='second') == [second]
+        assert len(await backend.find(limit=1)) == 1
+
+
+class TestSQLiteStorage:
+    async def test_add_get(self, sqlite_storage):
+        ca = new_client_action()
+        await client_action.Storage.add(ca)
+        assert await client_action.Storage.get(ca.id) is ca
+
+    async def test_persisted(self, sqlite_storage, tmp_path):
+        ca = new_client_action(task_id='task')
+        await client_action.Storage.add(ca)
+        ca.set_running()
+        ca.set_result({'test': 'result'})
+        await sqlite_storage.flush()
+
+        reopened = SQLiteStorage(str(tmp_path / 'dno.sqlite'))
+        try:
+            stored = await reopened.get(ca.id)
+        finally:
+            await reopened.close()
+        assert stored.status == client_action.Status.DONE
+        assert stored.args == {'a': 1}
+        assert stored.result == {'test': 'result'}
+        assert stored.task_id == 'task'
+
+    async def test_task_id_added(self, loop, tmp_path):
+        path = str(tmp_path / 'old.sqlite')
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute(
+                'CREATE TABLE client_action (id TEXT PRIMARY KEY, name TEXT NOT NULL, status TEXT NOT NULL, '
+                'args TEXT NOT NULL, result TEXT, error TEXT)'
+            )
+            connection.execute("INSERT INTO client_action VALUES ('old', 'x', 'DONE', '{}', '{}', NULL)")
+        connection.close()
+
+        backend = SQLiteStorage(path)
+        try:
+            ca = new_client_action(task_id='task')
+            await backend.add(ca)
+            await backend.flush()
+            assert (await backend.get('old')).task_id is None
+            assert backend._connection.execute(
+                'SELECT task_id FROM client_action WHERE id = ?', (ca.id,)
+            ).fetchone() == ('task',)
+        finally:
+            await backend.close()
+
+    async def test_delete(self, sqlite_storage):
+        ca = new_client_action()
+        await client_action.Storage.add(ca)
+        await client_action.Storage.delete(ca.id)
+        with pytest.raises(KeyError):
+            await client_action.Storage.get(ca.id)
+        with pytest.raises(KeyError):
+            await client_action.Storage.delete(ca.id)
+
+    async def test_find(self, sqlite_storage):
+        first, second = new_client_action('first'), new_client_action('second')
+        await client_action.Storage.add(first)
+        await client_action.Storage.add(second)
+        second.set_running()
+
+        assert await client_action.Storage.find(status=client_action.Status.PENDING) == [first]
+        assert await client_action.Storage.find(name='second', status=client_action.Status.RUNNING) == [second]
+
+    async def test_batched_writes(self, sqlite_storage):
+        transactions = []
+        execute_write = sqlite_storage._execute_write
+
+        def counting_execute_write(upserts, deletes):
+            transactions.append(len(upserts))
+            execute_write(upserts, deletes)
+
+        sqlite_storage._execute_write = counting_execute_write
+        field = client_action.ClientActionField(
+            name='batched',
+            args=client_action.BaseModel,
+            result=client_action.BaseModel,
+        )
+        client_actions = await asyncio.gather(*(field() for _ in range(100)))
+
+        assert sum(transactions) == 100
+        assert len(transactions) < 100
+        for ca in client_actions:
+            assert await client_action.Storage.get(ca.id) is ca
+
+    async def test_failed_write_retried(self, sqlite_storage):
+        execute_write = sqlite_storage._execute_write
+
+        def failing_execute_write(upserts, deletes):
+            raise sqlite3.OperationalError('disk I/O error')
+
+        sqlite_storage._execute_write = failing_execute_write
+        ca = new_client_action()
+        with pytest.raises(sqlite3.OperationalError):
+            await client_action.Storage.add(ca)
+        ca.set_running()
+        ca.set_result({'test': 'result'})
+
+        sqlite_storage._execute_write = execute_write
+        await sqlite_storage.flush()
+        assert sqlite_storage._connection.execute(
+            'SELECT status FROM client_action WHERE id = ?', (ca.id,)
+        ).fetchone() == ('DONE',)
+
+
+async def test_app_storage(loop, aiohttp_client, tmp_path):
+    backend = SQLiteStorage(str(tmp_path / 'dno.sqlite'))
+    previous = client_action.Storage.get_backend()
+    client = await aiohttp_client(await app.app_factory(['test_app'], storage=backend))
+    assert client_action.Storage.get_backend() is backend
+
+    await client.close()
+    assert client_action.Storage.get_backend() is previous
@@ -0,0 +1,90 @@
+import pytest
+from pydantic import BaseModel
+
+from dno import task_index, use_case
+from dno.use_case import Status
+
+
+class Result(BaseModel):
+    n: int
+
+
+class Index(use_case.UseCase):
+    domain_app = 'index_app'
+
+    n: int
+
+    result: Result
+
+    async def run(self):
+        return {'n': self.n}
+
+
+class Other(Index):
+    domain_app = 'index_app'
+
+    result: Result
+
+
+@pytest.fixture()
+def index(clock):
+    # Every task is created a second after the previous one
+    clock.step = 1
+    return task_index.TaskIndex(clock=clock)
+
+
+def add(index, cls, n, status=Status.PENDING):
+    uc = cls(n=n)
+    uc.status = status
+    index.on_change(uc)
+    return uc
+
+
+def test_newest_first(index):
+    ucs = [add(index, Index, n) for n in range(5)]
+    ids, cursor = index.query('index_app')
+    assert ids == [uc.id for uc in reversed(ucs)]
+    assert cursor is None
+    assert index.query('other_app') == ([], None)
+
+
+def test_pages(index):
+    ucs = [add(index, Index, n) for n in range(5)]
+    ids, cursor = index.query('index_app', limit=2)
+    assert ids == [ucs[4].id, ucs[3].id]
+
+    # Tasks started later don't shift the pages
+    add(index, Index, 5)
+    ids, cursor = index.query('index_app', cursor=cursor, limit=2)
+    assert ids == [ucs[2].id, ucs[1].id]
+    ids, cursor = index.query('index_app', cursor=cursor, limit=2)
+    assert ids == [ucs[0].id]
+    assert cursor is None
+
+
+def test_filters(index):
+    first = add(index, Index, 0)
+    other = add(index, Other, 1)
+    second = add(index, Index, 2)
+
+    assert index.query('index_app', use_case='Other')[0] == [other.id]
+
+    second.status = Status.RUNNING
+    index.on_change(second)
+    assert index.query('index_app', status=Status.PENDING)[0] == [other.id, first.id]
+    assert index.query('index_app', use_case='Index', status=Status.RUNNING)[0] == [second.id]
+    assert index.query('index_app', use_case='Index', status=Status.FINISHED)[0] == []
+
+    # Created at 1, 2 and 3
+    assert index.query('index_app', created_after=1, created_before=3)[0] == [other.id]
+    assert index.query('index_app', created_after=3)[0] == []
+
+
+def test_remove(index):
+    first = add(index, Index, 0)
+    second = add(index, Index, 1)
+    index.remove(first.id)
+    index.remove(first.id)
+    assert len(index) == 1
+    assert index.query('index_app')[0] == [second.id]
+    assert index.query('index_app', use_case='Index', status=Status.PENDING)[0] == [second.id]
@@ -0,0 +1,97 @@
+import pytest
+
+from dno.timers import TimerWheel
+
+
+@pytest.fixture
+def wheel(loop, clock):
+    return TimerWheel(tick=1, slots=4, levels=2, clock=clock)
+
+
+def test_bad_slots():
+    with pytest.raises(ValueError):
+        TimerWheel(slots=6)
+
+
+def test_fire_in_order(wheel, clock):
+    fired = []
+    for delay in (3, 1, 9, 2, 5):
+        wheel.call_later(delay, lambda delay=delay: fired.append(delay))
+    assert len(wheel) == 5
+
+    for now in range(1, 11):
+        clock.now = now
+        wheel.advance()
+        # Never early, and on the tick it's due
+        assert fired == sorted(delay for delay in (3, 1, 9, 2, 5) if delay <= now)
+    assert len(wheel) == 0
+
+
+def test_cancel(wheel, clock):
+    fired = []
+    timer = wheel.call_later(2, lambda: fired.append(2))
+    wheel.call_later(3, lambda: fired.append(3))
+    timer.cancel()
+    timer.cancel()
+    assert len(wheel) == 1
+
+    clock.now = 5
+    assert wheel.advance() == 1
+    assert fired == [3]
+
+
+def test_beyond_reach(wheel, clock):
+    # Two levels of four slots reach 16 ticks
+    fired = []
+    wheel.call_later(40, lambda: fired.append(40))
+    for now in range(1, 41):
+        clock.now = now
+        wheel.advance()
+        assert fired == ([40] if now >= 40 else [])
+
+
+def test_callback_error(wheel, clock):
+    fired = []
+    wheel.call_later(1, lambda: 1 / 0)
+    wheel.call_later(1, lambda: fired.append(1))
+    clock.now = 1
+    assert wheel.advance() == 2
+    assert fired == [1]
+
+
+async def test_driven_by_loop(loop):
+    wheel = TimerWheel(tick=0.01)
+    fired = loop.create_future()
+    wheel.call_later(0.02, lambda: fired.set_result(True))
+    assert await fired
+    assert len(wheel) == 0
+
+
+def test_idle(wheel, clock):
+    fired = []
+    wheel.call_later(1, lambda: fired.append(1))
+    clock.now = 1
+    wheel.advance()
+    wheel._handle.cancel()
+    wheel._handle = None
+
+    # A day later the wheel starts from now, not from the last tick
+    clock.now = 86400
+    wheel.call_later(2, lambda: fired.append(2))
+    assert wheel._current == 86400
+    clock.now = 86402
+    wheel.advance()
+    assert fired == [1, 2]
+
+
+def test_cancelled_dropped(wheel, clock):
+    timers = [wheel.call_later(3, lambda: None) for _ in range(1000)]
+    for timer in timers:
+        timer.cancel()
+    assert timers[0].callback is None
+    assert len(wheel) == 0
+
+    clock.now = 1
+    wheel.advance()
+    assert wheel._stored == 0
+    assert not any(slot for level in wheel._wheels for slot in level)
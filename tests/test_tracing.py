@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+from aiohttp import web
+from pydantic import BaseModel
+
+from dno import app, client_action, tracing, use_case
+
+
+class StepModel(BaseModel):
+    n: int
+
+
+class Traced(use_case.UseCase):
+    domain_app = 'test_app'
+
+    n: int
+
+    result: StepModel
+
+    step = client_action.ClientActionField(
+        name='traced step',
+        args=StepModel,
+        result=StepModel,
+    )
+
+    async def run(self):
+        ca = await self.step(n=self.n)
+        await ca.wait()
+        return ca.result
+
+
+def test_not_sampled():
+    tracer = tracing.Tracer(sample_rate=0.5, exporter=tracing.MemoryExporter(), random=lambda: 0.9)
+    root = tracer.start_span('root')
+    assert root is tracing.NOT_SAMPLED
+    assert tracer.start_span('child', parent=root) is tracing.NOT_SAMPLED
+
+    tracer._random = lambda: 0.1
+    root = tracer.start_span('root')
+    child = tracer.start_span('child', parent=root)
+    assert (child.trace_id, child.parent_id) == (root.trace_id, root.span_id)
+
+    # Disabled without an exporter
+    assert tracing.Tracer(sample_rate=1.0).start_span('root') is tracing.NOT_SAMPLED
+
+
+async def test_batches(loop, tmp_path):
+    exporter = tracing.FileExporter(str(tmp_path / 'spans.jsonl'))
+    tracer = tracing.Tracer(sample_rate=1.0, exporter=exporter, batch_size=2, max_queue=3)
+    for name in ('first', 'second'):
+        tracer.start_span(name, parent=None).finish()
+    await asyncio.sleep(0.1)
+    for name in ('third', 'fourth', 'fifth', 'sixth'):
+        tracer.start_span(name, parent=None).finish()
+    await tracer.flush()
+    await exporter.close()
+
+    with open(tmp_path / 'spans.jsonl') as f:
+        names = [json.loads(line)['name'] for line in f]
+    # The batch of two went out on its own; the rest waited for flush()
+    assert names[:2] == ['first', 'second']
+    assert len(names) + tracer.dropped == 6
+
+
+async def test_use_case_trace(loop, aiohttp_client):
+    exporter = tracing.MemoryExporter()
+    cli = await aiohttp_client(await app.app_factory(['test_app'], trace_sample_rate=1.0, trace_exporter=exporter))
+    try:
+        resp = await cli.post('/test_app/call/Traced', json={'n': 1})
+        assert resp.status == web.HTTPOk.status_code
+        task_id = (await resp.json())['id']
+        await asyncio.sleep(0.01)
+
+        uc = use_case.RUNNING_TASKS[task_id]
+        ca = next(iter(uc.client_actions.values()))
+        ca.set_running()
+        ca.set_result({'n': 2})
+        await asyncio.sleep(0.01)
+    finally:
+        await cli.close()
+
+    spans = {span['name']: span for span in exporter.spans}
+    request = spans['POST /test_app/call/{use_case}']
+    run = spans['use_case test_app.Traced']
+    step = spans['client_action traced step']
+    assert request['parent_id'] is None
+    assert run['parent_id'] == request['span_id']
+    assert step['parent_id'] == run['span_id']
+    assert {span['trace_id'] for span in (request, run, step)} == {request['trace_id']}
+    assert [event['name'] for event in step['events']] == ['wait', 'RUNNING', 'DONE']
+    assert run['attributes']['task.id'] == task_id
+    assert tracing.TRACER.sample_rate == 0.0
@@ -1,9 +1,12 @@
 import asyncio
-from typing import Dict
+from typing import Dict, List
 
-from pydantic import BaseModel
+import pytest
+from pydantic import BaseModel, ValidationError
 
 from dno import client_action, use_case
+from dno.scheduler import Scheduler
+from dno.timers import TimerWheel
 
 
 class ClientActionArgsBaseModel(BaseModel):
@@ -54,3 +57,253 @@ async def test():
     result = await uc.run()
 
     assert result == {'a': '500', 'b': {'x': 5, 'y': 1}}
+
+
+class GenericUseCase(use_case.UseCase):
+    ids: List[int]
+    tags: Dict[str, str] = {}
+
+    result: ReturnBaseModel
+
+    async def run(self):
+        pass
+
+
+class InheritedUseCase(GenericUseCase):
+    name: str
+
+    result: ReturnBaseModel
+
+
+def test_generic_arguments():
+    uc = GenericUseCase(ids=[1, 2])
+    assert uc.ids == [1, 2]
+    assert uc.tags == {}
+
+
+def test_inherited_arguments():
+    uc = InheritedUseCase(ids=[1], name='x')
+    assert uc.ids == [1]
+    assert uc.name == 'x'
+
+
+@pytest.mark.parametrize('kwargs, error_type', [
+    ({}, 'value_error.missing'),
+    ({'ids': 'abc'}, 'type_error.list'),
+    ({'ids': [1], 'unknown': 1}, 'value_error.extra'),
+])
+def test_bad_arguments(kwargs, error_type):
+    with pytest.raises(ValidationError) as e:
+        GenericUseCase(**kwargs)
+    assert e.value.errors()[0]['type'] == error_type
+
+
+def test_framework_attributes_not_defaults():
+    class Reboot(use_case.UseCase):
+        domain_app = 'reboot_app'
+        force: bool
+
+        result: ReturnBaseModel
+
+        async def run(self):
+            pass
+
+    with pytest.raises(ValidationError):
+        Reboot()
+
+
+@pytest.mark.parametrize('name', ['timeout', 'priority', 'calls', 'run'])
+def test_reserved_argument_names(name):
+    with pytest.raises(Exception, match='clash'):
+        type('Clashing', (use_case.UseCase,), {
+            '__module__': 'clash_app.use_cases',
+            '__annotations__': {name: int, 'result': ReturnBaseModel},
+            'run': GenericUseCase.run,
+        })
+
+
+async def test_client_action_field_not_mutated():
+    field = DummyUseCase.xx
+    await field(x=1, y=1.0, z='z')
+    assert field.args is ClientActionArgsBaseModel
+    assert field.result is ClientActionReturnBaseModel
+
+
+def test_registered_by_domain_app():
+    assert use_case.REGISTERED['tests']['DummyUseCase'] is DummyUseCase
+    assert DummyUseCase.domain_app == 'tests'
+    assert 'DummyUseCase' not in use_case.REGISTERED.get('test_app', {})
+
+
+class WaitingUseCase(use_case.UseCase):
+    xx = DummyUseCase.xx
+    result: ReturnBaseModel
+
+    async def run(self):
+        ca = await self.xx(x=1, y=1.0, z='z')
+        await ca.wait()
+        return ca.result
+
+
+@pytest.fixture
+def timers(loop, monkeypatch):
+    wheel = TimerWheel(tick=0.01)
+    monkeypatch.setattr(use_case, 'TIMERS', wheel)
+    monkeypatch.setattr(client_action, 'TIMERS', wheel)
+    return wheel
+
+
+async def test_cancel_queued(loop):
+    uc = WaitingUseCase()
+    await uc.start(Scheduler(limit=0))
+    assert uc.cancel()
+    assert uc.status == use_case.Status.FAILED
+    assert uc.error == {'type': 'Cancelled', 'message': 'Cancelled'}
+    assert not uc.cancel()
+
+    # Never run when it gets its turn
+    await uc.execute()
+    assert uc.client_actions == {}
+
+
+async def test_cancel_running(loop, settle):
+    uc = WaitingUseCase()
+    await uc.start()
+    await settle()
+    assert uc.status == use_case.Status.RUNNING
+    (ca,) = uc.client_actions.values()
+
+    assert uc.cancel('Stop', 'Stopped by hand')
+    assert ca.status == client_action.Status.ERROR
+    assert ca.error == {'type': 'Stop', 'message': 'Stopped by hand'}
+    await settle()
+    assert uc.status == use_case.Status.FAILED
+    assert uc.error == {'type': 'Stop', 'message': 'Stopped by hand'}
+    assert not uc.cancel()
+
+
+async def test_use_case_timeout(loop, timers):
+    uc = WaitingUseCase()
+    await uc.start(timeout=0.02)
+    for _ in range(100):
+        if uc.is_finished():
+            break
+        await asyncio.sleep(0.01)
+    assert uc.status == use_case.Status.FAILED
+    assert uc.error['type'] == 'Timeout'
+    assert len(timers) == 0
+
+
+async def test_use_case_finished_before_timeout(loop, timers, settle):
+    uc = DummyUseCase(a=1, b=1.0)
+    await uc.start(timeout=10)
+    await settle()
+    assert uc.status == use_case.Status.FINISHED
+    # The deadline is dropped with it
+    assert len(timers) == 0
+
+
+async def test_client_action_timeout(loop, timers):
+    field = client_action.ClientActionField(
+        name='xx with timeout',
+        args=ClientActionArgsBaseModel,
+        result=ClientActionReturnBaseModel,
+        timeout=0.02,
+    )
+    ca = await field(x=1, y=1.0, z='z')
+    ca.set_running()
+    await asyncio.wait_for(ca.wait(), 1)
+    assert ca.status == client_action.Status.ERROR
+    assert ca.error['type'] == 'Timeout'
+    with pytest.raises(client_action.UnexpectedStatus):
+        ca.abort({})
+
+
+class LeavingUseCase(use_case.UseCase):
+    xx = DummyUseCase.xx
+    result: ReturnBaseModel
+
+    async def run(self):
+        await self.xx(x=1, y=1.0, z='z')
+        raise ValueError('Gave up')
+
+
+async def test_failed_run_aborts_client_actions(loop):
+    uc = LeavingUseCase()
+    await uc.execute()
+    assert uc.status == use_case.Status.FAILED
+    (ca,) = uc.client_actions.values()
+    assert ca.status == client_action.Status.ERROR
+    assert ca.error == {'type': 'ValueError', 'message': 'Gave up'}
+
+
+class SharingUseCase(use_case.UseCase):
+    xx = client_action.ClientActionField(
+        name='shared_xx',
+        args=ClientActionArgsBaseModel,
+        result=ClientActionReturnBaseModel,
+        cache_ttl=10,
+    )
+    x: int
+    result: ReturnBaseModel
+
+    async def run(self):
+        ca = await self.xx(x=self.x, y=1.0, z='z')
+        await ca.wait()
+        return {'a': ca.status.value, 'b': {}}
+
+
+async def test_cancel_keeps_shared_client_actions(loop, settle):
+    first, second = SharingUseCase(x=1), SharingUseCase(x=1)
+    tasks = [asyncio.ensure_future(first.execute()), asyncio.ensure_future(second.execute())]
+    await settle()
+    (ca,) = first.client_actions.values()
+    assert list(second.client_actions.values()) == [ca]
+
+    # The issuer goes, the other task still waits on it
+    first.cancel()
+    await tasks[0]
+    assert ca.status == client_action.Status.PENDING
+
+    ca.set_running()
+    ca.set_result({'a': 'a', 'b': {}})
+    await tasks[1]
+    assert second.result.a == 'DONE'
+
+
+async def test_cancel_aborts_released_client_actions(loop, settle):
+    first, second = SharingUseCase(x=2), SharingUseCase(x=2)
+    tasks = [asyncio.ensure_future(first.execute()), asyncio.ensure_future(second.execute())]
+    await settle()
+    (ca,) = first.client_actions.values()
+
+    second.cancel()
+    await tasks[1]
+    assert ca.status == client_action.Status.PENDING
+
+    # Nobody else waits on it now
+    first.cancel('Timeout', 'Too slow')
+    await tasks[0]
+    assert ca.status == client_action.Status.ERROR
+    assert ca.error == {'type': 'Timeout', 'message': 'Too slow'}
+
+
+class FailingSharingUseCase(use_case.UseCase):
+    xx = SharingUseCase.xx
+    result: ReturnBaseModel
+
+    async def run(self):
+        await self.xx(x=3, y=1.0, z='z')
+        raise ValueError('boom')
+
+
+async def test_failed_client_action_not_coalesced(loop):
+    failing = FailingSharingUseCase()
+    await failing.execute()
+    (failed,) = failing.client_actions.values()
+    assert failed.status == client_action.Status.ERROR
+
+    # In the same loop turn, before the field has seen it finish
+    ca = await SharingUseCase.xx(x=3, y=1.0, z='z')
+    assert ca is not failed
+    assert ca.status == client_action.Status.PENDING
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from aiohttp import web
+from pydantic import BaseModel
+
+from dno import app, use_case
+from dno.watchdog import Watchdog
+
+
+class Nothing(BaseModel):
+    pass
+
+
+class Blocking(use_case.UseCase):
+    seconds: float
+
+    result: Nothing
+
+    async def run(self):
+        time.sleep(self.seconds)
+        return Nothing()
+
+
+async def test_watchdog(loop, aiohttp_client):
+    watchdog = Watchdog(threshold=0.05, interval=0.01)
+    cli = await aiohttp_client(await app.app_factory(['test_app'], watchdog=watchdog))
+
+    uc = Blocking(seconds=0.3)
+    await uc.start()
+    await asyncio.sleep(0.05)
+    assert uc.status == use_case.Status.FINISHED
+
+    resp = await cli.get('/watchdog')
+    assert resp.status == web.HTTPOk.status_code
+    (stall,) = await resp.json()
+    assert stall['use_case'] == 'Blocking'
+    assert stall['task_id'] == uc.id
+    assert stall['duration'] >= 0.2
+    assert 'time.sleep(self.seconds)' in stall['stack'][-1]
+
+    resp = await cli.get('/metrics')
+    assert 'dno_loop_lag_seconds_bucket{le="0.25"}' in await resp.text()
+
+
+async def test_watchdog_quiet(loop):
+    watchdog = Watchdog(threshold=0.05, interval=0.01)
+    watchdog.start()
+    try:
+        await asyncio.sleep(0.1)
+    finally:
+        watchdog.stop()
+    assert not watchdog.stalls
+    assert watchdog._lag.count > 0
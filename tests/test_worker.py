@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from dno import app, client_action, use_case
+from dno.worker import Worker, WorkerError
+
+
+class TextModel(BaseModel):
+    text: str
+
+
+class Shout(use_case.UseCase):
+    text: str
+
+    result: TextModel
+
+    shout = client_action.ClientActionField(
+        name='shout',
+        args=TextModel,
+        result=TextModel,
+    )
+
+    async def run(self):
+        ca = await self.shout(text=self.text)
+        await ca.wait()
+        return ca.result
+
+
+@pytest.fixture
+def url(loop, aiohttp_client):
+    cli = loop.run_until_complete(aiohttp_client(loop.run_until_complete(app.app_factory(['test_app']))))
+    return str(cli.make_url(''))
+
+
+async def start(texts):
+    use_cases = [Shout(text=text) for text in texts]
+    for uc in use_cases:
+        await uc.start()
+    return use_cases
+
+
+async def finished(use_cases):
+    while not all(uc.is_finished() for uc in use_cases):
+        await asyncio.sleep(0.01)
+
+
+async def test_worker(url):
+    async def shout(args):
+        if args['text'] == 'fail':
+            raise ValueError('Can\'t shout')
+        return TextModel(text=args['text'].upper())
+
+    worker = Worker(url, {'shout': shout}, prefetch=4, idle_delay=0.01)
+    use_cases = await start(['a', 'b', 'fail'] + [str(n) for n in range(20)])
+    running = asyncio.ensure_future(worker.run())
+    await asyncio.wait_for(finished(use_cases), 5)
+    worker.stop()
+    await asyncio.wait_for(running, 5)
+
+    assert use_cases[0].status == use_case.Status.FINISHED
+    assert use_cases[0].result == TextModel(text='A')
+    assert use_cases[2].status == use_case.Status.FAILED
+    (ca,) = use_cases[2].client_actions.values()
+    assert ca.error == {'type': 'ValueError', 'message': 'Can\'t shout'}
+    assert worker.handled == 22
+    assert worker.failed == 1
+
+
+async def test_worker_prefetch(url):
+    release = asyncio.Event()
+    busy = []
+
+    worker = Worker(url, prefetch=3, concurrency=2, idle_delay=0.01)
+
+    @worker.handler('shout')
+    async def shout(args):
+        busy.append(args['text'])
+        await release.wait()
+        return args
+
+    use_cases = await start([str(n) for n in range(5)])
+    running = asyncio.ensure_future(worker.run())
+    await asyncio.sleep(0.1)
+    # Three claimed, two of them handled at once
+    assert len(busy) == 2
+    claimed = [uc for uc in use_cases if list(uc.client_actions.values())[0].status == client_action.Status.RUNNING]
+    assert len(claimed) == 3
+
+    release.set()
+    await asyncio.wait_for(finished(use_cases), 5)
+    worker.stop()
+    await asyncio.wait_for(running, 5)
+    assert [uc.result.text for uc in use_cases] == [str(n) for n in range(5)]
+
+
+async def test_worker_no_handlers(loop):
+    with pytest.raises(WorkerError):
+        await Worker('http://localhost').run()